@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Single-pass ABC notation parser.
+One compiled pattern tokenizes a whole tune in a single left-to-right scan;
+each token is handled once, so parsing is linear in the length of the text.
+Handles repeats and first/second endings, chords, ties, rests, tuplets,
+broken rhythm, key signatures with bar-scoped accidentals and multiple
+voices (V:). Every voice comes out as its own event stream.
+"""
+
+import re
+from itertools import accumulate, compress
+
+# Whitespace, chord symbols, decorations, grace notes and comments carry no
+# timing; they are swallowed in front of the next token instead of being
+# tokens of their own. The alternatives are then tried in order: field lines
+# first so that 'C:' or 'K:' is not read as a note, then the most frequent.
+_TOKEN = re.compile(r"""
+    (?:[ \t\r\n]|"[^"\n]*"|![^!\n]*!|\+[^+\n]*\+|\{[^}\n]*\}|%[^\n]*)*
+    (
+      ^[A-Za-z]:[^\n]*                                      # Field line
+    | (?:\^\^|\^|__|_|=)?[A-Ga-g][,']*\d*/*\d*(?:-|[<>]+)?   # Note, maybe tied or dotted
+    | (?:\[\||:*\|+\]?:*|::)\d?                             # Bar line, repeat, ending
+    | \[[A-Za-z]:[^\]\n]*\]                                 # Inline field
+    | \[(?:[\^_=]*[A-Ga-g][,']*\d*/*\d*-?\s*)+\]\d*/*\d*     # Chord
+    | [zx]\d*/*\d*                                          # Rest
+    | \[\d                                                  # Ending after a space
+    | [<>]+                                                 # Broken rhythm
+    | -                                                     # Tie
+    | \(\d(?::\d*){0,2}                                      # Tuplet
+    | Z\d*                                                  # Multi-measure rest
+    | .                                                     # Anything else, ignored
+    )
+""", re.VERBOSE | re.MULTILINE)
+
+_NOTE = re.compile(r"(\^\^|\^|__|_|=)?([A-Ga-g])([,']*)(\d*/*\d*)")
+_LENGTH = re.compile(r'(\d*)(/*)(\d*)')
+_KEY = re.compile(r'([A-G])([#b]?)\s*([A-Za-z]*)')
+
+_STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_ACCIDENTALS = {'^^': 2, '^': 1, '__': -2, '_': -1, '=': 0}
+
+# Key signatures: tonic position on the circle of fifths and mode offsets
+_FIFTHS = {'F': -1, 'C': 0, 'G': 1, 'D': 2, 'A': 3, 'E': 4, 'B': 5}
+_MODES = {'': 0, 'maj': 0, 'ion': 0, 'mix': -1, 'dor': -2, 'm': -3, 'min': -3, 'aeo': -3,
+          'phr': -4, 'loc': -5, 'lyd': 1}
+_SHARP_ORDER = 'FCGDAEB'
+
+# Default tuplet spans: (p notes in the time of q)
+_TUPLET_TIME = {2: 3, 3: 2, 4: 3, 6: 2, 8: 3}
+
+# Parsed note and chord tokens; the same few spellings repeat throughout a score
+_note_tokens = {}
+_chord_tokens = {}
+# Note token -> (pitch, length, tie or broken-rhythm suffix) for notes without
+# accidentals; one table per key signature and unit length
+_plain_notes = {}
+
+_LETTERS = 'ABCDEFGabcdefg'
+REST = -1  # Pitch of an event that only moves the cursor
+
+def length_multiplier(text):
+    """Length factor of an ABC length suffix: '' -> 1, '3' -> 3, '/' -> 1/2, '3/2' -> 1.5, '//' -> 1/4."""
+    numerator, slashes, denominator = _LENGTH.fullmatch(text).groups()
+    value = int(numerator) if numerator else 1
+    if denominator:
+        return value / int(denominator)
+    return value / 2 ** len(slashes)
+
+def _fraction(text, default=None):
+    """Value of '3/8', '1/4' or '2'; default if text is not a number."""
+    numerator, _, denominator = text.strip().partition('/')
+    try:
+        return int(numerator) / int(denominator) if denominator else float(numerator)
+    except (ValueError, ZeroDivisionError):
+        return default
+
+def key_signature(key):
+    """Map of pitch letter -> semitone offset for a K: field such as 'G', 'Dm' or 'Bbmix'."""
+    match = _KEY.match(key.strip())
+    if not match:
+        return {}  # K:none, K:HP and the like
+    tonic, accidental, mode = match.groups()
+    fifths = _FIFTHS[tonic] + {'#': 7, 'b': -7, '': 0}[accidental]
+    mode = mode.lower()
+    fifths += _MODES.get(mode if mode in ('m', '') else mode[:3], 0)
+    if fifths >= 0:
+        return {letter: 1 for letter in _SHARP_ORDER[:fifths]}
+    return {letter: -1 for letter in _SHARP_ORDER[::-1][:-fifths]}
+
+def _note_token(text):
+    """(letter, octave, accidental or None, natural MIDI pitch, length factor) of a note token."""
+    parsed = _note_tokens.get(text)
+    if parsed is None:
+        accidental, letter, marks, length = _NOTE.fullmatch(text).groups()
+        octave = (1 if letter.islower() else 0) + marks.count("'") - marks.count(',')
+        step = letter.upper()
+        parsed = (step, octave, _ACCIDENTALS.get(accidental), 60 + _STEPS[step] + 12 * octave,
+                  length_multiplier(length))
+        _note_tokens[text] = parsed
+    return parsed
+
+def _chord_token(text):
+    """(list of note tokens, length factor of the chord) of a [...] chord token."""
+    parsed = _chord_tokens.get(text)
+    if parsed is None:
+        close = text.rindex(']')
+        notes = [_note_token(match.group()) for match in _NOTE.finditer(text, 1, close)]
+        parsed = (notes, length_multiplier(text[close + 1:]))
+        _chord_tokens[text] = parsed
+    return parsed
+
+class VoiceState:
+    """Event stream of one voice while a tune is being parsed.
+
+    Rather than a start time, every event records how far it moves the
+    cursor: a note its length, all but the last tone of a chord nothing.
+    A rest just lengthens the advance of the event before it. Adding a note
+    is then three appends, repeating a section three list extensions, and
+    events() turns the advances into start times with one running sum.
+    """
+
+    def __init__(self, voice_id, name=''):
+        self.id = voice_id
+        self.name = name
+        self.midi = []                # MIDI pitch, or REST
+        self.duration = []            # Whole notes
+        self.advance = []             # Whole notes the cursor moves after the event
+        self.repeat_start = 0         # Event index of the section a :| repeats
+        self.ending_start = None      # Event index where the first ending began, if in one
+        self.last = []                # Event indices of the previous note or chord
+        self.last_length = 0.0
+        self.ties = {}                # pitch -> event index of notes tied into the next note
+        self.broken = 1.0             # Length factor left for the next note by > or <
+        self.tuplet = (0, 1.0)        # (notes left, length factor)
+        self.accidentals = {}         # (letter, octave) -> offset for the rest of the bar
+
+    def length(self, length):
+        """Apply pending tuplet and broken-rhythm factors to a note length."""
+        remaining, factor = self.tuplet
+        if remaining:
+            length *= factor
+            self.tuplet = (remaining - 1, factor)
+        length *= self.broken
+        self.broken = 1.0
+        return length
+
+    def play(self, pitches, length):
+        """Add one note or chord at the cursor; notes tied from the previous step are extended."""
+        ties, self.ties = self.ties, {}
+        self.last = []
+        added = False
+        for pitch in pitches:
+            index = ties.get(pitch)
+            if index is None:
+                index = len(self.midi)
+                self.midi.append(pitch)
+                self.duration.append(length)
+                self.advance.append(0.0)
+                added = True
+            else:
+                self.duration[index] += length
+            self.last.append(index)
+        if added:
+            self.advance[-1] = length
+        else:
+            self.skip(length)  # Every tone was tied over
+        self.last_length = length
+
+    def appended(self):
+        """Make the last event the previous note after notes were appended directly."""
+        self.last = [len(self.midi) - 1]
+        self.last_length = self.duration[-1]
+
+    def rest(self, length):
+        self.ties = {}
+        self.last = []
+        self.skip(length)
+
+    def skip(self, length):
+        """Move the cursor without starting a note.
+
+        The time is added to the previous event's advance, unless that event
+        lies outside the current repeat section or ending; then a REST event
+        carries it, so that repeating the section repeats the silence too.
+        """
+        if len(self.midi) > max(self.repeat_start, self.ending_start or 0):
+            self.advance[-1] += length
+        else:
+            self.midi.append(REST)
+            self.duration.append(0.0)
+            self.advance.append(length)
+
+    def broken_rhythm(self, marks):
+        """Dot the previous note and halve the next for '>' ('<' the other way round);
+        '>>' and '<<' double-dot."""
+        dotted, short = 2 - 0.5 ** len(marks), 0.5 ** len(marks)
+        if marks[0] == '<':
+            dotted, short = short, dotted
+        if self.last:
+            # Scale the previous note or chord, moving the cursor with it
+            change = self.last_length * (dotted - 1)
+            for index in self.last:
+                self.duration[index] += change
+            self.advance[-1] += change
+            self.last_length += change
+        self.broken = short
+
+    def tie(self):
+        self.ties = {self.midi[index]: index for index in self.last}
+
+    def bar(self, text):
+        """Handle a bar line: clear accidentals and process repeats and endings."""
+        self.accidentals = {}
+        ending = text[-1] if text[-1].isdigit() else ''
+        text = text.rstrip('0123456789')
+        if text.startswith(':'):
+            self.repeat()
+        if text.endswith(':') or text.startswith(':'):
+            self.repeat_start = len(self.midi)
+        if ending:
+            self.begin_ending(ending)
+
+    def begin_ending(self, number):
+        self.ending_start = len(self.midi) if number == '1' else None
+
+    def repeat(self):
+        """Play the section since the last |: again, leaving out a first ending."""
+        start, stop = self.repeat_start, self.ending_start
+        if stop is None:
+            stop = len(self.midi)
+        self.midi.extend(self.midi[start:stop])
+        self.duration.extend(self.duration[start:stop])
+        self.advance.extend(self.advance[start:stop])
+        self.ending_start = None
+        self.ties = {}
+        self.last = []
+
+    def events(self):
+        """The voice dict parse_tune returns: parallel midi, start and duration lists."""
+        midi, duration = self.midi, self.duration
+        starts = list(accumulate(self.advance, initial=0.0))
+        starts.pop()
+        if REST in midi:
+            notes = [pitch != REST for pitch in midi]
+            midi, starts, duration = (list(compress(column, notes)) for column in (midi, starts, duration))
+        return {'id': self.id, 'name': self.name, 'midi': midi, 'start': starts, 'duration': duration}
+
+def _meter(value, current):
+    """(beats, beat unit) of an M: field; C and C| are common and cut time."""
+    if value in ('C', 'C|'):
+        return (4, 4) if value == 'C' else (2, 2)
+    numerator, _, denominator = value.partition('/')
+    try:
+        return (int(numerator), int(denominator))
+    except ValueError:
+        return current
+
+def _tempo(value, unit_length):
+    """Quarter notes per minute from a Q: field such as '1/4=100', '3/8=150' or '120'."""
+    beat, _, bpm = value.rpartition('=')
+    bpm = _fraction(bpm.split()[0]) if bpm.split() else None
+    if not bpm:
+        return None
+    # A bare Q:120 counts unit notes; 'Q:1/4 3/8=...' adds the beat lengths up
+    beat_length = sum(_fraction(part, 0) for part in beat.strip('" ').split()) or unit_length
+    return bpm * beat_length * 4
+
+def parse_tune(text):
+    """Parse one tune (from its X: line) into header fields and per-voice event streams.
+
+    Returns a dict with index, title, tempo (quarter notes per minute),
+    time_sig, key, unit_length and voices: a list of dicts with the voice id
+    and name and parallel midi, start and duration lists (in whole notes).
+    Returns None if the text has no X: field.
+    """
+    tune = {'index': None, 'title': 'Untitled', 'tempo': 120, 'time_sig': (4, 4), 'key': 'C'}
+    unit_length = 0.125
+    explicit_unit = False
+    key = {}
+    # Notes before the first V: field belong to voice 1
+    state = VoiceState('1')
+    voices = {'1': state}
+    append_midi, append_duration, append_advance = state.midi.append, state.duration.append, state.advance.append
+    # Pitch, length and tie or broken-rhythm suffix of notes without
+    # accidentals of their own, under the current key and unit length
+    plain = _plain_notes.setdefault((frozenset(key.items()), unit_length), {})
+    # Whether the current voice has no tie, tuplet, broken rhythm or bar
+    # accidental pending, so that a plain note is just three appends
+    fast = True
+    # Whether state.last is behind because the fast path added a note
+    appended = False
+
+    for token in _TOKEN.findall(text):
+        if fast:
+            note = plain.get(token)
+            if note is not None:
+                append_midi(note[0])
+                append_duration(note[1])
+                append_advance(note[1])
+                if note[2]:
+                    state.appended()
+                    if note[2] == '-':
+                        state.tie()
+                    else:
+                        state.broken_rhythm(note[2])
+                    fast = appended = False
+                else:
+                    appended = True
+                continue
+            if token == '|':
+                continue  # No accidentals to forget
+
+        first = token[0]
+        if (first in _LETTERS or first in '^_=' and len(token) > 1) and token[1:2] != ':':
+            note = token.rstrip('-<>')
+            step, octave, accidental, natural, factor = _note_token(note)
+            length = factor * unit_length
+            if accidental is None:
+                offset = key.get(step, 0)
+                plain[token] = (natural + offset, length, token[len(note):])
+                offset = state.accidentals.get((step, octave), offset)
+            else:
+                offset = state.accidentals[step, octave] = accidental
+            state.play((natural + offset,), state.length(length))
+            appended = False
+            if note != token:
+                # A tie or broken rhythm written straight after the note
+                if token[-1] == '-':
+                    state.tie()
+                else:
+                    state.broken_rhythm(token[len(note):])
+        elif first == '|' or first == ':' or token[:2] == '[|':
+            if token == '|':
+                state.accidentals = {}
+            else:
+                state.bar(token)
+                appended = False
+        elif first == '[' and token[2:3] != ':' and len(token) > 1:
+            if token[1].isdigit():
+                state.begin_ending(token[1])
+            else:
+                notes, chord_factor = _chord_token(token)
+                pitches = []
+                for step, octave, accidental, natural, _ in notes:
+                    if accidental is None:
+                        offset = state.accidentals.get((step, octave), key.get(step, 0))
+                    else:
+                        offset = state.accidentals[step, octave] = accidental
+                    pitches.append(natural + offset)
+                # A chord lasts as long as its first note
+                state.play(pitches, state.length(notes[0][4] * chord_factor * unit_length))
+                appended = False
+        elif token[1:2] == ':' and first.isalpha() or first == '[' and token[2:3] == ':':
+            field = token[1:-1] if first == '[' else token
+            name, value = field[0], field[2:].strip()
+            if name == 'X':
+                tune['index'] = int(value) if value.isdigit() else value
+            elif name == 'T' and tune['title'] == 'Untitled':
+                tune['title'] = value
+            elif name == 'M':
+                tune['time_sig'] = _meter(value, tune['time_sig'])
+                if not explicit_unit:
+                    # Without L:, short meters default to sixteenths
+                    numerator, denominator = tune['time_sig']
+                    unit_length = 0.0625 if numerator / denominator < 0.75 else 0.125
+            elif name == 'L':
+                unit_length = _fraction(value, unit_length)
+                explicit_unit = True
+            elif name == 'Q':
+                tempo = _tempo(value, unit_length)
+                if tempo:
+                    tune['tempo'] = tempo
+            elif name == 'K':
+                tune['key'] = value
+                key = key_signature(value)
+            elif name == 'V':
+                voice_id, _, rest = value.partition(' ')
+                if appended:
+                    state.appended()
+                    appended = False
+                state = voices.get(voice_id)
+                if state is None:
+                    state = voices[voice_id] = VoiceState(voice_id)
+                name_match = re.search(r'(?:name|nm)="([^"]*)"', rest)
+                if name_match:
+                    state.name = name_match.group(1)
+                append_midi, append_duration, append_advance = (state.midi.append, state.duration.append,
+                                                                state.advance.append)
+            if name in 'KLM':
+                plain = _plain_notes.setdefault((frozenset(key.items()), unit_length), {})
+        elif first == 'z' or first == 'x':
+            state.rest(state.length(length_multiplier(token[1:]) * unit_length))
+            appended = False
+        elif first == '-' or first == '<' or first == '>':
+            if appended:
+                state.appended()
+                appended = False
+            if first == '-':
+                state.tie()
+            else:
+                state.broken_rhythm(token)
+        elif first == '(' and len(token) > 1:
+            numbers = token[1:].split(':') + ['', '']
+            notes = int(numbers[0])
+            time = int(numbers[1]) if numbers[1] else _TUPLET_TIME.get(notes, 2)
+            count = int(numbers[2]) if numbers[2] else notes
+            state.tuplet = (count, time / notes)
+        elif first == 'Z':
+            numerator, denominator = tune['time_sig']
+            state.rest(int(token[1:] or 1) * numerator / denominator)
+            appended = False
+        else:
+            continue
+
+        fast = not (state.ties or state.tuplet[0] or state.broken != 1.0 or state.accidentals)
+
+    if tune['index'] is None:
+        return None
+    tune['unit_length'] = unit_length
+    # A voice 1 nothing was written to is not a voice of the tune
+    tune['voices'] = [state.events() for state in voices.values() if state.midi or state.id != '1']
+    return tune
+
+def parse_abc(text):
+    """Parse every tune of an ABC file; text before the first X: line is ignored."""
+    tunes = []
+    for chunk in re.split(r'\n(?=X:)', text):
+        if chunk.startswith('X:'):
+            tune = parse_tune(chunk)
+            if tune:
+                tunes.append(tune)
+    return tunes
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the synthesis, effect and mixing functions.
+Reports samples/second and notes/second at several note lengths and sample
+rates, saves the results as JSON and optionally compares them against a
+baseline file.
+
+Usage: python audio/benchmark.py [--quick] [--filter TEXT] [--dtype float32] [--baseline FILE] [--threshold 0.1]
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+import numpy as np
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(AUDIO_DIR)
+sys.path.insert(0, AUDIO_DIR)
+sys.path.append(ROOT_DIR)
+
+from abc_parser import parse_abc
+from generate_music import (MONO, STEREO, apply_reverb, drum_voice, generate_kick_drum, generate_tone,
+                            mix_tracks, pan_stereo, part_length, part_sounds, pitched_voice, render_part)
+from orchestral_battle import create_battle_drums, generate_string_tone_fixed
+from orchestral_boss import generate_choir_tone
+from generate_hq_music import HighQualityMusicGenerator
+from precision import SUPPORTED_DTYPES, sample_dtype, set_sample_dtype
+
+NOTE_LENGTHS = [0.125, 0.5, 2.0]  # Seconds
+SAMPLE_RATES = [22050, 44100, 48000]
+QUICK_NOTE_LENGTHS = [0.5]
+QUICK_SAMPLE_RATES = [44100]
+MIN_TIME = 0.2  # Seconds of repeated calls per measurement
+ABC_FILE = os.path.join(ROOT_DIR, 'music_scores.abc')
+ABC_CORPUS_TUNES = 200
+PHRASE_REPEATS = 4
+
+# Time the synthesis itself, not note cache or drum bank lookups
+kick_drum = inspect.unwrap(generate_kick_drum)
+string_tone = inspect.unwrap(generate_string_tone_fixed)
+choir_tone = inspect.unwrap(generate_choir_tone)
+
+def measure(fn, min_time=MIN_TIME):
+    """Return the best seconds per call of fn, repeating for at least min_time."""
+    fn()  # Warm up caches (wavetables, FFT plans, impulse responses)
+    best = float('inf')
+    elapsed = 0.0
+    calls = 0
+    while elapsed < min_time or calls < 3:
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        best = min(best, seconds)
+        elapsed += seconds
+        calls += 1
+    return best
+
+def signal(seconds, sample_rate):
+    """A deterministic test signal of the given length."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (0.3 * np.sin(2 * np.pi * 220 * t)).astype(sample_dtype())
+
+def test_tune(note_length, n_notes=32):
+    """A parsed-tune dict for synthesize_tune; durations are in whole notes at 120 BPM."""
+    midis = [60, 62, 64, 65, 67, 69, 71, 72]
+    return {'tempo': 120, 'notes': [{'midi': midis[i % len(midis)], 'duration': note_length / 2}
+                                    for i in range(n_notes)]}
+
+def repeated_part(repeats=PHRASE_REPEATS):
+    """A 28-note phrase with no repeats inside it, played repeats times."""
+    phrase = [(f'{name}{octave}', 0.5) for octave in (3, 4, 5, 6) for name in 'CDEFGAB']
+    return phrase * repeats
+
+def step_render(part, voice, beat_duration, sample_rate=44100):
+    """Render a part one step at a time, as render_part did before section reuse."""
+    track = np.zeros(part_length(part, beat_duration, sample_rate), dtype=sample_dtype())
+    for onset, sound in part_sounds(part, voice, beat_duration, sample_rate):
+        track[onset:onset + len(sound)] += sound
+    return track
+
+def stereo_mix_tracks(tracks_with_panning, sample_rate=44100):
+    """The mixer mix_tracks replaced, kept as a baseline.
+
+    A copy of the old mix_tracks_stereo with delay reverb: every track is
+    padded to full length and panned into its own stereo array, and mono
+    output is the mean of the normalized stereo mix.
+    """
+    max_length = max(len(track) for track, _, _ in tracks_with_panning)
+    stereo_mix = np.zeros((max_length, 2), dtype=sample_dtype())
+    for track, pan, reverb_amt in tracks_with_panning:
+        if len(track) < max_length:
+            track = np.pad(track, (0, max_length - len(track)))
+        if reverb_amt > 0:
+            track = apply_reverb(track, sample_rate, room_size=reverb_amt)
+            if len(track) > max_length:
+                track = track[:max_length]
+        stereo_track = pan_stereo(track, pan)
+        stereo_mix += stereo_track[:max_length]
+    max_val = np.max(np.abs(stereo_mix))
+    if max_val > 0:
+        stereo_mix = stereo_mix / max_val * 0.9
+    return np.mean(stereo_mix, axis=1)
+
+def abc_corpus(n_tunes=ABC_CORPUS_TUNES, seed=0):
+    """A deterministic ABC file of two-voice tunes shaped like music_scores.abc.
+
+    Every tune has two repeated 8-bar sections, the first with first and
+    second endings. Most bars are plain runs of notes with a chord symbol;
+    the rest add a chord, a tie, broken rhythm, a triplet, a rest or an
+    accidental, and every fourth bar has an octave mark.
+    """
+    rng = np.random.default_rng(seed)
+    scale = ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'c', 'd', 'e', 'f', 'g', 'a', 'b']
+    symbols = ['"C"', '"Am"', '"F"', '"G"', '"Dm"', '"Em"']
+    features = ['[{0}{2}]2 {1}2 {3}2 {4}2', '{0}2 {1}2 {2}4-', '{0}3 {1} {2}>{3} {4}2',
+                '(3{0}{1}{2} {3}2 {4}2 {0}2', '{0}2 z2 {1}2 {2}2', '^{0}2 {1}2 ={0}2 {2}2']
+
+    def bar(n):
+        notes = [scale[i] for i in rng.integers(0, len(scale), 6)]
+        if n % 4 == 3:
+            notes[5] += "'" if notes[5].islower() else ','
+        if rng.random() < 0.6:
+            body = '{0}2 {1}2 {2}2 {3}2' if rng.random() < 0.5 else '{0}{1}{2}{3} {4}{5}{0}{1}'
+        else:
+            body = features[rng.integers(len(features))]
+        return symbols[rng.integers(len(symbols))] + body.format(*notes)
+
+    def voice(name, number):
+        first = ' | '.join(bar(n) for n in range(7))
+        second = ' | '.join(bar(n) for n in range(8))
+        return (f'V:{number} name="{name}"\n|: {first} |1 {bar(7)} :|2 {bar(7)} |]\n'
+                f'|: {second} :|\n')
+
+    tunes = []
+    for n in range(1, n_tunes + 1):
+        tunes.append(f'X:{n}\nT:Corpus {n}\nM:4/4\nL:1/8\nQ:1/4=120\nK:G\n'
+                     + voice('Lead', 1) + voice('Bass', 2))
+    return '\n'.join(tunes)
+
+def regex_parse_abc(content):
+    """The line-by-line regex parser abc_parser replaced, kept as a baseline.
+
+    A copy of the old HighQualityMusicGenerator.parse_single_tune and
+    parse_note_line: header fields by prefix, then each note line stripped of
+    bar lines with re.sub and scanned for notes with a second finditer.
+    """
+    hq = HighQualityMusicGenerator()
+    tunes = []
+    for text in re.split(r'\n(?=X:\d+)', content):
+        if not text.strip() or not text.startswith('X:'):
+            continue
+        tune = {'notes': [], 'tempo': 120, 'time_sig': (4, 4), 'key': 'C', 'title': 'Untitled'}
+        default_length = 1 / 8
+        for line in text.strip().split('\n'):
+            line = line.strip()
+            if line.startswith('X:'):
+                tune['index'] = int(line[2:].strip())
+            elif line.startswith('T:'):
+                tune['title'] = line[2:].strip()
+            elif line.startswith('M:'):
+                parts = line[2:].strip().split('/')
+                if len(parts) == 2:
+                    tune['time_sig'] = (int(parts[0]), int(parts[1]))
+            elif line.startswith('L:'):
+                parts = line[2:].strip().split('/')
+                if len(parts) == 2:
+                    default_length = int(parts[0]) / int(parts[1])
+            elif line.startswith('Q:'):
+                match = re.search(r'1/4=(\d+)', line)
+                if match:
+                    tune['tempo'] = int(match.group(1))
+            elif line.startswith('K:'):
+                tune['key'] = line[2:].strip()
+            elif line.startswith('V:'):
+                continue
+            elif '|' in line or any(c in line for c in 'ABCDEFGabcdefg'):
+                line = re.sub(r'[|:\[\]"]', ' ', line)
+                line = re.sub(r'"[^"]*"', '', line)
+                for match in re.finditer(r"([_^=]?)([A-Ga-g])([,']*)(\d*/?\.?\d*)", line):
+                    accidental, pitch, octave_mod, duration = match.groups()
+                    if pitch.isupper():
+                        octave = 4
+                    else:
+                        octave = 5
+                        pitch = pitch.upper()
+                    if ',' in octave_mod:
+                        octave -= octave_mod.count(',')
+                    if "'" in octave_mod:
+                        octave += octave_mod.count("'")
+                    if duration:
+                        if '/' in duration:
+                            parts = duration.split('/')
+                            if len(parts) == 2 and parts[1]:
+                                note_length = default_length * (int(parts[0]) if parts[0] else 1) / int(parts[1])
+                            else:
+                                note_length = default_length / 2
+                        elif duration.isdigit():
+                            note_length = default_length * int(duration)
+                        else:
+                            note_length = default_length
+                    else:
+                        note_length = default_length
+                    tune['notes'].append({'pitch': pitch, 'midi': hq.note_to_midi_number(pitch, octave, accidental),
+                                          'duration': note_length, 'octave': octave,
+                                          'accidental': accidental})
+        tunes.append(tune)
+    return tunes
+
+def count_abc_notes(tunes):
+    """Notes in parsed tunes; every chord tone counts."""
+    return sum(len(voice['midi']) for tune in tunes for voice in tune['voices'])
+
+def benchmarks(note_lengths, sample_rates):
+    """Yield (name, fn, samples, notes) for every benchmark case."""
+    hq = HighQualityMusicGenerator()
+
+    for sample_rate in sample_rates:
+        for length in note_lengths:
+            samples = int(length * sample_rate)
+            case = f'{length}s@{sample_rate}'
+
+            yield (f'generate_kick_drum[{case}]',
+                   lambda l=length, sr=sample_rate: kick_drum(l, sr), samples, 1)
+            for use_wavetable in (False, True):
+                suffix = '/wavetable' if use_wavetable else ''
+                yield (f'generate_string_tone_fixed{suffix}[{case}]',
+                       lambda l=length, sr=sample_rate, w=use_wavetable:
+                           string_tone(440.0, l, sr, use_wavetable=w),
+                       samples, 1)
+                yield (f'generate_choir_tone{suffix}[{case}]',
+                       lambda l=length, sr=sample_rate, w=use_wavetable:
+                           choir_tone(440.0, l, sr, use_wavetable=w),
+                       samples, 1)
+
+            def hq_complex_tone(sample_rate=sample_rate, length=length):
+                hq.sample_rate = sample_rate
+                return hq.generate_complex_tone(440.0, length)
+            yield f'HQ.generate_complex_tone[{case}]', hq_complex_tone, samples, 1
+
+            # Effects and tunes run over 32 notes of this length
+            tune_audio = signal(32 * length, sample_rate)
+            tune_samples = len(tune_audio)
+            yield (f'apply_reverb[{case}x32]',
+                   lambda a=tune_audio, sr=sample_rate: apply_reverb(a, sr), tune_samples, 32)
+            tracks = [(tune_audio, pan, 0.3) for pan in (-0.5, 0.0, 0.5, 0.2)]
+            for layout in (MONO, STEREO):
+                yield (f'mix_tracks/{layout}[{case}x32x4]',
+                       lambda t=tracks, sr=sample_rate, l=layout: mix_tracks(t, sr, layout=l),
+                       4 * tune_samples, 4 * 32)
+            yield (f'stereo_mix_tracks[{case}x32x4]',
+                   lambda t=tracks, sr=sample_rate: stereo_mix_tracks(t, sr), 4 * tune_samples, 4 * 32)
+
+            def hq_add_reverb(sample_rate=sample_rate, audio=tune_audio):
+                hq.sample_rate = sample_rate
+                return hq.add_reverb(audio)
+            yield f'HQ.add_reverb[{case}x32]', hq_add_reverb, tune_samples, 32
+
+            def hq_synthesize(sample_rate=sample_rate, tune=test_tune(length)):
+                hq.sample_rate = sample_rate
+                return hq.synthesize_tune(tune)
+            yield f'HQ.synthesize_tune[{case}x32]', hq_synthesize, tune_samples, 32
+
+    # Section reuse renders the phrase once; the step loop renders every repeat
+    part, voice = repeated_part(), pitched_voice(generate_tone)
+    samples, case = part_length(part, 0.5), f'phrase x{PHRASE_REPEATS}'
+    yield f'render_part[{case}]', lambda: render_part(part, voice, 0.5), samples, len(part)
+    yield f'step_render[{case}]', lambda: step_render(part, voice, 0.5), samples, len(part)
+    # Hits after the first few of each length come from the drum bank
+    drums, voice = create_battle_drums(), drum_voice()
+    yield 'render_part[battle drums]', lambda: render_part(drums, voice, 0.5), part_length(drums, 0.5), len(drums)
+
+    # Parsing has no sample rate; notes/second is notes parsed
+    n_notes = count_abc_notes(hq.parse_abc_file(ABC_FILE))
+    yield 'HQ.parse_abc_file[music_scores.abc]', lambda: hq.parse_abc_file(ABC_FILE), 0, n_notes
+    # Both parsers are timed on the same text and credited with the notes
+    # abc_parser finds, so notes/second compares their throughput directly.
+    # The lead is small, about 1.1x: tokenizing is a third of parse_abc's
+    # time, and repeats, voices and ties are work the regex parser skips
+    corpus = abc_corpus()
+    n_notes = count_abc_notes(parse_abc(corpus))
+    yield f'parse_abc[corpus{ABC_CORPUS_TUNES}]', lambda: parse_abc(corpus), 0, n_notes
+    yield f'regex_parse_abc[corpus{ABC_CORPUS_TUNES}]', lambda: regex_parse_abc(corpus), 0, n_notes
+
+def run_benchmarks(note_lengths=NOTE_LENGTHS, sample_rates=SAMPLE_RATES, name_filter=None,
+                   min_time=MIN_TIME):
+    """Run the benchmarks and return {name: {'seconds', 'samples_per_sec', 'notes_per_sec'}}."""
+    results = {}
+    for name, fn, samples, notes in benchmarks(note_lengths, sample_rates):
+        if name_filter and name_filter not in name:
+            continue
+        seconds = measure(fn, min_time)
+        results[name] = {
+            'seconds': seconds,
+            'samples_per_sec': samples / seconds,
+            'notes_per_sec': notes / seconds,
+        }
+        print(f"{name:<52} {samples / seconds / 1e6:9.2f} Msamples/s {notes / seconds:11.1f} notes/s")
+    return results
+
+def compare(results, baseline, threshold=0.1):
+    """Print throughput changes against a baseline; return the names that regressed.
+
+    A benchmark regresses when its notes/second falls more than threshold
+    (a fraction) below the baseline.
+    """
+    regressions = []
+    print(f"\nComparison with baseline (threshold {threshold:.0%}):")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['notes_per_sec']
+        change = result['notes_per_sec'] / old - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<52} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the synthesis, effect and mixing functions.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help='JSON file for the results (default: benchmark_results.json)')
+    parser.add_argument('-b', '--baseline',
+                        help='results JSON from an earlier run to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='allowed slowdown as a fraction before failing (default: 0.1)')
+    parser.add_argument('-k', '--filter', dest='name_filter',
+                        help='only run benchmarks whose name contains this text')
+    parser.add_argument('--quick', action='store_true',
+                        help='one note length and sample rate only')
+    parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float64',
+                        help='sample precision to benchmark (default: float64)')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME,
+                        help=f'seconds to spend per measurement (default: {MIN_TIME})')
+    args = parser.parse_args(argv)
+    set_sample_dtype(args.dtype)
+
+    note_lengths = QUICK_NOTE_LENGTHS if args.quick else NOTE_LENGTHS
+    sample_rates = QUICK_SAMPLE_RATES if args.quick else SAMPLE_RATES
+    results = run_benchmarks(note_lengths, sample_rates, args.name_filter, args.min_time)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'dtype': args.dtype,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"✗ {len(regressions)} benchmark(s) regressed")
+            return 1
+        print("✓ No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
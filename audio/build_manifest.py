@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Content-hash build manifest for incremental soundtrack builds.
+Each track's inputs (part data, voice function source, tempo, sample rate,
+mix/effect settings and encoder settings) are hashed so unchanged tracks
+can be skipped.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import types
+
+import numpy as np
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_NAME = 'build_manifest.json'
+
+def _digest(data):
+    """Return a short SHA-256 hex digest of a string."""
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+def _module_source(module):
+    """Return the source of a local audio module, or None for anything else."""
+    path = getattr(module, '__file__', None)
+    if not path or os.path.dirname(os.path.abspath(path)) != AUDIO_DIR:
+        return None
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+def _code_names(code):
+    """Global names referenced by a code object and its nested functions."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+def function_fingerprint(fn, seen=None):
+    """Hash a function's source together with everything it calls.
+
+    Closure values, default arguments, referenced global functions, plain
+    data and arrays, and any local audio modules it uses are all folded in,
+    so editing a tone generator or a table such as MIDI_FREQUENCIES changes
+    the fingerprint of every voice that uses it.
+    """
+    seen = set() if seen is None else seen
+    fn = inspect.unwrap(fn)
+    if fn in seen:
+        return ''
+    seen.add(fn)
+
+    parts = [inspect.getsource(fn)]
+    for cell in fn.__closure__ or ():
+        parts.append(_value_fingerprint(cell.cell_contents, seen))
+    for default in list(fn.__defaults__ or ()) + list((fn.__kwdefaults__ or {}).values()):
+        parts.append(_value_fingerprint(default, seen))
+    for name in sorted(_code_names(fn.__code__)):
+        if name in fn.__globals__:
+            parts.append(f'{name}={_value_fingerprint(fn.__globals__[name], seen)}')
+    return _digest('\n'.join(parts))
+
+def _value_fingerprint(value, seen):
+    if hasattr(value, '__wrapped__'):
+        value = inspect.unwrap(value)  # e.g. functools.lru_cache wrappers
+    if isinstance(value, types.FunctionType):
+        return function_fingerprint(value, seen)
+    if isinstance(value, types.ModuleType):
+        if value in seen:
+            return ''
+        seen.add(value)
+        source = _module_source(value)
+        return _digest(source) if source is not None else value.__name__
+    if isinstance(value, type) and _module_source(inspect.getmodule(value)) is not None:
+        return _digest(inspect.getsource(value))
+    if isinstance(value, (bool, int, float, str, tuple, list, dict, type(None))):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(f'{value.dtype.str}{value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+        return digest.hexdigest()[:16]
+    return type(value).__name__
+
+def _part_data(part):
+    """A part as hashed: (note, beats) lists as written, event arrays by content."""
+    if isinstance(part, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(part).tobytes()).hexdigest()
+    return part
+
+def _settings_digest(settings, seen):
+    """Hash a settings dict; function values are replaced by their fingerprints."""
+    return _digest(json.dumps(settings, sort_keys=True,
+                              default=lambda value: _value_fingerprint(value, seen)))
+
+def track_inputs(arrangement, tempo, sample_rate, effects, encoder):
+    """Return a hash for each group of inputs that determines a track's output.
+
+    effects and encoder are settings dicts; they may include the render and
+    encode functions themselves so that code changes invalidate the track.
+    """
+    seen = set()
+    return {
+        'parts': _digest(repr([(name, _part_data(part)) for name, part, _, _, _ in arrangement])),
+        'voices': _digest(repr([(name, function_fingerprint(voice, seen))
+                                for name, _, voice, _, _ in arrangement])),
+        'mix': _digest(repr([(name, pan, reverb) for name, _, _, pan, reverb in arrangement])),
+        'effects': _settings_digest(effects, seen),
+        'tempo': _digest(repr(tempo)),
+        'sample_rate': _digest(repr(sample_rate)),
+        'encoder': _settings_digest(encoder, seen),
+    }
+
+def inputs_hash(inputs):
+    """Combine per-group input hashes into one track hash."""
+    return _digest(json.dumps(inputs, sort_keys=True))
+
+def load_manifest(path):
+    """Load a build manifest, returning an empty one if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, path):
+    """Write a build manifest."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def rebuild_reason(entry, inputs, output_path):
+    """Explain why a track must be rebuilt, or return None if it is up to date."""
+    if entry is None:
+        return 'not in manifest'
+    if not os.path.exists(output_path):
+        return f'{os.path.basename(output_path)} is missing'
+    changed = [group for group, digest in inputs.items() if entry['inputs'].get(group) != digest]
+    if changed:
+        return f"{', '.join(changed)} changed"
+    return None
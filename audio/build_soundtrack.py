@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Soundtrack Builder
+Renders and encodes every orchestral track in parallel across CPU cores.
+Tracks whose inputs are unchanged since the last build are skipped; see
+build_manifest.py for what is hashed. With --stems, each part is also
+exported as a sample-aligned stem for adaptive playback; see stems.py.
+With --variants, each track is also encoded to a matrix of formats and
+qualities listed in variants.json; see encode_matrix.py.
+
+Usage: python audio/build_soundtrack.py [--jobs N] [--stream] [--stereo] [--dtype float32] [--seed N] [--force]
+                                       [--stems] [--variants [NAME,...]] [--profile] [track ...]
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AUDIO_DIR)
+
+from build_manifest import (MANIFEST_NAME, inputs_hash, load_manifest, rebuild_reason,
+                            save_manifest, track_inputs)
+from compiled_score import compiled_arrangement
+from encode_matrix import ENCODE_MATRIX, VARIANTS_MANIFEST_NAME, encode_variants, variants_missing
+from generate_music import LAYOUT_CHANNELS, MONO, STEREO, encode_to_ogg, render_arrangement
+from noise import BUILD_SEED
+from precision import SUPPORTED_DTYPES, set_sample_dtype
+from profiling import StageProfiler, profile_stages, stage
+from stems import STEMS_DIR, STEMS_MANIFEST_NAME, export_stems, prune_stems, stems_entry, stems_missing
+from streaming import stream_arrangement
+
+# Track name -> generator module, in build order
+TRACKS = {
+    'main_menu': 'orchestral_main_menu',
+    'battle': 'orchestral_battle',
+    'boss': 'orchestral_boss',
+    'victory': 'orchestral_victory',
+    'game_over': 'orchestral_game_over',
+}
+
+# Encoder settings shared by every track; the channel count follows the layout
+ENCODER = {'codec': 'libvorbis', 'quality': 4}
+
+def track_build_inputs(name, stream=False, sample_rate=44100, dtype='float64', layout=MONO, seed=BUILD_SEED,
+                       stems=False, variants=None):
+    """Return the per-group input hashes that determine a track's output."""
+    module = importlib.import_module(TRACKS[name])
+    effects = {
+        'reverb': 'delay',
+        'fade_out': getattr(module, 'FADE_OUT', 0.0),
+        'stream': stream,
+        'dtype': dtype,
+        'layout': layout,
+        'seed': seed,
+        'render': stream_arrangement if stream else render_arrangement,
+        'stems': {'export': export_stems, 'loop': getattr(module, 'LOOP', False)} if stems else None,
+    }
+    encoder = dict(ENCODER, channels=LAYOUT_CHANNELS[layout], encode=encode_to_ogg)
+    if variants is not None:
+        encoder.update(encode=encode_variants, variants={variant: ENCODE_MATRIX[variant] for variant in variants})
+    return track_inputs(compiled_arrangement(module, sample_rate), module.TEMPO, sample_rate, effects,
+                        encoder)
+
+def plan_builds(tracks, manifest, output_dir=AUDIO_DIR, stream=False, sample_rate=44100, force=False,
+                dtype='float64', layout=MONO, seed=BUILD_SEED, stems_manifest=None, variants=None,
+                variants_manifest=None):
+    """Split tracks into those to rebuild and those to skip.
+
+    With a stems_manifest, tracks whose stems are missing are rebuilt too,
+    and likewise with variants for tracks missing any of those variants.
+    Returns (to_build, skipped, inputs): to_build maps track -> reason,
+    skipped lists up-to-date tracks and inputs maps track -> input hashes.
+    """
+    to_build, skipped, inputs = {}, [], {}
+    stems_dir = os.path.join(output_dir, STEMS_DIR)
+    for name in tracks:
+        inputs[name] = track_build_inputs(name, stream, sample_rate, dtype, layout, seed,
+                                          stems=stems_manifest is not None, variants=variants)
+        output_path = os.path.join(output_dir, f'{name}.ogg')
+        reason = rebuild_reason(manifest.get(name), inputs[name], output_path)
+        if not reason and stems_manifest is not None and stems_missing(stems_manifest.get(name), stems_dir):
+            reason = 'stems missing'
+        if not reason and variants is not None and variants_missing(variants_manifest.get(name), variants,
+                                                                    output_dir):
+            reason = 'variants missing'
+        if force:
+            reason = 'forced'
+        if reason:
+            to_build[name] = reason
+        else:
+            skipped.append(name)
+    return to_build, skipped, inputs
+
+def build_track(name, output_dir=AUDIO_DIR, stream=False, sample_rate=44100, profile=False,
+                dtype='float64', layout=MONO, seed=BUILD_SEED, stems=False, variants=None):
+    """Render and encode one track; returns (name, ok, seconds, log, error, entries).
+
+    Rendering uses dtype samples ('float64' or 'float32'), the output
+    channel layout ('mono' or 'stereo') and seed for every part's noise, so
+    the same inputs and seed give the same PCM. With profile, a per-stage report is added to the log and written to
+    <name>.profile.json in output_dir. With stems, every part is also
+    written to the stems directory from the same render. With a list of
+    variants from ENCODE_MATRIX, those encodes run alongside the main OGG.
+    entries maps 'stems' and 'variants' to the track's entries in those
+    manifests, for whichever was requested.
+    """
+    start = time.perf_counter()
+    log = io.StringIO()
+    ok, error, entries = False, None, {}
+    profiler = StageProfiler() if profile else None
+
+    # Buffer the generator's progress output so the parent can print it in order
+    with contextlib.redirect_stdout(log):
+        try:
+            set_sample_dtype(dtype)  # Workers may be spawned without the parent's setting
+            module = importlib.import_module(TRACKS[name])
+            fade_out = getattr(module, 'FADE_OUT', 0.0)
+            print(f"Noise seed: {seed}")
+            with profile_stages(profiler):
+                with stage('compose'):
+                    parts = compiled_arrangement(module, sample_rate)
+                if stems:
+                    mix, stem_list = export_stems(parts, module.TEMPO, os.path.join(output_dir, STEMS_DIR),
+                                                  sample_rate, fade_out=fade_out, layout=layout, track=name,
+                                                  seed=seed, quality=ENCODER['quality'])
+                    entries['stems'] = stems_entry(stem_list, len(mix), module.TEMPO, sample_rate, layout,
+                                                   loop=getattr(module, 'LOOP', False))
+                    blocks = [mix]
+                elif stream:
+                    blocks = stream_arrangement(parts, module.TEMPO, sample_rate, fade_out=fade_out,
+                                                layout=layout, track=name, seed=seed)
+                else:
+                    blocks = [render_arrangement(parts, module.TEMPO, sample_rate, fade_out=fade_out,
+                                                 layout=layout, track=name, seed=seed)]
+
+                if variants is not None:
+                    with stage('ffmpeg'):
+                        ok, entries['variants'] = encode_variants(
+                            blocks, output_dir, name, sample_rate, LAYOUT_CHANNELS[layout], ENCODER['quality'],
+                            {variant: ENCODE_MATRIX[variant] for variant in variants})
+                else:
+                    ok = encode_to_ogg(blocks, os.path.join(output_dir, f'{name}.ogg'), sample_rate,
+                                       LAYOUT_CHANNELS[layout], ENCODER['quality'],
+                                       wav_filename=os.path.join(output_dir, f'{name}.wav')) is not None
+            if not ok:
+                error = 'OGG encoding failed' if variants is None else 'variant encoding failed'
+            if profiler:
+                profiler.print_report(name)
+                profiler.save(os.path.join(output_dir, f'{name}.profile.json'), name)
+        except Exception:
+            error = traceback.format_exc()
+
+    return name, ok, time.perf_counter() - start, log.getvalue(), error, entries
+
+def build_soundtrack(tracks, jobs=None, output_dir=AUDIO_DIR, stream=False, verbose=False,
+                     force=False, profile=False, dtype='float64', layout=MONO, seed=BUILD_SEED, stems=False,
+                     variants=None):
+    """Build changed tracks in a process pool, reporting results in track order.
+
+    Successful builds are recorded, with their noise seed, in the output
+    directory's manifest. With stems, their stems are recorded in
+    stems/stems.json and stem files no track uses any more are deleted.
+    With variants, every encoded file is listed in variants.json.
+    Returns the list of track names that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    stems_dir = os.path.join(output_dir, STEMS_DIR)
+    stems_manifest_path = os.path.join(stems_dir, STEMS_MANIFEST_NAME)
+    stems_manifest = load_manifest(stems_manifest_path) if stems else None
+    variants_manifest_path = os.path.join(output_dir, VARIANTS_MANIFEST_NAME)
+    variants_manifest = load_manifest(variants_manifest_path) if variants is not None else None
+    to_build, skipped, inputs = plan_builds(tracks, manifest, output_dir, stream, force=force, dtype=dtype,
+                                            layout=layout, seed=seed, stems_manifest=stems_manifest,
+                                            variants=variants, variants_manifest=variants_manifest)
+
+    for name in skipped:
+        print(f"Skipping {name}: inputs unchanged (hash {inputs_hash(inputs[name])})")
+    if not to_build:
+        print("All tracks are up to date")
+        return []
+
+    tracks = list(to_build)
+    print(f"Building {len(tracks)} tracks with {jobs or os.cpu_count()} jobs")
+    print("=" * 50)
+
+    results = {}
+    next_index = 0
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(build_track, name, output_dir, stream, profile=profile, dtype=dtype,
+                               layout=layout, seed=seed, stems=stems, variants=variants): name
+                   for name in tracks}
+        for future in as_completed(futures):
+            try:
+                name, ok, seconds, log, error, entries = future.result()
+            except Exception as e:
+                # A worker that died (e.g. killed for running out of memory) breaks the whole pool
+                error = ''.join(traceback.format_exception_only(type(e), e))
+                name, ok, seconds, log, entries = futures[future], False, 0.0, '', {}
+            results[name] = (ok, seconds, log, error, entries)
+
+            # Report finished tracks in order, holding back any that finish early
+            while next_index < len(tracks) and tracks[next_index] in results:
+                name = tracks[next_index]
+                ok, seconds, log, error, entries = results[name]
+                next_index += 1
+                status = 'ok' if ok else 'FAILED'
+                print(f"[{next_index}/{len(tracks)}] {name:<10} {status} ({seconds:.1f}s)"
+                      f" - {to_build[name]}")
+                if verbose or profile or not ok:
+                    for line in log.splitlines():
+                        print(f"    {line}")
+                if error:
+                    print(f"    {error.rstrip()}")
+                    failed.append(name)
+                else:
+                    manifest[name] = {'hash': inputs_hash(inputs[name]), 'inputs': inputs[name],
+                                      'output': f'{name}.ogg', 'seed': seed}
+                    save_manifest(manifest, manifest_path)
+                    if stems:
+                        stems_manifest[name] = entries['stems']
+                        save_manifest(stems_manifest, stems_manifest_path)
+                    if variants is not None:
+                        variants_manifest[name] = entries['variants']
+                        save_manifest(variants_manifest, variants_manifest_path)
+
+    if stems and not failed:
+        prune_stems(stems_dir, stems_manifest)
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the orchestral soundtrack in parallel.')
+    parser.add_argument('tracks', nargs='*', metavar='track',
+                        help=f"tracks to build (default: all of {', '.join(TRACKS)})")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('-o', '--output-dir', default=AUDIO_DIR,
+                        help='directory for the encoded OGG files (default: audio/)')
+    parser.add_argument('--stream', action='store_true',
+                        help='render block by block with bounded memory')
+    parser.add_argument('--stereo', action='store_const', dest='layout', const=STEREO, default=MONO,
+                        help='encode stereo OGGs that keep each part\'s panning (default: mono)')
+    parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float64',
+                        help='sample precision for rendering (default: float64)')
+    parser.add_argument('--seed', type=int, default=BUILD_SEED,
+                        help=f'seed for drum and percussion noise (default: {BUILD_SEED})')
+    parser.add_argument('--stems', action='store_true',
+                        help='also export each part as a sample-aligned stem to stems/ in the output directory')
+    parser.add_argument('--variants', nargs='?', const=','.join(ENCODE_MATRIX), metavar='NAME,...',
+                        help=f"also encode each track to these variants and list them in variants.json "
+                             f"(default: all of {', '.join(ENCODE_MATRIX)})")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='rebuild tracks even if their inputs are unchanged')
+    parser.add_argument('--profile', action='store_true',
+                        help='report per-stage time and peak memory for each track')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print each track's generator output")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.tracks if name not in TRACKS]
+    if unknown:
+        parser.error(f"unknown track(s): {', '.join(unknown)}")
+    if args.stems and args.stream:
+        parser.error("--stems renders whole tracks and cannot be combined with --stream")
+    variants = args.variants.split(',') if args.variants is not None else None
+    unknown = [variant for variant in variants or () if variant not in ENCODE_MATRIX]
+    if unknown:
+        parser.error(f"unknown variant(s): {', '.join(unknown)}")
+
+    tracks = args.tracks or list(TRACKS)
+    start = time.perf_counter()
+    failed = build_soundtrack(tracks, args.jobs, args.output_dir, args.stream, args.verbose,
+                              args.force, args.profile, args.dtype, args.layout, args.seed, args.stems,
+                              variants)
+
+    print("=" * 50)
+    if failed:
+        print(f"✗ {len(failed)} of {len(tracks)} tracks failed: {', '.join(failed)}")
+        return 1
+    print(f"✓ Soundtrack up to date ({len(tracks)} tracks) in {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Command line shared by the track generator scripts.
+Each orchestral_*.py script and generate_hq_music.py parses its options
+with track_arguments, so they accept the same flags and report typos and
+--help the way build_soundtrack.py does.
+"""
+
+import argparse
+
+from precision import set_sample_dtype
+
+REVERBS = ('delay', 'convolution')
+
+def track_arguments(description, argv=None, stream=True, layout=True):
+    """Parse a track generator's command line and apply its sample dtype.
+
+    stream and layout add --stream and --stereo for scripts that support
+    them. Returns the parsed arguments; args.layout is MONO or STEREO and
+    args.reverb is 'delay' or 'convolution'.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--float32', action='store_const', dest='dtype', const='float32', default='float64',
+                        help='render with float32 sample buffers (default: float64)')
+    parser.add_argument('--reverb', choices=REVERBS, default='delay',
+                        help='reverb applied to each part: tapped delay line or convolution with a '
+                             'hall impulse response (default: delay)')
+    parser.add_argument('--profile', action='store_true',
+                        help='report per-stage time and peak memory')
+    if stream:
+        parser.add_argument('--stream', action='store_true',
+                            help='render block by block with bounded memory')
+    if layout:
+        # Imported here: generate_hq_music.py runs from the repository root, where
+        # generate_music is the root demo script, and asks for no layout
+        from generate_music import MONO, STEREO
+        parser.add_argument('--stereo', action='store_const', dest='layout', const=STEREO, default=MONO,
+                            help='encode a stereo OGG that keeps each part\'s panning (default: mono)')
+    args = parser.parse_args(argv)
+    set_sample_dtype(args.dtype)
+    return args
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Compiled score cache.
+Scores (orchestral arrangements and ABC tunes) are compiled once into event
+arrays plus a small JSON header with tempo, meter and voice names, and kept
+on disk under a hash of their sources. Later builds load each score's
+events with a single memory-mapped read instead of re-parsing.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from score import EVENT_DTYPE, beat_lengths, part_events, step_starts
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+SCORE_CACHE_DIR = os.path.join(AUDIO_DIR, '.score_cache')
+
+# Bump when the compiled layout or the conversion rules change
+COMPILER_VERSION = 1
+
+# Conversion code every compiled score depends on, part of each cache key
+COMPILER_SOURCES = [os.path.join(AUDIO_DIR, 'score.py'), os.path.abspath(__file__)]
+
+# Events plus each note's exact duration in seconds, which voices need to
+# reproduce the sample lengths the list renderer produced
+COMPILED_DTYPE = np.dtype(EVENT_DTYPE.descr + [('duration', np.float64)])
+
+class CompiledScore:
+    """Events of every voice of one track or tune, sorted by voice id."""
+
+    def __init__(self, events, voices, tempo, meter=(4, 4), title='', key='C'):
+        self.events = events
+        self.voices = list(voices)
+        self.tempo = tempo
+        self.meter = tuple(meter)
+        self.title = title
+        self.key = key
+
+    def voice_events(self, voice):
+        """Events of one voice, by index or name; a view into the shared array."""
+        if not isinstance(voice, int):
+            voice = self.voices.index(voice)
+        start, stop = np.searchsorted(self.events['voice'], [voice, voice + 1])
+        return self.events[start:stop]
+
+    def header(self):
+        """JSON-serializable description of everything but the events."""
+        return {'voices': self.voices, 'tempo': self.tempo, 'meter': list(self.meter),
+                'title': self.title, 'key': self.key}
+
+def source_digest(paths, **params):
+    """Hash the contents of source files together with compile parameters."""
+    digest = hashlib.sha256(json.dumps(dict(params, version=COMPILER_VERSION), sort_keys=True).encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def save_scores(scores, digest, cache_dir=SCORE_CACHE_DIR):
+    """Write compiled scores as <digest>-<n>.npy event files and a <digest>.json header."""
+    os.makedirs(cache_dir, exist_ok=True)
+    for n, score in enumerate(scores):
+        path = os.path.join(cache_dir, f'{digest}-{n}.npy')
+        # Write under a name of this process's own, so builds and the dev server
+        # compiling the same score at once never read or publish a partial file
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(score.events, dtype=COMPILED_DTYPE))
+        os.replace(temp, path)
+    path = os.path.join(cache_dir, f'{digest}.json')
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump([score.header() for score in scores], f, ensure_ascii=False)
+    os.replace(temp, path)
+
+def load_scores(digest, cache_dir=SCORE_CACHE_DIR):
+    """Load compiled scores with memory-mapped events, or None if they are not cached."""
+    path = os.path.join(cache_dir, f'{digest}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        headers = json.load(f)
+    return [CompiledScore(np.load(os.path.join(cache_dir, f'{digest}-{n}.npy'), mmap_mode='r'),
+                          **header)
+            for n, header in enumerate(headers)]
+
+def cached_scores(digest, compile_fn, cache_dir=SCORE_CACHE_DIR):
+    """Return the cached scores for digest, compiling and saving them on a miss."""
+    scores = load_scores(digest, cache_dir)
+    if scores is None:
+        scores = compile_fn()
+        save_scores(scores, digest, cache_dir)
+    return scores
+
+def compile_events(events, durations):
+    """Combine events with per-row durations in seconds into COMPILED_DTYPE rows."""
+    compiled = np.zeros(len(events), dtype=COMPILED_DTYPE)
+    for field in EVENT_DTYPE.names:
+        compiled[field] = events[field]
+    compiled['duration'] = durations
+    return compiled
+
+def compile_part(part, beat_duration, sample_rate=44100, voice=0):
+    """Compile a (note, beats) part into COMPILED_DTYPE events for voice."""
+    durations, lengths = beat_lengths([beats for _, beats in part], beat_duration, sample_rate)
+    events = part_events(part, beat_duration, sample_rate, voice=voice)
+    # Every sounding step starts a new group of rows; chord rows share its duration
+    counts = np.diff(np.append(step_starts(events), len(events)))
+    return compile_events(events, np.repeat(durations[lengths > 0], counts))
+
+def compile_arrangement(arrangement, tempo, sample_rate=44100, meter=(4, 4), title=''):
+    """Compile the parts of a (name, part, voice, pan, reverb) arrangement, one voice per part."""
+    beat_duration = 60.0 / tempo
+    events = [compile_part(part, beat_duration, sample_rate, voice)
+              for voice, (_, part, _, _, _) in enumerate(arrangement)]
+    return CompiledScore(np.concatenate(events) if events else np.zeros(0, COMPILED_DTYPE),
+                         [name for name, _, _, _, _ in arrangement], tempo, meter, title)
+
+def compiled_arrangement(module, sample_rate=44100, cache_dir=SCORE_CACHE_DIR):
+    """Return module.arrangement() with each part replaced by its cached compiled events.
+
+    The cache key covers the module source and the score conversion code, so
+    editing a part recompiles the track. Voices, pans and reverb amounts are
+    taken from the module as usual, so module.arrangement() runs on a hit
+    too: building the note lists takes microseconds, while compiling them
+    to events is the millisecond step the cache saves.
+    """
+    sources = [module.__file__, os.path.join(AUDIO_DIR, 'generate_music.py')] + COMPILER_SOURCES
+    digest = source_digest(sources, track=module.__name__, sample_rate=sample_rate)
+    scores = load_scores(digest, cache_dir)
+    arrangement = module.arrangement()
+    if scores is None:
+        scores = [compile_arrangement(arrangement, module.TEMPO, sample_rate,
+                                      getattr(module, 'METER', (4, 4)), module.__name__)]
+        save_scores(scores, digest, cache_dir)
+    score, = scores
+    return [(name, score.voice_events(index), voice, pan, reverb)
+            for index, (name, _, voice, pan, reverb) in enumerate(arrangement)]
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Development server with on-demand track rendering.
+Serves the game like `python3 -m http.server`, except that
+audio/<track>.ogg for every soundtrack track comes from a render cache keyed
+by the audio sources and render settings. On a miss the track is rendered
+block by block in a subprocess and piped through ffmpeg; the encoded pages
+are streamed to the browser with chunked transfer encoding while they are
+written to the cache. Concurrent requests for a track share one render.
+
+Normalization needs the peak of the whole mix, which each render records
+next to the cache. The first render of a track has no peak to go on and
+measures it with a full extra pass before the first byte, roughly doubling
+its time to first audio. After that, a render (for example after a source
+edit) starts streaming at once with the last recorded peak. If the new mix
+peaks elsewhere, the audio sent was normalized, and clipped, with the old
+peak, so it is not cached; the track is rendered again in the background
+with the exact peak and matches a streamed build. Importing the audio
+modules takes most of a second, so a standby renderer process is kept with
+them already imported; it is replaced whenever an audio source changes.
+
+Usage: python audio/dev_server.py [--host 127.0.0.1] [--port 8080] [--stereo] [--seed N]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import glob
+import importlib
+import mimetypes
+import os
+import re
+import shlex
+import sys
+import urllib.parse
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(AUDIO_DIR)
+sys.path.insert(0, AUDIO_DIR)
+
+from build_soundtrack import ENCODER, TRACKS
+from compiled_score import compiled_arrangement, source_digest
+from encoder import ffmpeg_available, ffmpeg_command, ogg_codec_args, pcm16_chunks
+from generate_music import LAYOUT_CHANNELS, MONO, STEREO
+from noise import BUILD_SEED
+from streaming import stream_arrangement
+
+RENDER_CACHE_DIR = os.path.join(AUDIO_DIR, '.render_cache')
+SAMPLE_RATE = 44100
+CHUNK_BYTES = 16 * 1024  # Encoded bytes read from ffmpeg at a time
+
+SOURCE_POLL_SECONDS = 1.0  # How often the standby renderer checks for edited sources
+
+_TRACK_PATH = re.compile(r'/audio/(\w+)\.ogg')
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+def _audio_sources():
+    return sorted(glob.glob(os.path.join(AUDIO_DIR, '*.py')))
+
+def render_key(track, layout=MONO, seed=BUILD_SEED, sample_rate=SAMPLE_RATE):
+    """Cache key of a rendered track.
+
+    Every audio/*.py file is hashed with the settings. That is coarser than
+    the build manifest, but needs no imports, so the long-running server
+    notices edits to scores and voices without a restart.
+    """
+    return source_digest(_audio_sources(), track=track, layout=layout, seed=seed, sample_rate=sample_rate,
+                         encoder=ENCODER)
+
+def write_track_pcm(track, layout=MONO, seed=BUILD_SEED, sample_rate=SAMPLE_RATE, peak=None, peak_file=None):
+    """Write a track's 16-bit PCM to stdout as a streamed build renders it.
+
+    peak normalizes the mix without a measuring pass; samples it leaves
+    above full scale are clipped. The mix's actual peak is written to
+    peak_file once rendering ends. Progress messages go to stderr so they
+    cannot corrupt the samples.
+    """
+    out = sys.stdout.buffer
+    with contextlib.redirect_stdout(sys.stderr):
+        module = importlib.import_module(TRACKS[track])
+        parts = compiled_arrangement(module, sample_rate)
+        blocks = stream_arrangement(parts, module.TEMPO, sample_rate,
+                                    fade_out=getattr(module, 'FADE_OUT', 0.0), peak=peak, layout=layout,
+                                    track=track, seed=seed)
+        measured = None
+        def rendered():
+            nonlocal measured
+            while True:
+                try:
+                    block = next(blocks)
+                except StopIteration as end:
+                    measured = end.value  # The mix peak stream_arrangement returns
+                    return
+                yield block
+        for chunk in pcm16_chunks(rendered()):
+            out.write(chunk)
+    out.flush()
+    if peak_file:
+        with open(f'{peak_file}.tmp', 'w') as f:
+            f.write(repr(measured))
+        os.replace(f'{peak_file}.tmp', peak_file)
+
+class RenderJob:
+    """Encoded chunks of one render, replayed to every request that joins it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Condition()
+
+    async def add(self, chunk):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, error=None):
+        async with self._changed:
+            self.done, self.error = True, error
+            self._changed.notify_all()
+
+    async def stream(self):
+        """Yield every chunk from the first, then new ones until the render ends.
+
+        Raises RuntimeError if the render fails.
+        """
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: sent < len(self.chunks) or self.done)
+                chunks, done, error = self.chunks[sent:], self.done, self.error
+            if error:
+                raise RuntimeError(error)
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if done:
+                return
+
+class DevServer:
+    """Static file server whose soundtrack OGGs are rendered on demand."""
+
+    def __init__(self, root=ROOT_DIR, cache_dir=RENDER_CACHE_DIR, layout=MONO, seed=BUILD_SEED):
+        self.root = os.path.realpath(root)
+        self.cache_dir = cache_dir
+        self.layout = layout
+        self.seed = seed
+        self.render_tracks = ffmpeg_available()
+        self.jobs = {}     # Cache key -> RenderJob in progress
+        self.standby = None  # (process, PCM read end, source digest) of an idle renderer
+        self._spawning = False
+        self._tasks = set()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {self.root} on http://{host}:{port}/")
+        if self.render_tracks:
+            print(f"Tracks render on demand ({self.layout}, seed {self.seed}), cached in {self.cache_dir}")
+            self.standby = await self.spawn_renderer()
+            task = asyncio.create_task(self.refresh_standby())
+            self._tasks.add(task)
+        else:
+            print("ffmpeg not found: serving the pre-built track OGGs")
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """Answer one request and close the connection."""
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request) != 3:
+                await self.send(writer, 400, 'Bad Request')
+                return
+            method, target, _ = request
+            path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+            print(f"{method} {path}")
+            if method not in ('GET', 'HEAD'):
+                await self.send(writer, 405, 'Method Not Allowed')
+                return
+
+            match = _TRACK_PATH.fullmatch(path)
+            if self.render_tracks and match and match.group(1) in TRACKS:
+                await self.serve_track(writer, match.group(1), method, headers.get('range'))
+            else:
+                await self.serve_file(writer, path, method, headers.get('range'))
+        except ConnectionError:
+            pass  # The browser went away, e.g. it switched tracks mid-stream
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, reason, headers=(), body=b'', method='GET'):
+        """Write a complete response with a Content-Length body (left out for HEAD)."""
+        head = [f'HTTP/1.1 {status} {reason}', f'Content-Length: {len(body)}', 'Connection: close',
+                *(f'{name}: {value}' for name, value in headers)]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + (b'' if method == 'HEAD' else body))
+        await writer.drain()
+
+    async def serve_file(self, writer, path, method, byte_range=None):
+        """Serve a file below the root; directories serve their index.html."""
+        filename = os.path.realpath(os.path.join(self.root, path.lstrip('/')))
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, 'index.html')
+        inside = filename == self.root or filename.startswith(self.root + os.sep)
+        if not (inside and os.path.isfile(filename)):
+            await self.send(writer, 404, 'Not Found')
+            return
+        await self.send_file(writer, filename, method, byte_range)
+
+    async def send_file(self, writer, filename, method, byte_range=None, content_type=None):
+        """Send a whole file, or the part a single 'bytes=' range asks for."""
+        with open(filename, 'rb') as f:
+            data = f.read()
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        headers = [('Content-Type', content_type), ('Accept-Ranges', 'bytes')]
+        match = _RANGE.fullmatch(byte_range or '')
+        if match and any(match.groups()):
+            start, stop = match.groups()
+            if start:
+                start, stop = int(start), min(int(stop) + 1 if stop else len(data), len(data))
+            else:
+                start, stop = max(len(data) - int(stop), 0), len(data)
+            if start >= stop:
+                await self.send(writer, 416, 'Range Not Satisfiable', [('Content-Range', f'bytes */{len(data)}')])
+                return
+            headers.append(('Content-Range', f'bytes {start}-{stop - 1}/{len(data)}'))
+            await self.send(writer, 206, 'Partial Content', headers, data[start:stop], method)
+            return
+        await self.send(writer, 200, 'OK', headers, data, method)
+
+    async def serve_track(self, writer, track, method, byte_range=None):
+        """Serve a track from the render cache, or stream it while it renders."""
+        key = render_key(track, self.layout, self.seed)
+        cached = os.path.join(self.cache_dir, f'{track}-{key}.ogg')
+        if os.path.exists(cached):
+            await self.send_file(writer, cached, method, byte_range, 'audio/ogg')
+            return
+
+        job = self.jobs.get(key) or self.start_render(key, track, cached)
+        chunks = job.stream()
+        try:
+            # Hold the headers back until audio arrives, so a failed render is a 500
+            first = await chunks.__anext__()
+        except (RuntimeError, StopAsyncIteration) as e:
+            await self.send(writer, 500, 'Internal Server Error', [('Content-Type', 'text/plain')],
+                            f'Rendering {track} failed: {e}\n'.encode())
+            return
+
+        head = ['HTTP/1.1 200 OK', 'Content-Type: audio/ogg', 'Transfer-Encoding: chunked',
+                'Cache-Control: no-store', 'Connection: close']
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        if method == 'HEAD':
+            await writer.drain()
+            return
+        try:
+            writer.write(b'%x\r\n%s\r\n' % (len(first), first))
+            async for chunk in chunks:
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+        except RuntimeError:
+            return  # Closing without the last chunk tells the browser the body is incomplete
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def spawn_renderer(self):
+        """Start a renderer that imports the audio modules now and waits for its arguments."""
+        digest = source_digest(_audio_sources())
+        # The renderer writes PCM straight into ffmpeg through an OS pipe
+        read_fd, write_fd = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), '--standby', stdin=asyncio.subprocess.PIPE,
+                stdout=write_fd)
+        except OSError:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        return process, read_fd, digest
+
+    async def discard_stale_standby(self):
+        """Stop the standby renderer if an audio source changed since it imported them."""
+        standby = self.standby
+        if standby and standby[2] != source_digest(_audio_sources()):
+            self.standby = None
+            process, read_fd, _ = standby
+            process.kill()
+            await process.wait()
+            os.close(read_fd)
+
+    async def refresh_standby(self):
+        """Keep a standby renderer with current sources, so edits are picked up before a request."""
+        while True:
+            await asyncio.sleep(SOURCE_POLL_SECONDS)
+            if not self.jobs:
+                await self.discard_stale_standby()
+                await self.replace_standby()
+
+    async def take_renderer(self):
+        """Return the standby renderer if its sources are current, else a new one."""
+        await self.discard_stale_standby()
+        standby, self.standby = self.standby, None
+        return standby or await self.spawn_renderer()
+
+    async def replace_standby(self):
+        """Start the next standby renderer unless there is one already."""
+        if self.standby is None and not self._spawning:
+            self._spawning = True
+            try:
+                self.standby = await self.spawn_renderer()
+            finally:
+                self._spawning = False
+
+    def start_render(self, key, track, cached):
+        """Start rendering a track in the background; returns its RenderJob."""
+        job = self.jobs[key] = RenderJob()
+        task = asyncio.create_task(self.render(job, key, track, cached))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def known_peak(self, track, peak_file):
+        """Return (peak, exact): the recorded mix peak for peak_file, else the track's last one.
+
+        peak is None for a track never rendered before, which makes the
+        renderer measure it first; that render is exact too.
+        """
+        candidates = [peak_file] if os.path.exists(peak_file) else sorted(
+            glob.glob(os.path.join(self.cache_dir, f'{track}-*.peak')), key=os.path.getmtime)[-1:]
+        if not candidates:
+            return None, True
+        with open(candidates[0]) as f:
+            return float(f.read()), candidates[0] == peak_file
+
+    async def render(self, job, key, track, cached):
+        """Render and encode a track, feeding job and writing cached on success."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        partial = f'{cached}.tmp'
+        peak_file = os.path.join(self.cache_dir, f'{track}-{key}.peak')
+        peak, exact = self.known_peak(track, peak_file)
+        print(f"Rendering {track}{'' if exact else ' with its previous peak'}...")
+        rerender = False
+        try:
+            renderer, read_fd, _ = await self.take_renderer()
+            try:
+                args = ['--pcm', track, '--seed', str(self.seed), *(['--stereo'] if self.layout == STEREO else []),
+                        *(['--peak', repr(peak)] if peak is not None else []), '--peak-file', peak_file]
+                renderer.stdin.write(shlex.join(args).encode() + b'\n')
+                renderer.stdin.close()
+                encoder = await asyncio.create_subprocess_exec(
+                    *ffmpeg_command('pipe:1', SAMPLE_RATE, LAYOUT_CHANNELS[self.layout],
+                                    ogg_codec_args(ENCODER['quality']) + ['-f', 'ogg']),
+                    stdin=read_fd, stdout=asyncio.subprocess.PIPE)
+            except BaseException:
+                # Without an encoder reading its pipe the renderer would never exit
+                with contextlib.suppress(ProcessLookupError):
+                    renderer.kill()
+                await renderer.wait()
+                raise
+            finally:
+                os.close(read_fd)
+
+            with open(partial, 'wb') as f:
+                while chunk := await encoder.stdout.read(CHUNK_BYTES):
+                    f.write(chunk)
+                    await job.add(chunk)
+            codes = await renderer.wait(), await encoder.wait()
+            if any(codes):
+                raise RuntimeError(f'renderer and ffmpeg exited with {codes}')
+            await job.finish()
+            if not exact and self.known_peak(track, peak_file) != (peak, True):
+                rerender = True
+                os.remove(partial)
+                print(f"The peak of {track} changed: rendering it again for the cache")
+                return
+            os.replace(partial, cached)
+            # Older renders of this track can never be requested again
+            for stale in glob.glob(os.path.join(self.cache_dir, f'{track}-*')):
+                if stale not in (cached, peak_file):
+                    os.remove(stale)
+            print(f"Rendered {track}: {sum(map(len, job.chunks))} bytes")
+        except Exception as e:
+            print(f"Rendering {track} failed: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(partial)
+            await job.finish(str(e) or type(e).__name__)
+        finally:
+            del self.jobs[key]
+            # Spawned only now, so its imports do not compete with the render for the CPU
+            await self.replace_standby()
+            if rerender:
+                self.start_render(key, track, cached)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the game with soundtrack tracks rendered on demand.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    parser.add_argument('--stereo', action='store_const', dest='layout', const=STEREO, default=MONO,
+                        help="render stereo tracks that keep each part's panning (default: mono)")
+    parser.add_argument('--seed', type=int, default=BUILD_SEED,
+                        help=f'seed for drum and percussion noise (default: {BUILD_SEED})')
+    # Internal: the server renders each track in a subprocess started with --pcm
+    parser.add_argument('--pcm', choices=TRACKS, help=argparse.SUPPRESS)
+    parser.add_argument('--peak', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--peak-file', help=argparse.SUPPRESS)
+    parser.add_argument('--standby', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.standby:
+        # Everything is imported by now; the server sends the --pcm arguments when it needs a track
+        line = sys.stdin.readline()
+        return main(shlex.split(line)) if line else 0
+    if args.pcm:
+        write_track_pcm(args.pcm, args.layout, args.seed, peak=args.peak, peak_file=args.peak_file)
+        return 0
+    try:
+        asyncio.run(DevServer(layout=args.layout, seed=args.seed).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
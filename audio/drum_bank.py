@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Pre-rendered drum one-shots.
+A drum hit depends only on the drum, its settings and the hit length, so
+each articulation is rendered once per length into a bank of read-only
+buffers and every later hit is placed with an add. A few round-robin
+variations, each with its own noise, keep repeated hits from sounding
+mechanically identical. Banks belong to the active noise source, and the
+renderer picks each hit's variation from its place in the score (see
+round_robin), so a part gets the same hits whatever else the process
+rendered before and in whichever order its steps are rendered.
+"""
+
+import contextlib
+import functools
+import inspect
+
+from noise import active_source, noise_source
+from note_cache import NOTE_CACHE
+from precision import sample_dtype
+
+ROUND_ROBIN = 4  # Variations rendered per articulation and length
+
+_variation = 0  # Round-robin position of the step being rendered
+
+@contextlib.contextmanager
+def round_robin(position):
+    """Render the hits inside the block as round-robin position (taken modulo each bank's variations)."""
+    global _variation
+    previous, _variation = _variation, position
+    try:
+        yield
+    finally:
+        _variation = previous
+
+def uses_round_robin(fn):
+    """True if fn is a banked drum generator or a voice marked as calling one."""
+    return getattr(fn, 'round_robin', False)
+
+def one_shot(drum_fn=None, variations=ROUND_ROBIN, cache=NOTE_CACHE):
+    """Bank the hits of a drum generator with signature (..., duration, sample_rate, ...).
+
+    An articulation is the generator with every argument but the duration
+    (amplitude, pitch, open or closed). A hit uses variation slot
+    round_robin position modulo variations; each slot and sample count is
+    rendered on first use, with noise seeded by the active source, and then
+    served from cache. variations should divide ROUND_ROBIN, the period the
+    renderer counts positions in. Usable as @one_shot or
+    @one_shot(variations=n).
+    """
+    if drum_fn is None:
+        return functools.partial(one_shot, variations=variations, cache=cache)
+    signature = inspect.signature(drum_fn)
+    voice_id = f'{drum_fn.__module__}.{drum_fn.__qualname__}'
+
+    @functools.wraps(drum_fn)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        duration = params.pop('duration')
+        sample_rate = params.pop('sample_rate')
+
+        source = active_source()
+        articulation = (sample_rate, tuple(sorted(params.items())))
+        slot = _variation % variations
+        n_samples = int(sample_rate * duration)
+        key = (voice_id, source.key, sample_dtype().name) + articulation + (n_samples, slot)
+        samples = cache.get(key)
+        if samples is None:
+            # Every variation draws from a stream of its own, so its noise does
+            # not depend on which hits happened to be rendered first; the stream
+            # is named without the module, which is __main__ when run as a script
+            with noise_source(source.spawn(drum_fn.__qualname__, *articulation, n_samples, slot)):
+                samples = drum_fn(*args, **kwargs)
+            cache.put(key, samples)
+        return samples
+
+    wrapper.round_robin = True
+    return wrapper
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Multi-format, multi-quality encodes of one render.
+Each track can be shipped in a matrix of variants (Vorbis at several
+qualities, Opus, and a reduced-sample-rate mobile tier), all encoded side by
+side from the same PCM as it is rendered. The variants manifest lists every
+file with its size, bitrate and duration, so the game can pick the
+smallest variant it finds acceptable.
+"""
+
+import os
+
+from encoder import ogg_codec_args, tee_to_ffmpeg
+
+VARIANTS_MANIFEST_NAME = 'variants.json'
+DEFAULT_VARIANT = 'default'  # The track's main <name>.ogg, encoded with the build's encoder settings
+
+# Variant name -> encoder settings; sample_rate resamples in ffmpeg (Opus always encodes at 48 kHz)
+ENCODE_MATRIX = {
+    'vorbis-q6': {'codec': 'libvorbis', 'quality': 6, 'extension': 'ogg'},
+    'vorbis-q2': {'codec': 'libvorbis', 'quality': 2, 'extension': 'ogg'},
+    'opus-96k': {'codec': 'libopus', 'bitrate': '96k', 'sample_rate': 48000, 'extension': 'opus'},
+    'opus-48k': {'codec': 'libopus', 'bitrate': '48k', 'sample_rate': 48000, 'extension': 'opus'},
+    'mobile': {'codec': 'libvorbis', 'quality': 0, 'sample_rate': 22050, 'extension': 'ogg'},
+}
+
+def codec_args(settings):
+    """ffmpeg output arguments for a variant's encoder settings."""
+    if settings['codec'] == 'libvorbis':
+        args = ogg_codec_args(settings['quality'])
+    else:
+        args = ['-c:a', settings['codec'], '-b:a', settings['bitrate']]
+    if 'sample_rate' in settings:
+        args += ['-ar', str(settings['sample_rate'])]
+    return args
+
+def variant_filename(track, variant, settings):
+    """File name of one variant of a track, e.g. battle.opus-96k.opus."""
+    return f"{track}.{variant}.{settings['extension']}"
+
+def encode_variants(blocks, output_dir, track, sample_rate=44100, channels=1, quality=4, variants=ENCODE_MATRIX):
+    """Encode blocks to <track>.ogg and every variant at once.
+
+    The main OGG uses Vorbis at quality, as encode_to_ogg would. Files are
+    replaced only if every encoder succeeds, so the matrix on disk always
+    comes from one render. Returns (ok, entries): ok is False if any encode
+    failed, in which case no file was touched and entries is empty;
+    otherwise entries are the variants manifest entries, smallest first.
+    Raises OSError if ffmpeg cannot be started.
+    """
+    settings = {DEFAULT_VARIANT: {'codec': 'libvorbis', 'quality': quality, 'extension': 'ogg'}}
+    settings.update(variants)
+    files = {variant: os.path.join(output_dir, f'{track}.ogg' if variant == DEFAULT_VARIANT
+                                   else variant_filename(track, variant, variant_settings))
+             for variant, variant_settings in settings.items()}
+
+    frames = 0
+    def counted(blocks):
+        nonlocal frames
+        for block in blocks:
+            frames += len(block)
+            yield block
+
+    failed = tee_to_ffmpeg(counted(blocks), {files[variant]: codec_args(variant_settings)
+                                             for variant, variant_settings in settings.items()},
+                           sample_rate, channels, all_or_nothing=True)
+    duration = frames / sample_rate
+    entries = []
+    for variant, path in files.items():
+        if path in failed:
+            continue
+        size = os.path.getsize(path)
+        print(f"Encoded {os.path.basename(path)}: {size / 1024:.0f} KB")
+        entries.append({
+            'variant': variant,
+            'file': os.path.basename(path),
+            'codec': settings[variant]['codec'],
+            'sample_rate': settings[variant].get('sample_rate', sample_rate),
+            'channels': channels,
+            'bytes': size,
+            'bitrate_kbps': round(size * 8 / duration / 1000, 1) if duration else 0.0,
+            'duration': round(duration, 3),
+        })
+    entries.sort(key=lambda entry: entry['bytes'])
+    return not failed, entries
+
+def variants_missing(entry, variants, output_dir):
+    """Return True unless entry lists every variant and all of its files exist."""
+    if entry is None:
+        return True
+    listed = {item['variant'] for item in entry}
+    return (not set(variants) <= listed
+            or not all(os.path.exists(os.path.join(output_dir, item['file'])) for item in entry))
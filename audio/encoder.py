@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Encoding float PCM blocks without intermediate files.
+Blocks are converted to 16-bit PCM and piped into ffmpeg subprocesses as
+they are produced, so encoding overlaps rendering; several encodes of the
+same blocks run side by side, one process each.
+"""
+
+import contextlib
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+CHUNK_FRAMES = 4096  # Frames per write when a whole track is passed as one block
+
+def ffmpeg_available():
+    """Return True if an ffmpeg binary is on the PATH."""
+    return shutil.which('ffmpeg') is not None
+
+def pcm16_chunks(blocks):
+    """Yield interleaved 16-bit PCM bytes for float blocks of shape (n,) or (n, channels).
+
+    Samples beyond full scale are clipped; converting them unclipped would
+    wrap them around to the opposite sign, which is heard as a loud click.
+    """
+    for block in blocks:
+        for start in range(0, len(block), CHUNK_FRAMES):
+            yield np.int16(np.clip(block[start:start + CHUNK_FRAMES], -1.0, 1.0) * 32767).tobytes()
+
+def write_wav_blocks(blocks, filename, sample_rate=44100, channels=1):
+    """Write float blocks to a 16-bit WAV file as they are produced."""
+    with wave.open(filename, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        for chunk in pcm16_chunks(blocks):
+            wav_file.writeframes(chunk)
+    print(f"Saved WAV file: {filename}")
+    return filename
+
+def ffmpeg_command(output, sample_rate=44100, channels=1, codec_args=()):
+    """ffmpeg arguments encoding 16-bit PCM from stdin to output ('pipe:1' for stdout)."""
+    return ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), '-i', 'pipe:0',
+            *codec_args, output]
+
+def ogg_codec_args(quality=4):
+    """ffmpeg codec arguments for Ogg Vorbis at a VBR quality level."""
+    return ['-c:a', 'libvorbis', '-q:a', str(quality)]
+
+def temp_output(output_filename):
+    """Per-process temporary name for an output, keeping its extension so ffmpeg picks the format."""
+    root, extension = os.path.splitext(output_filename)
+    return f'{root}.{os.getpid()}.tmp{extension}'
+
+def _stop(process):
+    """Kill an encoder and reap it."""
+    process.kill()
+    with contextlib.suppress(BrokenPipeError):
+        process.stdin.close()
+    process.wait()
+
+def tee_to_ffmpeg(blocks, outputs, sample_rate=44100, channels=1, all_or_nothing=False):
+    """Encode float blocks to several outputs at once, one ffmpeg process each.
+
+    outputs maps output filename -> codec arguments. Every PCM chunk is
+    written to all encoders as it is produced, so they run concurrently with
+    each other and with rendering. Each encoder's stderr goes to a temporary
+    file rather than a pipe, so a chatty ffmpeg can never fill a pipe nobody
+    reads and stall while we block writing its stdin.
+
+    Each output is encoded to a temporary name and renamed into place when
+    its encoder succeeds, so a failed encode never replaces a good file.
+    With all_or_nothing, outputs are renamed only once every encoder has
+    succeeded, and otherwise all of them count as failed. If rendering
+    raises, every encoder is killed and its partial file deleted before the
+    exception propagates. Returns the list of outputs that failed. Raises
+    OSError if ffmpeg cannot be started.
+    """
+    processes = {}
+    logs = {}
+    try:
+        for output_filename, codec_args in outputs.items():
+            cmd = ffmpeg_command(temp_output(output_filename), sample_rate, channels, codec_args)
+            logs[output_filename] = tempfile.TemporaryFile()
+            processes[output_filename] = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                                          stdout=subprocess.DEVNULL,
+                                                          stderr=logs[output_filename])
+
+        writing = dict(processes)
+        for chunk in pcm16_chunks(blocks):
+            for output_filename, process in list(writing.items()):
+                try:
+                    process.stdin.write(chunk)
+                except BrokenPipeError:
+                    del writing[output_filename]  # ffmpeg exited early; its stderr explains why
+
+        returncodes = {}
+        for output_filename, process in processes.items():
+            with contextlib.suppress(BrokenPipeError):
+                process.stdin.close()
+            returncodes[output_filename] = process.wait()
+    except BaseException:
+        for process in processes.values():
+            _stop(process)
+        for output_filename, log in logs.items():
+            log.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_output(output_filename))
+        raise
+
+    failed = []
+    for output_filename, returncode in returncodes.items():
+        with logs[output_filename] as log:
+            log.seek(0)
+            stderr = log.read().decode(errors='replace')
+        if returncode != 0:
+            print(f"Error encoding {output_filename}: {stderr}")
+            failed.append(output_filename)
+    if all_or_nothing and failed:
+        failed = list(outputs)
+    for output_filename in outputs:
+        if output_filename in failed:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_output(output_filename))
+        else:
+            os.replace(temp_output(output_filename), output_filename)
+    return failed
+
+def pipe_to_ffmpeg(blocks, output_filename, sample_rate=44100, channels=1, codec_args=()):
+    """Encode float blocks by piping raw PCM into ffmpeg's stdin.
+
+    Returns True on success. Raises OSError if ffmpeg cannot be started.
+    """
+    return not tee_to_ffmpeg(blocks, {output_filename: codec_args}, sample_rate, channels)
+
+def pipe_to_ogg(blocks, ogg_filename, sample_rate=44100, channels=1, quality=4):
+    """Encode float blocks to Ogg Vorbis through ffmpeg's stdin."""
+    return pipe_to_ffmpeg(blocks, ogg_filename, sample_rate, channels, ogg_codec_args(quality))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Cached amplitude envelopes shared by every voice.
+An ADSR envelope depends only on its segment lengths, sustain level and
+note length, so each shape is built once, kept read-only in an LRU cache
+and multiplied into note samples in place.
+"""
+
+import numpy as np
+
+from note_cache import NoteCache
+from precision import sample_dtype
+
+# Envelopes are small next to rendered notes; 32 MB holds thousands of shapes
+ENVELOPE_CACHE = NoteCache(max_bytes=32 * 1024 * 1024)
+
+def segment_lengths(length, attack, decay, release):
+    """Fit attack, decay and release (in samples) into a note of length samples.
+
+    The release may overlap the decay, but when the attack and decay run past
+    the end of the note or the release is as long as the note, all three are
+    shrunk in proportion so the note still rises, decays and ends silent.
+    """
+    if attack + decay > length or release >= length:
+        scale = length / (attack + decay + release)
+        attack, decay, release = int(attack * scale), int(decay * scale), int(release * scale)
+    return attack, decay, release
+
+def _build_envelope(length, attack, decay, sustain, release, decay_rate, sample_rate, dtype):
+    attack, decay, release = segment_lengths(length, attack, decay, release)
+    envelope = np.full(length, sustain, dtype=dtype)
+    envelope[:attack] = np.linspace(0, 1, attack)
+    envelope[attack:attack + decay] = np.linspace(1, sustain, decay)
+    if release:
+        # Written last, so it takes over from a decay that is still running
+        envelope[-release:] = np.linspace(sustain, 0, release)
+    if decay_rate:
+        # Exponential fade over the whole note (struck and plucked sounds)
+        envelope *= np.exp(-decay_rate / sample_rate * np.arange(length))
+    return envelope
+
+def adsr_envelope(length, sample_rate=44100, attack=0.0, decay=0.0, sustain=1.0, release=0.0,
+                  decay_rate=0.0, dtype=None):
+    """Return the cached, read-only envelope for a note of length samples.
+
+    attack, decay and release are in seconds; the attack rises from 0 to 1,
+    the decay falls to the sustain level and the release falls from it to 0
+    at the end of the note. A non-zero decay_rate multiplies the whole
+    envelope by exp(-decay_rate * t). dtype defaults to the sample dtype.
+    """
+    dtype = np.dtype(dtype or sample_dtype())
+    key = (length, int(attack * sample_rate), int(decay * sample_rate), sustain,
+           int(release * sample_rate), decay_rate, sample_rate, dtype.name)
+    envelope = ENVELOPE_CACHE.get(key)
+    if envelope is None:
+        envelope = _build_envelope(*key[:-1], dtype)
+        ENVELOPE_CACHE.put(key, envelope)
+    return envelope
+
+def apply_envelope(samples, sample_rate=44100, attack=0.0, decay=0.0, sustain=1.0, release=0.0,
+                   decay_rate=0.0):
+    """Multiply samples by their cached envelope in place and return them."""
+    samples *= adsr_envelope(len(samples), sample_rate, attack, decay, sustain, release,
+                             decay_rate, samples.dtype)
+    return samples
@@ -7,69 +7,70 @@ import numpy as np
 from scipy.io import wavfile
 import subprocess
 import os
+import noise
+import wavetable
+from convolution_reverb import apply_convolution_reverb
+from drum_bank import ROUND_ROBIN, one_shot, round_robin, uses_round_robin
+from envelope import apply_envelope
+from note_cache import NOTE_CACHE, print_cache_stats
+from encoder import ffmpeg_available, pipe_to_ogg, write_wav_blocks
+from noise import BUILD_SEED, NoiseSource, seeded_voice
+from profiling import stage
+from sections import reused_sounds
+from precision import as_samples, cycles, ramp, sample_dtype, set_sample_dtype
+from score import (DRUM_PITCHES, MIDI_FREQUENCIES, beat_lengths, event_frequencies, events_length,
+                   part_events, step_starts)
 
-# Musical notes frequencies (Hz) - Extended range C2 to B5
-NOTES = {
-    # Bass octaves
-    'C2': 65.41, 'D2': 73.42, 'E2': 82.41, 'F2': 87.31,
-    'G2': 98.00, 'A2': 110.00, 'B2': 123.47,
-    'C3': 130.81, 'D3': 146.83, 'E3': 164.81, 'F3': 174.61,
-    'G3': 196.00, 'A3': 220.00, 'B3': 246.94,
-    # Mid octaves
-    'C4': 261.63, 'D4': 293.66, 'E4': 329.63, 'F4': 349.23,
-    'G4': 392.00, 'A4': 440.00, 'B4': 493.88,
-    'C5': 523.25, 'D5': 587.33, 'E5': 659.25, 'F5': 698.46,
-    'G5': 783.99, 'A5': 880.00, 'B5': 987.77,
-    'rest': 0.0
-}
-
-def generate_tone(frequency, duration, sample_rate=44100, amplitude=0.3):
+# Output channel layouts for the mixer and encoders
+MONO = 'mono'
+STEREO = 'stereo'
+LAYOUT_CHANNELS = {MONO: 1, STEREO: 2}
+
+def generate_tone(frequency, duration, sample_rate=44100, amplitude=0.3, use_wavetable=False):
     """Generate a sine wave tone for a given frequency and duration."""
     if frequency == 0:  # Rest note
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    # Add slight envelope to avoid clicks
-    envelope = np.ones_like(t)
-    fade_samples = int(0.01 * sample_rate)  # 10ms fade
-    envelope[:fade_samples] = np.linspace(0, 1, fade_samples)
-    envelope[-fade_samples:] = np.linspace(1, 0, fade_samples)
+    phase = cycles(frequency, t)
     
     # Generate tone with harmonics for richer sound
-    tone = amplitude * envelope * (
-        np.sin(2 * np.pi * frequency * t) +  # Fundamental
-        0.3 * np.sin(4 * np.pi * frequency * t) +  # 2nd harmonic
-        0.1 * np.sin(6 * np.pi * frequency * t)  # 3rd harmonic
-    )
-    return tone
+    if use_wavetable:
+        tone = wavetable.TONE.render(phase, frequency, sample_rate)
+    else:
+        tone = (
+            np.sin(2 * np.pi * phase) +  # Fundamental
+            0.3 * np.sin(4 * np.pi * phase) +  # 2nd harmonic
+            0.1 * np.sin(6 * np.pi * phase)  # 3rd harmonic
+        )
+    tone *= amplitude
+    
+    # Add slight envelope to avoid clicks (10ms fades)
+    return apply_envelope(tone, sample_rate, attack=0.01, release=0.01)
 
-def generate_bass_tone(frequency, duration, sample_rate=44100, amplitude=0.4):
+def generate_bass_tone(frequency, duration, sample_rate=44100, amplitude=0.4, use_wavetable=False):
     """Generate a bass tone with deeper, rounder sound."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # ADSR envelope for bass
-    attack = int(0.02 * sample_rate)
-    decay = int(0.05 * sample_rate)
-    sustain_level = 0.7
-    release = int(0.1 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    envelope[:attack] = np.linspace(0, 1, attack)
-    envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
+    phase = cycles(frequency, t)
     
     # Bass sound with fundamental and light harmonics
-    tone = amplitude * envelope * (
-        np.sin(2 * np.pi * frequency * t) +  # Strong fundamental
-        0.2 * np.sin(np.pi * frequency * t) +  # Sub-harmonic
-        0.1 * np.sin(4 * np.pi * frequency * t)  # Light 2nd harmonic
-    )
-    return tone
+    if use_wavetable:
+        tone = wavetable.BASS.render(phase / 2, frequency / 2, sample_rate)
+    else:
+        tone = (
+            np.sin(2 * np.pi * phase) +  # Strong fundamental
+            0.2 * np.sin(np.pi * phase) +  # Sub-harmonic
+            0.1 * np.sin(4 * np.pi * phase)  # Light 2nd harmonic
+        )
+    tone *= amplitude
+    
+    # ADSR envelope for bass
+    return apply_envelope(tone, sample_rate, attack=0.02, decay=0.05, sustain=0.7, release=0.1)
 
+@one_shot
 def generate_kick_drum(duration, sample_rate=44100, amplitude=0.8):
     """Generate a kick drum sound using synthesis."""
     t = np.linspace(0, duration, int(sample_rate * duration), False)
@@ -77,119 +78,173 @@ def generate_kick_drum(duration, sample_rate=44100, amplitude=0.8):
     # Pitch envelope - starts high and drops quickly
     pitch_envelope = 60 * np.exp(-35 * t) + 40
     
-    # Amplitude envelope - sharp attack, quick decay
-    amp_envelope = np.exp(-10 * t)
-    
     # Synthesize kick with sine wave and noise
-    kick = amplitude * amp_envelope * (
-        0.7 * np.sin(2 * np.pi * pitch_envelope * t) +  # Pitched component
-        0.3 * np.random.normal(0, 0.1, len(t)) * np.exp(-50 * t)  # Click/noise
+    kick = (
+        0.7 * np.sin(2 * np.pi * cycles(pitch_envelope, t)) +  # Pitched component
+        0.3 * as_samples(noise.normal(0, 0.1, len(t))) * np.exp(-50 * as_samples(t))  # Click/noise
     )
-    return kick
+    kick *= amplitude
+    
+    # Amplitude envelope - sharp attack, quick decay
+    return apply_envelope(kick, sample_rate, decay_rate=10)
 
+@one_shot
 def generate_snare_drum(duration, sample_rate=44100, amplitude=0.6):
     """Generate a snare drum sound using noise and tone."""
     t = np.linspace(0, duration, int(sample_rate * duration), False)
     
-    # Amplitude envelope
-    amp_envelope = np.exp(-15 * t)
-    
     # Mix of tone and noise
     tone_freq = 200
-    snare = amplitude * amp_envelope * (
-        0.3 * np.sin(2 * np.pi * tone_freq * t) +  # Tonal component
-        0.7 * np.random.normal(0, 1, len(t))  # Noise (snare rattle)
+    snare = (
+        0.3 * np.sin(2 * np.pi * cycles(tone_freq, t)) +  # Tonal component
+        0.7 * as_samples(noise.normal(0, 1, len(t)))  # Noise (snare rattle)
     )
+    snare *= amplitude
+    
+    # Amplitude envelope
+    apply_envelope(snare, sample_rate, decay_rate=15)
     
     # High-pass filter effect (crude but effective)
-    snare = snare - np.mean(snare)
+    snare -= np.mean(snare)
     return snare
 
+@one_shot
 def generate_hihat(duration, sample_rate=44100, amplitude=0.3, closed=True):
     """Generate a hi-hat sound (closed or open)."""
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
+    n_samples = int(sample_rate * duration)
+    
+    # High-frequency noise
+    hihat = amplitude * as_samples(noise.normal(0, 1, n_samples))
     
     # Different decay for closed vs open hi-hat
     decay_rate = 50 if closed else 10
-    amp_envelope = np.exp(-decay_rate * t)
-    
-    # High-frequency noise
-    hihat = amplitude * amp_envelope * np.random.normal(0, 1, len(t))
+    apply_envelope(hihat, sample_rate, decay_rate=decay_rate)
     
     # Simple high-pass filter simulation
-    hihat = hihat - np.mean(hihat)
+    hihat -= np.mean(hihat)
     return hihat
 
-def generate_string_tone(frequency, duration, sample_rate=44100, amplitude=0.3, instrument='violin'):
+def generate_string_tone(frequency, duration, sample_rate=44100, amplitude=0.3, instrument='violin',
+                         use_wavetable=False):
     """Generate string instrument sound using sawtooth waves."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # ADSR envelope for strings
-    attack = int(0.05 * sample_rate) if instrument == 'violin' else int(0.08 * sample_rate)
-    decay = int(0.1 * sample_rate)
-    sustain_level = 0.8
-    release = int(0.15 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    envelope[:attack] = np.linspace(0, 1, attack)
-    envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
-    
-    # Sawtooth wave synthesis for string-like sound
-    sawtooth = 2 * (t * frequency % 1) - 1
+    phase = cycles(frequency, t)
     
     # Add vibrato for realism
     vibrato_freq = 5.0  # Hz
     vibrato_depth = 0.01 if instrument == 'violin' else 0.005
     vibrato = 1 + vibrato_depth * np.sin(2 * np.pi * vibrato_freq * t)
     
-    # Combine sawtooth with harmonics
-    tone = amplitude * envelope * (
-        0.6 * sawtooth +  # Main sawtooth
-        0.2 * np.sin(2 * np.pi * frequency * t * vibrato) +  # Fundamental with vibrato
-        0.1 * np.sin(4 * np.pi * frequency * t) +  # 2nd harmonic
-        0.1 * np.sin(3 * np.pi * frequency * t)  # 3rd harmonic
-    )
+    if use_wavetable:
+        # Band-limited sawtooth and harmonics, plus the vibrato fundamental
+        tone = wavetable.STRING.render(phase / 2, frequency / 2, sample_rate)
+        tone += 0.2 * wavetable.SINE.render(cycles(frequency, t * vibrato), frequency, sample_rate)
+    else:
+        # Sawtooth wave synthesis for string-like sound
+        sawtooth = 2 * ramp(frequency, t) - 1
+        
+        # Combine sawtooth with harmonics
+        tone = (
+            0.6 * sawtooth +  # Main sawtooth
+            0.2 * np.sin(2 * np.pi * cycles(frequency, t * vibrato)) +  # Fundamental with vibrato
+            0.1 * np.sin(4 * np.pi * phase) +  # 2nd harmonic
+            0.1 * np.sin(3 * np.pi * phase)  # 3rd harmonic
+        )
+    tone *= amplitude
     
-    return tone
+    # ADSR envelope for strings
+    return apply_envelope(tone, sample_rate, **string_adsr(instrument))
+
+def string_adsr(instrument='violin'):
+    """ADSR settings (seconds) shared by the string voices."""
+    attack = 0.05 if instrument == 'violin' else 0.08
+    return {'attack': attack, 'decay': 0.1, 'sustain': 0.8, 'release': 0.15}
+
+def string_waveforms(frequencies, t, vibrato, sample_rate=44100, use_wavetable=False):
+    """Unenveloped string waveforms, one row per frequency, each peaking at or below 1."""
+    frequencies = np.asarray(frequencies, dtype=float)[:, np.newaxis]
+    phases = cycles(frequencies, t)
+    vibrato_phases = cycles(frequencies, t * vibrato)
+    
+    if use_wavetable:
+        # Each row is band-limited for its own note, so tables cannot be shared
+        rows = np.empty_like(phases)
+        for row, phase, vibrato_phase, frequency in zip(rows, phases, vibrato_phases, frequencies[:, 0]):
+            row[:] = wavetable.STRING.render(phase / 2, frequency / 2, sample_rate)
+            row += 0.2 * wavetable.SINE.render(vibrato_phase, frequency, sample_rate)
+        return rows
+    
+    # Accumulate in place; the (notes x samples) temporaries dominate the cost
+    half_phase = np.pi * phases
+    rows = np.sin(2 * np.pi * vibrato_phases)  # Fundamental with vibrato
+    rows *= 0.2
+    rows += 0.1 * np.sin(4 * half_phase)  # 2nd harmonic
+    rows += 0.1 * np.sin(3 * half_phase)  # 3rd harmonic
+    sawtooth = ramp(frequencies, t)
+    sawtooth *= 1.2
+    sawtooth -= 0.6
+    rows += sawtooth  # Main sawtooth
+    return rows
 
-def generate_piano_tone(frequency, duration, sample_rate=44100, amplitude=0.35):
+def generate_string_chord(frequencies, duration, sample_rate=44100, amplitude=0.3, instrument='violin',
+                          use_wavetable=False):
+    """Generate a summed chord of string tones sharing one envelope and vibrato.
+    
+    Tones missing from the note cache are synthesized together as one
+    (notes x samples) array; the envelope and amplitude are applied once to
+    the sum. Each tone peaks at or below amplitude, so a chord of n tones
+    never exceeds n * amplitude.
+    """
+    n_samples = int(sample_rate * duration)
+    t = np.linspace(0, duration, n_samples, False)
+    vibrato_depth = 0.01 if instrument == 'violin' else 0.005
+    vibrato = 1 + vibrato_depth * np.sin(2 * np.pi * 5.0 * t)
+    
+    # Raw waveforms are cached per tone, independent of amplitude and envelope
+    keys = [('generate_music.string_waveforms', frequency, n_samples, sample_rate, instrument,
+             use_wavetable, sample_dtype().name) for frequency in frequencies]
+    rows = [NOTE_CACHE.get(key) for key in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        rendered = string_waveforms([frequencies[i] for i in missing], t, vibrato, sample_rate,
+                                    use_wavetable)
+        for i, row in zip(missing, rendered):
+            NOTE_CACHE.put(keys[i], row)
+            rows[i] = row
+    
+    chord = np.array(rows[0])  # Writable copy; cached rows are read-only
+    for row in rows[1:]:
+        chord += row
+    chord *= amplitude
+    return apply_envelope(chord, sample_rate, **string_adsr(instrument))
+
+def generate_piano_tone(frequency, duration, sample_rate=44100, amplitude=0.35, use_wavetable=False):
     """Generate piano-like sound with quick attack and gradual decay."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # Piano-like ADSR envelope
-    attack = int(0.005 * sample_rate)  # Very quick attack
-    decay = int(0.1 * sample_rate)
-    sustain_level = 0.6
-    release = int(0.3 * sample_rate)
-    
-    # Create envelope
-    envelope = np.ones_like(t) * sustain_level
-    envelope[:attack] = np.linspace(0, 1, attack)
-    envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    
-    # Exponential decay for piano
-    decay_rate = 2.0  # Decay speed
-    exp_decay = np.exp(-decay_rate * t)
-    envelope = envelope * exp_decay
+    phase = cycles(frequency, t)
     
     # Piano harmonics (fundamental + overtones)
-    tone = amplitude * envelope * (
-        1.0 * np.sin(2 * np.pi * frequency * t) +  # Fundamental
-        0.4 * np.sin(4 * np.pi * frequency * t) +  # 2nd harmonic
-        0.2 * np.sin(6 * np.pi * frequency * t) +  # 3rd harmonic
-        0.1 * np.sin(8 * np.pi * frequency * t) +  # 4th harmonic
-        0.05 * np.sin(10 * np.pi * frequency * t)  # 5th harmonic
-    )
-    
-    return tone
+    if use_wavetable:
+        tone = wavetable.PIANO.render(phase, frequency, sample_rate)
+    else:
+        tone = (
+            1.0 * np.sin(2 * np.pi * phase) +  # Fundamental
+            0.4 * np.sin(4 * np.pi * phase) +  # 2nd harmonic
+            0.2 * np.sin(6 * np.pi * phase) +  # 3rd harmonic
+            0.1 * np.sin(8 * np.pi * phase) +  # 4th harmonic
+            0.05 * np.sin(10 * np.pi * phase)  # 5th harmonic
+        )
+    tone *= amplitude
+    
+    # Piano-like envelope: very quick attack, then an exponential decay
+    # (decay_rate 2.0) instead of a release
+    return apply_envelope(tone, sample_rate, attack=0.005, decay=0.1, sustain=0.6, decay_rate=2.0)
 
 def create_melody():
     """Create a simple melody - 'Ode to Joy' theme."""
@@ -304,16 +359,156 @@ def create_piano_arpeggios():
     ]
     return arpeggios
 
+def note_lengths(part, beat_duration, sample_rate=44100):
+    """Return per-note durations in seconds and lengths in samples as arrays."""
+    return beat_lengths([beats for _, beats in part], beat_duration, sample_rate)
+
+def part_length(part, beat_duration, sample_rate=44100):
+    """Return the length of a rendered (note, beats) or compiled event part in samples."""
+    if isinstance(part, np.ndarray):
+        return events_length(part)
+    return int(note_lengths(part, beat_duration, sample_rate)[1].sum())
+
+def event_sounds(events, voice, sample_rate=44100, durations=None, table=MIDI_FREQUENCIES):
+    """Yield (onset, samples) for every step of one voice's events, in order.
+
+    Frequencies of all events are looked up in one go. Each step (a note, a
+    drum hit or the rows of a chord) is rendered by
+    voice(pitches, frequencies, duration, sample_rate) and scaled by its
+    velocity. durations holds each step's duration in seconds; by default it
+    comes from a compiled 'duration' field or is derived from the sample length.
+    """
+    starts, _, step_sound = _event_steps(events, voice, sample_rate, durations, table)
+    for k, start in enumerate(starts):
+        yield int(events['onset'][start]), step_sound(k)
+
+def _event_steps(events, voice, sample_rate, durations, table):
+    """First row and sound key of every step, and a function rendering step k.
+
+    Steps with equal keys sound the same. Each step renders at a round-robin
+    position counting earlier steps with its pitches, length, velocity and
+    duration, so banked drum hits vary by their place in the score rather
+    than by render order; for voices that use it the position is part of
+    the key.
+    """
+    starts = step_starts(events)
+    stops = np.append(starts[1:], len(events))
+    frequencies = event_frequencies(events, table)
+    if durations is None and 'duration' in events.dtype.names:
+        durations = events['duration'][starts]
+    elif durations is None:
+        # Half a sample of slack so int(sample_rate * duration) gives the length back
+        durations = (events['length'][starts] + 0.5) / sample_rate
+
+    pitches = events['pitch'].tolist()
+    keys = list(zip([tuple(pitches[start:stop]) for start, stop in zip(starts, stops)],
+                    events['length'][starts].tolist(), events['velocity'][starts].tolist(),
+                    np.asarray(durations, dtype=float).tolist()))
+    hits = {}
+    positions = []
+    for key in keys:
+        positions.append(hits.get(key, 0))
+        hits[key] = (positions[-1] + 1) % ROUND_ROBIN
+    if uses_round_robin(voice):
+        keys = [key + (position,) for key, position in zip(keys, positions)]
+
+    def step_sound(k):
+        start, stop = starts[k], stops[k]
+        with round_robin(positions[k]):
+            sound = voice(events['pitch'][start:stop], frequencies[start:stop], durations[k], sample_rate)
+        velocity = float(events['velocity'][start])
+        return sound if velocity == 1 else sound * velocity
+    return starts, keys, step_sound
+
+def section_sounds(events, voice, sample_rate=44100, durations=None, table=MIDI_FREQUENCIES):
+    """Yield (onset, samples) for one voice's events, rendering repeated sections once.
+
+    Steps with the same pitches, length, duration and velocity (and, for
+    banked drums, round-robin position) sound the same, so a run of them
+    that recurs with the same spacing is rendered once and yielded at each
+    occurrence. Unlike event_sounds the sounds come out of order, so add
+    them into place; either way every step sounds the same.
+    """
+    starts, keys, step_sound = _event_steps(events, voice, sample_rate, durations, table)
+    return reused_sounds(keys, events['onset'][starts], step_sound)
+
+def part_sounds(part, voice, beat_duration, sample_rate=44100):
+    """Yield (onset, samples) for a (note, beats) part, with its exact note durations.
+
+    part may also be an event array, such as a compiled part.
+    """
+    if isinstance(part, np.ndarray):
+        return event_sounds(part, voice, sample_rate)
+    durations, lengths = note_lengths(part, beat_duration, sample_rate)
+    events = part_events(part, beat_duration, sample_rate)
+    return event_sounds(events, voice, sample_rate, durations[lengths > 0])
+
+def render_events(events, voice, sample_rate=44100, durations=None):
+    """Render one voice's events into a preallocated track.
+
+    Every step or repeated section is added straight into place, so the cost
+    grows with the amount of distinct material rather than the number of
+    events; a repeated bar costs one addition per repeat.
+    """
+    track = np.zeros(events_length(events), dtype=sample_dtype())
+    for onset, sound in section_sounds(events, voice, sample_rate, durations):
+        track[onset:onset + len(sound)] += sound
+    return track
+
+def render_part(part, voice, beat_duration, sample_rate=44100):
+    """Render a (note, beats) part or compiled event part into one preallocated track.
+
+    List parts are converted to events first, so all onsets, lengths and
+    frequencies are computed up front in a few array operations.
+    """
+    if isinstance(part, np.ndarray):
+        return render_events(part, voice, sample_rate)
+    durations, lengths = note_lengths(part, beat_duration, sample_rate)
+    return render_events(part_events(part, beat_duration, sample_rate), voice, sample_rate,
+                         durations[lengths > 0])
+
+def pitched_voice(tone_fn, transpose=1.0, **kwargs):
+    """Wrap a tone generator as a timeline voice for single notes."""
+    def voice(pitches, frequencies, duration, sample_rate):
+        frequency = float(frequencies[0]) * transpose
+        return tone_fn(frequency, duration, sample_rate, **kwargs)
+    voice.round_robin = uses_round_robin(tone_fn)
+    return voice
+
+def chord_voice(chord_fn, peak, **kwargs):
+    """Wrap a chord generator as a timeline voice for chords peaking at most at peak.
+
+    chord_fn(frequencies, duration, sample_rate, amplitude, ...) renders a
+    tuple of frequencies whose tones each peak at or below amplitude, so
+    giving every tone peak / n keeps the chord within peak without a scan.
+    """
+    def voice(pitches, frequencies, duration, sample_rate):
+        frequencies = tuple(float(frequency) for frequency in frequencies if frequency > 0)
+        if not frequencies:
+            return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
+        return chord_fn(frequencies, duration, sample_rate, amplitude=peak / len(frequencies), **kwargs)
+    return voice
+
+def drum_voice(kick=0.8, snare=0.6, hihat=0.4, closed=True):
+    """Timeline voice for 'kick', 'snare', 'hihat' and 'rest' hits."""
+    def voice(pitches, frequencies, duration, sample_rate):
+        drum_pitch = pitches[0]
+        if drum_pitch == DRUM_PITCHES['kick']:
+            return generate_kick_drum(duration, sample_rate, amplitude=kick)
+        elif drum_pitch == DRUM_PITCHES['snare']:
+            return generate_snare_drum(duration, sample_rate, amplitude=snare)
+        elif drum_pitch == DRUM_PITCHES['hihat']:
+            return generate_hihat(duration, sample_rate, amplitude=hihat, closed=closed)
+        else:  # rest
+            return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
+    voice.round_robin = True
+    return voice
+
 def generate_audio(melody, tempo=120, sample_rate=44100):
     """Generate audio from melody."""
     beat_duration = 60.0 / tempo  # Duration of one beat in seconds
-    audio = np.array([])
-    
-    for note, duration in melody:
-        frequency = NOTES[note]
-        tone = generate_tone(frequency, duration * beat_duration, sample_rate)
-        audio = np.concatenate([audio, tone])
-    
+    audio = render_part(melody, pitched_voice(generate_tone), beat_duration, sample_rate)
+
     # Normalize to prevent clipping
     audio = audio / np.max(np.abs(audio))
     return audio
@@ -363,72 +558,157 @@ def convert_to_ogg_with_python(wav_filename, ogg_filename='output.ogg'):
     print("- https://convertio.co/wav-ogg/")
     return None
 
+def encode_to_ogg(blocks, ogg_filename='output.ogg', sample_rate=44100, channels=1, quality=4,
+                  wav_filename='output.wav'):
+    """Encode audio blocks to OGG by piping them into ffmpeg, with no WAV on disk.
+    
+    A whole track may be passed as a single block. When ffmpeg cannot be
+    started, the blocks are written to wav_filename and converted with
+    convert_to_ogg instead.
+    """
+    if ffmpeg_available():
+        try:
+            with stage('ffmpeg'):
+                encoded = pipe_to_ogg(blocks, ogg_filename, sample_rate, channels, quality)
+            if encoded:
+                print(f"Successfully encoded OGG: {ogg_filename}")
+                return ogg_filename
+            return None
+        except OSError as e:
+            print(f"Could not start ffmpeg ({e}), falling back to a WAV file...")
+    
+    with stage('write WAV'):
+        wav_file = write_wav_blocks(blocks, wav_filename, sample_rate, channels)
+    with stage('ffmpeg'):
+        ogg_file = convert_to_ogg(wav_file, ogg_filename)
+    if ogg_file:
+        os.remove(wav_file)
+    return ogg_file
+
 def apply_reverb(audio, sample_rate=44100, room_size=0.3, decay=0.5):
     """Apply simple reverb effect to audio."""
     # Simple reverb using delays and decay
     delays = [int(0.029 * sample_rate), int(0.037 * sample_rate), 
               int(0.043 * sample_rate), int(0.053 * sample_rate)]
     
-    reverb_signal = np.copy(audio)
+    # Allocate the output once, long enough for the longest delay
+    reverb_signal = np.zeros(len(audio) + max(delays), dtype=audio.dtype)
+    reverb_signal[:len(audio)] = audio
     
     for delay_samples in delays:
-        delayed = np.zeros(len(audio) + delay_samples)
-        delayed[delay_samples:delay_samples + len(audio)] = audio * decay
-        
-        # Pad reverb_signal if needed
-        if len(delayed) > len(reverb_signal):
-            reverb_signal = np.pad(reverb_signal, (0, len(delayed) - len(reverb_signal)))
-        
-        reverb_signal[:len(delayed)] += delayed * room_size
+        reverb_signal[delay_samples:delay_samples + len(audio)] += (audio * decay) * room_size
     
     return reverb_signal
 
+def pan_gains(pan_position, layout=STEREO):
+    """Channel gains for a pan position from -1 (left) to 1 (right).
+
+    Stereo uses a constant-power pan law; the mono gain is the average of
+    the two stereo gains, i.e. the stereo pan folded down to one channel.
+    """
+    # Plain floats, so float32 audio is not promoted by float64 scalars
+    left_gain = float(np.sqrt(0.5 * (1.0 - pan_position)))
+    right_gain = float(np.sqrt(0.5 * (1.0 + pan_position)))
+    if layout == MONO:
+        return (0.5 * (left_gain + right_gain),)
+    return left_gain, right_gain
+
 def pan_stereo(audio, pan_position):
-    """Pan audio in stereo field. pan_position: -1 (left) to 1 (right)."""
-    # Convert mono to stereo with panning
-    left_gain = np.sqrt(0.5 * (1.0 - pan_position))
-    right_gain = np.sqrt(0.5 * (1.0 + pan_position))
-    
-    stereo = np.zeros((len(audio), 2))
-    stereo[:, 0] = audio * left_gain  # Left channel
-    stereo[:, 1] = audio * right_gain  # Right channel
-    
+    """Pan mono audio into an (n, 2) stereo buffer. pan_position: -1 (left) to 1 (right)."""
+    stereo = np.zeros((len(audio), 2), dtype=audio.dtype)
+    for channel, gain in enumerate(pan_gains(pan_position, STEREO)):
+        stereo[:, channel] = audio * gain
     return stereo
 
-def mix_tracks_stereo(tracks_with_panning, sample_rate=44100):
-    """Mix multiple audio tracks with stereo panning and reverb."""
-    # tracks_with_panning: list of (track, pan_position, reverb_amount) tuples
-    
+def apply_track_reverb(track, reverb_amt, sample_rate=44100, reverb='delay'):
+    """Apply a part's reverb send: 'delay' or 'convolution' at reverb_amt, none at 0."""
+    if reverb_amt > 0 and reverb == 'convolution':
+        return apply_convolution_reverb(track, sample_rate, wet=reverb_amt)
+    if reverb_amt > 0:
+        return apply_reverb(track, sample_rate, room_size=reverb_amt)
+    return track
+
+def mix_tracks(tracks_with_panning, sample_rate=44100, reverb='delay', layout=MONO):
+    """Mix tracks with panning and reverb into a mono (n,) or stereo (n, 2) buffer.
+    
+    tracks_with_panning is a list of (track, pan_position, reverb_amount)
+    tuples. reverb is 'delay' for the tapped delay line or 'convolution' for
+    the hall impulse response (reverb_amount is then the wet level). Each
+    track is added straight into its channels of the output at its pan
+    gains, so a mono mix never allocates stereo buffers. The mix is
+    normalized to a peak of 0.9.
+    """
     # Find the longest track
     max_length = max(len(track) for track, _, _ in tracks_with_panning)
     
-    # Initialize stereo mix
-    stereo_mix = np.zeros((max_length, 2))
+    n_channels = LAYOUT_CHANNELS[layout]
+    mix = np.zeros((max_length, n_channels), dtype=sample_dtype())
     
     for track, pan, reverb_amt in tracks_with_panning:
-        # Pad track if shorter
-        if len(track) < max_length:
-            track = np.pad(track, (0, max_length - len(track)))
-        
-        # Apply reverb if specified
-        if reverb_amt > 0:
-            track = apply_reverb(track, sample_rate, room_size=reverb_amt)
-            if len(track) > max_length:
-                track = track[:max_length]
+        # Apply reverb if specified; the tail beyond the longest track is dropped
+        with stage('reverb'):
+            track = apply_track_reverb(track, reverb_amt, sample_rate, reverb)[:max_length]
         
-        # Pan and add to mix
-        stereo_track = pan_stereo(track, pan)
-        stereo_mix += stereo_track[:max_length]
-    
-    # Normalize to prevent clipping
-    max_val = np.max(np.abs(stereo_mix))
-    if max_val > 0:
-        stereo_mix = stereo_mix / max_val * 0.9
-    
-    # Convert back to mono for compatibility (can be removed for stereo output)
-    mixed_mono = np.mean(stereo_mix, axis=1)
+        # Pan and add to mix; shorter tracks only touch their own span
+        with stage('mix'):
+            for channel, gain in enumerate(pan_gains(pan, layout)):
+                mix[:len(track), channel] += track * gain
+    
+    with stage('mix'):
+        # Normalize to prevent clipping
+        max_val = np.max(np.abs(mix))
+        if max_val > 0:
+            mix *= 0.9 / max_val
+    
+    return mix[:, 0] if layout == MONO else mix
+
+def mix_tracks_stereo(tracks_with_panning, sample_rate=44100, reverb='delay'):
+    """Mix tracks in stereo and return the mono average of the normalized mix.
+
+    Kept for existing callers; new code should use mix_tracks with a layout.
+    """
+    return mix_tracks(tracks_with_panning, sample_rate, reverb, layout=STEREO).mean(axis=1)
+
+def apply_fade_out(audio, fade_out, sample_rate=44100):
+    """Fade the last fade_out seconds of mono or (n, channels) audio to silence in place."""
+    fade_duration = int(fade_out * sample_rate)
+    if 0 < fade_duration < len(audio):
+        gain = np.linspace(1, 0, fade_duration, dtype=audio.dtype)
+        audio[-fade_duration:] *= gain.reshape((-1,) + (1,) * (audio.ndim - 1))
+    return audio
+
+def render_parts(arrangement, tempo, sample_rate=44100, track='', seed=BUILD_SEED):
+    """Render each part of an arrangement dry, as (name, samples, pan, reverb_amount).
+
+    Each part draws its noise from a source seeded by seed, track and the
+    part name, so the same arguments always give the same samples.
+    """
+    beat_duration = 60.0 / tempo
     
-    return mixed_mono
+    rendered = []
+    for name, part, voice, pan, reverb_amt in arrangement:
+        print(f"Generating {name} track...")
+        voice = seeded_voice(voice, NoiseSource(seed, track, name))
+        with stage(f'render {name}'):
+            track_audio = render_part(part, voice, beat_duration, sample_rate)
+        rendered.append((name, track_audio, pan, reverb_amt))
+    print_cache_stats()
+    return rendered
+
+def render_arrangement(arrangement, tempo, sample_rate=44100, reverb='delay', fade_out=0.0,
+                       layout=MONO, track='', seed=BUILD_SEED):
+    """Render and mix an arrangement of (name, part, voice, pan, reverb_amount) entries.
+
+    Parts are rendered by render_parts, so the same arguments always give
+    the same samples.
+    """
+    tracks_to_mix = [(track_audio, pan, reverb_amt) for _, track_audio, pan, reverb_amt
+                     in render_parts(arrangement, tempo, sample_rate, track, seed)]
+    
+    print("Mixing tracks with panning and reverb...")
+    mixed_audio = mix_tracks(tracks_to_mix, sample_rate, reverb=reverb, layout=layout)
+    with stage('fade out'):
+        return apply_fade_out(mixed_audio, fade_out, sample_rate)
 
 def main():
     print("Orchestral Music Generator")
@@ -460,62 +740,28 @@ def main():
     
     # Generate melody track
     print("Generating melody track...")
-    melody_track = np.array([])
-    for note, duration in melody:
-        frequency = NOTES[note]
-        tone = generate_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.4)
-        melody_track = np.concatenate([melody_track, tone])
+    melody_track = render_part(melody, pitched_voice(generate_tone, amplitude=0.4),
+                               beat_duration, sample_rate)
     
     # Generate bass track
     print("Generating bass track...")
-    bass_track = np.array([])
-    for note, duration in bass:
-        frequency = NOTES[note]
-        tone = generate_bass_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.5)
-        bass_track = np.concatenate([bass_track, tone])
+    bass_track = render_part(bass, pitched_voice(generate_bass_tone, amplitude=0.5),
+                             beat_duration, sample_rate)
     
     # Generate drum track
     print("Generating drum track...")
-    drum_track = np.array([])
-    for drum_type, duration in drums:
-        drum_duration = duration * beat_duration
-        if drum_type == 'kick':
-            sound = generate_kick_drum(drum_duration, sample_rate, amplitude=0.7)
-        elif drum_type == 'snare':
-            sound = generate_snare_drum(drum_duration, sample_rate, amplitude=0.5)
-        elif drum_type == 'hihat':
-            sound = generate_hihat(drum_duration, sample_rate, amplitude=0.3, closed=True)
-        else:  # rest
-            sound = np.zeros(int(sample_rate * drum_duration))
-        drum_track = np.concatenate([drum_track, sound])
+    drum_track = render_part(drums, drum_voice(kick=0.7, snare=0.5, hihat=0.3, closed=True),
+                             beat_duration, sample_rate)
     
     # Generate string tracks
     print("Generating string sections...")
-    string_track = np.array([])
-    for chord_notes, duration in strings:
-        chord_duration = duration * beat_duration
-        chord_sound = np.zeros(int(sample_rate * chord_duration))
-        
-        # Generate each note in the chord
-        for notes_tuple in chord_notes:
-            for note in notes_tuple:
-                frequency = NOTES[note]
-                tone = generate_string_tone(frequency, chord_duration, sample_rate, 
-                                           amplitude=0.2, instrument='violin')
-                chord_sound += tone
-        
-        # Normalize chord to prevent clipping
-        if np.max(np.abs(chord_sound)) > 0:
-            chord_sound = chord_sound / np.max(np.abs(chord_sound)) * 0.4
-        string_track = np.concatenate([string_track, chord_sound])
+    string_track = render_part(strings, chord_voice(generate_string_chord, 0.4, instrument='violin'),
+                               beat_duration, sample_rate)
     
     # Generate piano track
     print("Generating piano arpeggios...")
-    piano_track = np.array([])
-    for note, duration in piano:
-        frequency = NOTES[note]
-        tone = generate_piano_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.3)
-        piano_track = np.concatenate([piano_track, tone])
+    piano_track = render_part(piano, pitched_voice(generate_piano_tone, amplitude=0.3),
+                              beat_duration, sample_rate)
     
     # Mix all tracks with stereo panning and reverb
     print("Mixing all tracks with panning and reverb...")
@@ -530,21 +776,18 @@ def main():
         (piano_track, -0.3, 0.3),      # Piano: slightly left, light reverb
     ]
     
-    mixed_audio = mix_tracks_stereo(tracks_to_mix, sample_rate)
-    
-    # Save as WAV
-    wav_file = save_as_wav(mixed_audio, 'orchestral_output.wav', sample_rate)
+    mixed_audio = mix_tracks(tracks_to_mix, sample_rate, layout=STEREO)
     
-    # Convert to OGG
-    print("\nConverting to OGG format...")
-    ogg_file = convert_to_ogg(wav_file, 'orchestral_output.ogg')
+    # Encode straight to OGG, falling back to a WAV file without ffmpeg
+    print("\nEncoding to OGG format...")
+    ogg_file = encode_to_ogg([mixed_audio], 'orchestral_output.ogg', sample_rate,
+                             channels=LAYOUT_CHANNELS[STEREO], wav_filename='orchestral_output.wav')
     
     if ogg_file:
         print(f"\n✓ Success! Generated files:")
-        print(f"  - {wav_file}")
         print(f"  - {ogg_file}")
     else:
-        print(f"\n✓ WAV file generated: {wav_file}")
+        print(f"\n✓ WAV file generated: orchestral_output.wav")
         print("  (OGG conversion requires ffmpeg)")
     
     # Display the sheet music representation
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+In-process memoization cache for rendered notes.
+Identical notes (same voice, frequency, length, amplitude and sample rate)
+are rendered once and reused, with LRU eviction under a memory cap.
+"""
+
+import functools
+import inspect
+from collections import OrderedDict
+
+from precision import sample_dtype
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+
+class NoteCache:
+    """LRU cache of rendered note buffers bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached samples for key, or None on a miss."""
+        samples = self._entries.get(key)
+        if samples is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return samples
+
+    def put(self, key, samples):
+        """Store samples under key, evicting least recently used entries."""
+        if samples.nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key).nbytes
+        # Cached buffers are shared between callers, so freeze them
+        samples.flags.writeable = False
+        self._entries[key] = samples
+        self.nbytes += samples.nbytes
+        self._evict()
+
+    def resize(self, max_bytes):
+        """Change the memory cap, evicting entries if needed."""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters and memory usage."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, samples = self._entries.popitem(last=False)
+            self.nbytes -= samples.nbytes
+
+# Shared cache used by all cached voices
+NOTE_CACHE = NoteCache()
+
+def cached_voice(tone_fn):
+    """Memoize a tone generator with signature (frequency, duration, sample_rate, amplitude, ...).
+
+    The key is the voice function, frequency, sample count, amplitude, sample
+    rate, sample dtype and any remaining keyword arguments (e.g. instrument). Returned
+    arrays are read-only views shared between calls.
+    """
+    signature = inspect.signature(tone_fn)
+    voice_id = f'{tone_fn.__module__}.{tone_fn.__qualname__}'
+
+    @functools.wraps(tone_fn)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        frequency = params.pop('frequency')
+        duration = params.pop('duration')
+        sample_rate = params.pop('sample_rate')
+        amplitude = params.pop('amplitude')
+        n_samples = int(sample_rate * duration)
+
+        key = (voice_id, frequency, n_samples, amplitude, sample_rate, sample_dtype().name,
+               tuple(sorted(params.items())))
+        samples = NOTE_CACHE.get(key)
+        if samples is None:
+            samples = tone_fn(*args, **kwargs)
+            NOTE_CACHE.put(key, samples)
+        return samples
+
+    return wrapper
+
+def print_cache_stats(cache=NOTE_CACHE):
+    """Print a one-line summary of the note cache counters."""
+    stats = cache.stats()
+    print(f"Note cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%} hit rate, {stats['bytes'] / 1e6:.1f} MB)")
@@ -11,6 +11,11 @@ import os
 import sys
 sys.path.append(os.path.dirname(__file__))
 from generate_music import *
+from cli import track_arguments
+from note_cache import cached_voice
+from streaming import stream_arrangement
+from profiling import StageProfiler, profile_stages, stage
+import wavetable
 
 def create_battle_melody():
     """Create an intense battle theme melody."""
@@ -331,231 +336,150 @@ def create_battle_brass():
     ]
     return brass
 
-def generate_bass_tone_fixed(frequency, duration, sample_rate=44100, amplitude=0.4):
+@cached_voice
+def generate_bass_tone_fixed(frequency, duration, sample_rate=44100, amplitude=0.4, use_wavetable=False):
     """Generate a bass tone with proper bounds checking."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # ADSR envelope for bass
-    attack = int(0.02 * sample_rate)
-    decay = int(0.05 * sample_rate)
-    sustain_level = 0.7
-    release = int(0.1 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    
-    # Bounds checking
-    if attack < len(envelope):
-        envelope[:attack] = np.linspace(0, 1, min(attack, len(envelope)))
-    
-    if attack < len(envelope) and attack + decay <= len(envelope):
-        envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
+    phase = cycles(frequency, t)
     
     # Bass sound with fundamental and light harmonics
-    tone = amplitude * envelope * (
-        np.sin(2 * np.pi * frequency * t) +  # Strong fundamental
-        0.2 * np.sin(np.pi * frequency * t) +  # Sub-harmonic
-        0.1 * np.sin(4 * np.pi * frequency * t)  # Light 2nd harmonic
-    )
-    return tone
+    if use_wavetable:
+        tone = wavetable.BASS.render(phase / 2, frequency / 2, sample_rate)
+    else:
+        tone = (
+            np.sin(2 * np.pi * phase) +  # Strong fundamental
+            0.2 * np.sin(np.pi * phase) +  # Sub-harmonic
+            0.1 * np.sin(4 * np.pi * phase)  # Light 2nd harmonic
+        )
+    tone *= amplitude
+    
+    # ADSR envelope for bass
+    return apply_envelope(tone, sample_rate, attack=0.02, decay=0.05, sustain=0.7, release=0.1)
 
-def generate_brass_tone(frequency, duration, sample_rate=44100, amplitude=0.4):
+@cached_voice
+def generate_brass_tone(frequency, duration, sample_rate=44100, amplitude=0.4, use_wavetable=False):
     """Generate brass instrument sound."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # Brass-like ADSR
-    attack = int(0.03 * sample_rate)
-    decay = int(0.05 * sample_rate)
-    sustain_level = 0.8
-    release = int(0.1 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    if attack < len(envelope):
-        envelope[:attack] = np.linspace(0, 1, attack)
-    if attack + decay < len(envelope):
-        envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
+    phase = cycles(frequency, t)
     
     # Brass harmonics (strong odd harmonics)
-    tone = amplitude * envelope * (
-        1.0 * np.sin(2 * np.pi * frequency * t) +  # Fundamental
-        0.5 * np.sin(3 * np.pi * frequency * t) +  # 3rd harmonic (strong)
-        0.3 * np.sin(5 * np.pi * frequency * t) +  # 5th harmonic
-        0.2 * np.sin(7 * np.pi * frequency * t) +  # 7th harmonic
-        0.1 * np.sin(9 * np.pi * frequency * t)   # 9th harmonic
-    )
+    if use_wavetable:
+        tone = wavetable.BRASS.render(phase / 2, frequency / 2, sample_rate)
+    else:
+        tone = (
+            1.0 * np.sin(2 * np.pi * phase) +  # Fundamental
+            0.5 * np.sin(3 * np.pi * phase) +  # 3rd harmonic (strong)
+            0.3 * np.sin(5 * np.pi * phase) +  # 5th harmonic
+            0.2 * np.sin(7 * np.pi * phase) +  # 7th harmonic
+            0.1 * np.sin(9 * np.pi * phase)   # 9th harmonic
+        )
+    tone *= amplitude
+    
+    # Brass-like ADSR
+    apply_envelope(tone, sample_rate, attack=0.03, decay=0.05, sustain=0.8, release=0.1)
     
     # Add slight vibrato for realism
-    vibrato = 1 + 0.005 * np.sin(2 * np.pi * 4.5 * t)
-    tone = tone * vibrato
+    tone *= 1 + 0.005 * np.sin(2 * np.pi * cycles(4.5, t))
     
     return tone
 
-def generate_string_tone_fixed(frequency, duration, sample_rate=44100, amplitude=0.3, instrument='violin'):
+@cached_voice
+def generate_string_tone_fixed(frequency, duration, sample_rate=44100, amplitude=0.3, instrument='violin',
+                               use_wavetable=False):
     """Generate string instrument sound with fixed bounds checking."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # ADSR envelope for strings
-    attack = int(0.05 * sample_rate) if instrument == 'violin' else int(0.08 * sample_rate)
-    decay = int(0.1 * sample_rate)
-    sustain_level = 0.8
-    release = int(0.15 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    
-    # Bounds checking for envelope segments
-    if attack < len(envelope):
-        envelope[:attack] = np.linspace(0, 1, min(attack, len(envelope)))
-    
-    if attack < len(envelope) and attack + decay <= len(envelope):
-        envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
-    
-    # Sawtooth wave synthesis for string-like sound
-    phase = (t * frequency) % 1
-    sawtooth = 2 * phase - 1
+    phase = cycles(frequency, t)
     
     # Add vibrato for realism
     vibrato_freq = 5.0  # Hz
     vibrato_depth = 0.01 if instrument == 'violin' else 0.005
     vibrato = 1 + vibrato_depth * np.sin(2 * np.pi * vibrato_freq * t)
     
-    # Combine sawtooth with harmonics
-    tone = amplitude * envelope * (
-        0.6 * sawtooth +  # Main sawtooth
-        0.2 * np.sin(2 * np.pi * frequency * t * vibrato) +  # Fundamental with vibrato
-        0.1 * np.sin(4 * np.pi * frequency * t) +  # 2nd harmonic
-        0.1 * np.sin(3 * np.pi * frequency * t)  # 3rd harmonic
-    )
+    if use_wavetable:
+        # Band-limited sawtooth and harmonics, plus the vibrato fundamental
+        tone = wavetable.STRING.render(phase / 2, frequency / 2, sample_rate)
+        tone += 0.2 * wavetable.SINE.render(cycles(frequency, t * vibrato), frequency, sample_rate)
+    else:
+        # Sawtooth wave synthesis for string-like sound
+        sawtooth = 2 * ramp(frequency, t) - 1
+        
+        # Combine sawtooth with harmonics
+        tone = (
+            0.6 * sawtooth +  # Main sawtooth
+            0.2 * np.sin(2 * np.pi * cycles(frequency, t * vibrato)) +  # Fundamental with vibrato
+            0.1 * np.sin(4 * np.pi * phase) +  # 2nd harmonic
+            0.1 * np.sin(3 * np.pi * phase)  # 3rd harmonic
+        )
+    tone *= amplitude
     
-    return tone
+    # ADSR envelope for strings
+    return apply_envelope(tone, sample_rate, **string_adsr(instrument))
+
+TEMPO = 140  # Fast battle tempo
+LOOP = True  # Loops under every level
+
+def arrangement():
+    """Return the (name, part, voice, pan, reverb) entries mixed into the battle track."""
+    # Pan: -1 (left) to 1 (right), Reverb: 0 (dry) to 1 (wet)
+    return [
+        # Melody: center, light reverb
+        ('melody', create_battle_melody(),
+         pitched_voice(generate_string_tone_fixed, amplitude=0.35, instrument='violin'), 0.0, 0.2),
+        # Bass: center, minimal reverb
+        ('bass', create_battle_bass(),
+         pitched_voice(generate_bass_tone_fixed, amplitude=0.7), 0.0, 0.1),
+        # Drums: slightly left, very dry
+        ('drums', create_battle_drums(),
+         drum_voice(kick=0.8, snare=0.6, hihat=0.4, closed=True), -0.05, 0.05),
+        # Strings: left, moderate reverb (shorter attack for staccato effect)
+        #('strings', create_battle_strings(),
+        # chord_voice(generate_string_chord, 0.45, instrument='violin'), -0.3, 0.3),
+        # Brass: right, moderate reverb
+        ('brass', create_battle_brass(),
+         pitched_voice(generate_brass_tone, amplitude=0.4), 0.3, 0.35),
+    ]
 
-def main():
+def main(stream=False, profile=False, layout=MONO, reverb='delay'):
     print("Generating Orchestral Battle Music")
     print("=" * 50)
     
-    tempo = 140  # Fast battle tempo
     sample_rate = 44100
-    beat_duration = 60.0 / tempo
-    
-    # Create all parts
-    print("Creating battle melody...")
-    melody = create_battle_melody()
-    
-    print("Creating driving bass line...")
-    bass = create_battle_bass()
-    
-    print("Creating intense drum patterns...")
-    drums = create_battle_drums()
-    
-    print("Creating aggressive strings...")
-    strings = create_battle_strings()
-    
-    print("Creating powerful brass...")
-    brass = create_battle_brass()
-    
-    # Generate melody track
-    print("Generating melody track...")
-    melody_track = np.array([])
-    for note, duration in melody:
-        frequency = NOTES.get(note, 0)
-        tone = generate_string_tone_fixed(frequency, duration * beat_duration, sample_rate, 
-                                   amplitude=0.35, instrument='violin')
-        melody_track = np.concatenate([melody_track, tone])
-    
-    # Generate bass track
-    print("Generating bass track...")
-    bass_track = np.array([])
-    for note, duration in bass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_bass_tone_fixed(frequency, duration * beat_duration, sample_rate, amplitude=0.7)
-        bass_track = np.concatenate([bass_track, tone])
+    profiler = StageProfiler() if profile else None
     
-    # Generate drum track
-    print("Generating drum track...")
-    drum_track = np.array([])
-    for drum_type, duration in drums:
-        drum_duration = duration * beat_duration
-        if drum_type == 'kick':
-            sound = generate_kick_drum(drum_duration, sample_rate, amplitude=0.8)
-        elif drum_type == 'snare':
-            sound = generate_snare_drum(drum_duration, sample_rate, amplitude=0.6)
-        elif drum_type == 'hihat':
-            sound = generate_hihat(drum_duration, sample_rate, amplitude=0.4, closed=True)
-        else:  # rest
-            sound = np.zeros(int(sample_rate * drum_duration))
-        drum_track = np.concatenate([drum_track, sound])
-    
-    # Generate string section
-    print("Generating string sections...")
-    string_track = np.array([])
-    for chord_notes, duration in strings:
-        chord_duration = duration * beat_duration
-        chord_sound = np.zeros(int(sample_rate * chord_duration))
-        
-        for notes_tuple in chord_notes:
-            for note in notes_tuple:
-                frequency = NOTES.get(note, 0)
-                # Use shorter attack for staccato effect in battle
-                tone = generate_string_tone_fixed(frequency, chord_duration, sample_rate, 
-                                           amplitude=0.12, instrument='violin')
-                chord_sound += tone
-        
-        if np.max(np.abs(chord_sound)) > 0:
-            chord_sound = chord_sound / np.max(np.abs(chord_sound)) * 0.45
-        string_track = np.concatenate([string_track, chord_sound])
-    
-    # Generate brass section
-    print("Generating brass section...")
-    brass_track = np.array([])
-    for note, duration in brass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_brass_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.4)
-        brass_track = np.concatenate([brass_track, tone])
-    
-    # Mix all tracks with battle-appropriate panning
-    print("Mixing orchestra for battle intensity...")
-    
-    tracks_to_mix = [
-        (melody_track, 0.0, 0.2),       # Melody: center, light reverb
-        (bass_track, 0.0, 0.1),          # Bass: center, minimal reverb
-        (drum_track, -0.05, 0.05),       # Drums: slightly left, very dry
-        #(string_track, -0.3, 0.3),       # Strings: left, moderate reverb
-        (brass_track, 0.3, 0.35),        # Brass: right, moderate reverb
-    ]
-    
-    mixed_audio = mix_tracks_stereo(tracks_to_mix, sample_rate)
-    
-    # Save as WAV
-    wav_file = save_as_wav(mixed_audio, 'battle.wav', sample_rate)
+    with profile_stages(profiler):
+        with stage('compose'):
+            parts = arrangement()
+        
+        if stream:
+            # Render block by block with bounded memory
+            blocks = stream_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                        track='battle')
+        else:
+            blocks = [render_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                         track='battle')]
+        
+        # Encode straight to OGG (falls back to battle.wav without ffmpeg)
+        print("\nEncoding to OGG format...")
+        ogg_file = encode_to_ogg(blocks, 'battle.ogg', sample_rate, LAYOUT_CHANNELS[layout],
+                                 wav_filename='battle.wav')
     
-    # Convert to OGG
-    print("\nConverting to OGG format...")
-    ogg_file = convert_to_ogg(wav_file, 'battle.ogg')
+    if profiler:
+        profiler.print_report('battle')
+        profiler.save('battle.profile.json', 'battle')
     
     if ogg_file:
         print(f"\n✓ Success! Generated orchestral battle music:")
-        print(f"  - {wav_file}")
         print(f"  - {ogg_file}")
-    
-    # Clean up WAV file
-    if os.path.exists(wav_file) and ogg_file:
-        os.remove(wav_file)
-        print(f"  - Cleaned up temporary WAV file")
 
 if __name__ == "__main__":
-    main()
+    args = track_arguments('Generate the orchestral battle music.')
+    main(stream=args.stream, profile=args.profile, layout=args.layout, reverb=args.reverb)
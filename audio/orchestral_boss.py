@@ -12,6 +12,11 @@ import sys
 sys.path.append(os.path.dirname(__file__))
 from orchestral_battle import generate_brass_tone, generate_bass_tone_fixed, generate_string_tone_fixed
 from generate_music import *
+from cli import track_arguments
+from note_cache import cached_voice
+from streaming import stream_arrangement
+from profiling import StageProfiler, profile_stages, stage
+import wavetable
 
 def create_boss_melody():
     """Create an epic, menacing boss theme."""
@@ -166,148 +171,90 @@ def create_boss_choir():
     ]
     return choir
 
-def generate_choir_tone(frequency, duration, sample_rate=44100, amplitude=0.3):
+@cached_voice
+def generate_choir_tone(frequency, duration, sample_rate=44100, amplitude=0.3, use_wavetable=False):
     """Generate choir-like sound using multiple voices."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
     
-    # Choir envelope - slow attack for swells
-    attack = int(0.2 * sample_rate)
-    decay = int(0.1 * sample_rate)
-    sustain_level = 0.8
-    release = int(0.3 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    if attack < len(envelope):
-        envelope[:attack] = np.linspace(0, 1, min(attack, len(envelope)))
-    if attack < len(envelope) and attack + decay <= len(envelope):
-        envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
-    
     # Multiple detuned voices for choir effect
     voices = 0
     detune_amounts = [-0.01, -0.005, 0, 0.005, 0.01]  # Slight detuning
     
     for detune in detune_amounts:
         freq_detuned = frequency * (1 + detune)
+        phase = cycles(freq_detuned, t)
+        if use_wavetable:
+            voices += wavetable.CHOIR.render(phase, freq_detuned, sample_rate)
+            continue
         # Vowel formants simulation (simplified)
-        voices += np.sin(2 * np.pi * freq_detuned * t)  # Fundamental
-        voices += 0.3 * np.sin(4 * np.pi * freq_detuned * t)  # 2nd harmonic
-        voices += 0.2 * np.sin(6 * np.pi * freq_detuned * t)  # 3rd harmonic
+        voices += np.sin(2 * np.pi * phase)  # Fundamental
+        voices += 0.3 * np.sin(4 * np.pi * phase)  # 2nd harmonic
+        voices += 0.2 * np.sin(6 * np.pi * phase)  # 3rd harmonic
     
-    # Normalize and apply envelope
-    tone = amplitude * envelope * voices / len(detune_amounts)
-    
-    return tone
+    # Normalize and apply envelope (slow attack for swells)
+    voices *= amplitude / len(detune_amounts)
+    return apply_envelope(voices, sample_rate, attack=0.2, decay=0.1, sustain=0.8, release=0.3)
+
+TEMPO = 120  # Epic, moderate tempo for boss
+LOOP = True  # Loops until the boss is defeated
+
+def arrangement():
+    """Return the (name, part, voice, pan, reverb) entries mixed into the boss track."""
+    bass = create_boss_bass()
+    return [
+        # Melody: center, moderate reverb
+        ('melody', create_boss_melody(),
+         pitched_voice(generate_string_tone_fixed, amplitude=0.4, instrument='cello'), 0.0, 0.3),
+        # Bass: center, light reverb
+        ('bass', bass,
+         pitched_voice(generate_bass_tone_fixed, amplitude=0.8), 0.0, 0.15),
+        # Drums: center, minimal reverb
+        ('drums', create_boss_drums(),
+         drum_voice(kick=0.9, snare=0.7, hihat=0.3, closed=False), 0.0, 0.1),
+        # Choir: left, heavy reverb
+        ('choir', create_boss_choir(),
+         pitched_voice(generate_choir_tone, amplitude=0.35), -0.2, 0.6),
+        # Brass: right, moderate reverb - power chords following the
+        # first part of the bass one octave higher
+        ('brass', bass[:16],
+         pitched_voice(generate_brass_tone, transpose=2, amplitude=0.45), 0.2, 0.4),
+    ]
 
-def main():
+def main(stream=False, profile=False, layout=MONO, reverb='delay'):
     print("Generating Orchestral Boss Battle Music")
     print("=" * 50)
     
-    tempo = 120  # Epic, moderate tempo for boss
     sample_rate = 44100
-    beat_duration = 60.0 / tempo
-    
-    # Create all parts
-    print("Creating boss melody...")
-    melody = create_boss_melody()
-    
-    print("Creating thunderous bass...")
-    bass = create_boss_bass()
-    
-    print("Creating epic drums...")
-    drums = create_boss_drums()
-    
-    print("Creating choir vocals...")
-    choir = create_boss_choir()
-    
-    # Generate melody track
-    print("Generating melody track...")
-    melody_track = np.array([])
-    for note, duration in melody:
-        frequency = NOTES.get(note, 0)
-        tone = generate_string_tone_fixed(frequency, duration * beat_duration, sample_rate, 
-                                         amplitude=0.4, instrument='cello')
-        melody_track = np.concatenate([melody_track, tone])
+    profiler = StageProfiler() if profile else None
     
-    # Generate bass track
-    print("Generating bass track...")
-    bass_track = np.array([])
-    for note, duration in bass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_bass_tone_fixed(frequency, duration * beat_duration, sample_rate, amplitude=0.8)
-        bass_track = np.concatenate([bass_track, tone])
-    
-    # Generate drum track
-    print("Generating drum track...")
-    drum_track = np.array([])
-    for drum_type, duration in drums:
-        drum_duration = duration * beat_duration
-        if drum_type == 'kick':
-            sound = generate_kick_drum(drum_duration, sample_rate, amplitude=0.9)
-        elif drum_type == 'snare':
-            sound = generate_snare_drum(drum_duration, sample_rate, amplitude=0.7)
-        elif drum_type == 'hihat':
-            sound = generate_hihat(drum_duration, sample_rate, amplitude=0.3, closed=False)
-        else:  # rest
-            sound = np.zeros(int(sample_rate * drum_duration))
-        drum_track = np.concatenate([drum_track, sound])
-    
-    # Generate choir track
-    print("Generating epic choir...")
-    choir_track = np.array([])
-    for note, duration in choir:
-        frequency = NOTES.get(note, 0)
-        tone = generate_choir_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.35)
-        choir_track = np.concatenate([choir_track, tone])
-    
-    # Generate brass accents
-    print("Generating brass power chords...")
-    brass_track = np.array([])
-    # Simple brass hits following the bass pattern
-    for note, duration in bass[:16]:  # Use first part of bass for brass
-        frequency = NOTES.get(note, 0)
-        if frequency > 0:
-            frequency *= 2  # One octave higher
-        tone = generate_brass_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.45)
-        brass_track = np.concatenate([brass_track, tone])
-    
-    # Pad brass track to match length
-    if len(brass_track) < len(melody_track):
-        brass_track = np.pad(brass_track, (0, len(melody_track) - len(brass_track)))
-    
-    # Mix all tracks
-    print("Mixing epic orchestra...")
-    
-    tracks_to_mix = [
-        (melody_track, 0.0, 0.3),       # Melody: center, moderate reverb
-        (bass_track, 0.0, 0.15),        # Bass: center, light reverb
-        (drum_track, 0.0, 0.1),         # Drums: center, minimal reverb
-        (choir_track, -0.2, 0.6),       # Choir: left, heavy reverb
-        (brass_track, 0.2, 0.4),        # Brass: right, moderate reverb
-    ]
-    
-    mixed_audio = mix_tracks_stereo(tracks_to_mix, sample_rate)
-    
-    # Save as WAV
-    wav_file = save_as_wav(mixed_audio, 'boss.wav', sample_rate)
+    with profile_stages(profiler):
+        with stage('compose'):
+            parts = arrangement()
+        
+        if stream:
+            # Render block by block with bounded memory
+            blocks = stream_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                        track='boss')
+        else:
+            blocks = [render_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                         track='boss')]
+        
+        # Encode straight to OGG (falls back to boss.wav without ffmpeg)
+        print("\nEncoding to OGG format...")
+        ogg_file = encode_to_ogg(blocks, 'boss.ogg', sample_rate, LAYOUT_CHANNELS[layout],
+                                 wav_filename='boss.wav')
     
-    # Convert to OGG
-    print("\nConverting to OGG format...")
-    ogg_file = convert_to_ogg(wav_file, 'boss.ogg')
+    if profiler:
+        profiler.print_report('boss')
+        profiler.save('boss.profile.json', 'boss')
     
     if ogg_file:
         print(f"\n✓ Success! Generated orchestral boss battle music:")
-        print(f"  - {wav_file}")
         print(f"  - {ogg_file}")
-    
-    # Clean up WAV file
-    if os.path.exists(wav_file) and ogg_file:
-        os.remove(wav_file)
-        print(f"  - Cleaned up temporary WAV file")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = track_arguments('Generate the orchestral boss music.')
+    main(stream=args.stream, profile=args.profile, layout=args.layout, reverb=args.reverb)
@@ -13,6 +13,9 @@ sys.path.append(os.path.dirname(__file__))
 from orchestral_battle import generate_brass_tone, generate_bass_tone_fixed, generate_string_tone_fixed
 from orchestral_boss import generate_choir_tone
 from generate_music import *
+from cli import track_arguments
+from streaming import stream_arrangement
+from profiling import StageProfiler, profile_stages, stage
 
 def create_game_over_melody():
     """Create a somber, melancholic game over theme."""
@@ -94,63 +97,12 @@ def create_game_over_strings():
     ]
     return strings
 
-def main():
-    print("Generating Orchestral Game Over Music")
-    print("=" * 50)
-    
-    tempo = 60  # Slow, somber tempo
-    sample_rate = 44100
-    beat_duration = 60.0 / tempo
-    
-    # Create parts
-    print("Creating melancholic melody...")
-    melody = create_game_over_melody()
-    
-    print("Creating mournful bass...")
-    bass = create_game_over_bass()
-    
-    print("Creating somber strings...")
-    strings = create_game_over_strings()
-    
-    # Generate melody track (solo cello)
-    print("Generating solo cello melody...")
-    melody_track = np.array([])
-    for note, duration in melody:
-        frequency = NOTES.get(note, 0)
-        tone = generate_string_tone_fixed(frequency, duration * beat_duration, sample_rate, 
-                                         amplitude=0.4, instrument='cello')
-        melody_track = np.concatenate([melody_track, tone])
-    
-    # Generate bass track
-    print("Generating deep bass...")
-    bass_track = np.array([])
-    for note, duration in bass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_bass_tone_fixed(frequency, duration * beat_duration, sample_rate, amplitude=0.5)
-        bass_track = np.concatenate([bass_track, tone])
-    
-    # Generate string section
-    print("Generating mournful strings...")
-    string_track = np.array([])
-    for chord_notes, duration in strings:
-        chord_duration = duration * beat_duration
-        chord_sound = np.zeros(int(sample_rate * chord_duration))
-        
-        for notes_tuple in chord_notes:
-            for note in notes_tuple:
-                frequency = NOTES.get(note, 0)
-                tone = generate_string_tone_fixed(frequency, chord_duration, sample_rate, 
-                                                 amplitude=0.1, instrument='cello')
-                chord_sound += tone
-        
-        if np.max(np.abs(chord_sound)) > 0:
-            chord_sound = chord_sound / np.max(np.abs(chord_sound)) * 0.3
-        string_track = np.concatenate([string_track, chord_sound])
-    
-    # Simple piano notes for atmosphere
-    print("Generating atmospheric piano...")
-    piano_track = np.array([])
-    piano_notes = [
+TEMPO = 60  # Slow, somber tempo
+FADE_OUT = 2.0  # Seconds of fade out at the end
+
+def create_game_over_piano():
+    """Create sparse atmospheric piano notes."""
+    piano = [
         ('A4', 1.0), ('rest', 3.0),
         ('G4', 1.0), ('rest', 3.0),
         ('F4', 1.0), ('rest', 3.0),
@@ -162,55 +114,58 @@ def main():
         ('rest', 4.0),
         ('E3', 4.0),
     ]
-    for note, duration in piano_notes:
-        frequency = NOTES.get(note, 0)
-        tone = generate_piano_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.25)
-        piano_track = np.concatenate([piano_track, tone])
-    
-    # Pad tracks to same length
-    max_len = max(len(melody_track), len(bass_track), len(string_track), len(piano_track))
-    for track in [melody_track, bass_track, string_track, piano_track]:
-        if len(track) < max_len:
-            padding = max_len - len(track)
-            if track is melody_track:
-                melody_track = np.pad(track, (0, padding))
-            elif track is bass_track:
-                bass_track = np.pad(track, (0, padding))
-            elif track is string_track:
-                string_track = np.pad(track, (0, padding))
-            elif track is piano_track:
-                piano_track = np.pad(track, (0, padding))
-    
-    # Mix with heavy reverb for atmosphere
-    print("Mixing somber orchestra...")
-    tracks_to_mix = [
-        (melody_track, 0.0, 0.5),       # Melody: center, heavy reverb
-        (bass_track, 0.0, 0.3),         # Bass: center, moderate reverb
-        (string_track, -0.3, 0.7),      # Strings: left, very heavy reverb
-        (piano_track, 0.3, 0.6),        # Piano: right, heavy reverb
+    return piano
+
+def arrangement():
+    """Return the (name, part, voice, pan, reverb) entries mixed into the game over track."""
+    # Heavy reverb throughout for atmosphere
+    return [
+        # Melody (solo cello): center, heavy reverb
+        ('melody', create_game_over_melody(),
+         pitched_voice(generate_string_tone_fixed, amplitude=0.4, instrument='cello'), 0.0, 0.5),
+        # Bass: center, moderate reverb
+        ('bass', create_game_over_bass(),
+         pitched_voice(generate_bass_tone_fixed, amplitude=0.5), 0.0, 0.3),
+        # Strings: left, very heavy reverb
+        ('strings', create_game_over_strings(),
+         chord_voice(generate_string_chord, 0.3, instrument='cello'), -0.3, 0.7),
+        # Piano: right, heavy reverb
+        ('piano', create_game_over_piano(),
+         pitched_voice(generate_piano_tone, amplitude=0.25), 0.3, 0.6),
     ]
+
+def main(stream=False, profile=False, layout=MONO, reverb='delay'):
+    print("Generating Orchestral Game Over Music")
+    print("=" * 50)
     
-    mixed_audio = mix_tracks_stereo(tracks_to_mix, sample_rate)
-    
-    # Apply fade out at the end
-    fade_duration = int(2 * sample_rate)  # 2 second fade
-    if len(mixed_audio) > fade_duration:
-        fade_out = np.linspace(1, 0, fade_duration)
-        mixed_audio[-fade_duration:] *= fade_out
+    sample_rate = 44100
+    profiler = StageProfiler() if profile else None
     
-    # Save
-    wav_file = save_as_wav(mixed_audio, 'game_over.wav', sample_rate)
+    with profile_stages(profiler):
+        with stage('compose'):
+            parts = arrangement()
+        
+        if stream:
+            # Render block by block with bounded memory
+            blocks = stream_arrangement(parts, TEMPO, sample_rate, reverb=reverb, fade_out=FADE_OUT,
+                                        layout=layout, track='game_over')
+        else:
+            blocks = [render_arrangement(parts, TEMPO, sample_rate, reverb=reverb, fade_out=FADE_OUT,
+                                         layout=layout, track='game_over')]
+        
+        # Encode straight to OGG (falls back to game_over.wav without ffmpeg)
+        print("\nEncoding to OGG format...")
+        ogg_file = encode_to_ogg(blocks, 'game_over.ogg', sample_rate, LAYOUT_CHANNELS[layout],
+                                 wav_filename='game_over.wav')
     
-    print("\nConverting to OGG format...")
-    ogg_file = convert_to_ogg(wav_file, 'game_over.ogg')
+    if profiler:
+        profiler.print_report('game_over')
+        profiler.save('game_over.profile.json', 'game_over')
     
     if ogg_file:
         print(f"\n✓ Success! Generated orchestral game over music:")
         print(f"  - {ogg_file}")
-    
-    # Clean up
-    if os.path.exists(wav_file) and ogg_file:
-        os.remove(wav_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = track_arguments('Generate the orchestral game over music.')
+    main(stream=args.stream, profile=args.profile, layout=args.layout, reverb=args.reverb)
@@ -11,6 +11,13 @@ import os
 import sys
 sys.path.append(os.path.dirname(__file__))
 from generate_music import *
+from drum_bank import one_shot
+import noise
+from note_cache import cached_voice
+from cli import track_arguments
+from streaming import stream_arrangement
+from profiling import StageProfiler, profile_stages, stage
+import wavetable
 
 def create_main_menu_melody():
     """Create a heroic main menu theme melody."""
@@ -167,168 +174,115 @@ def create_main_menu_timpani():
     ]
     return timpani
 
-def generate_brass_tone(frequency, duration, sample_rate=44100, amplitude=0.4):
+@cached_voice
+def generate_brass_tone(frequency, duration, sample_rate=44100, amplitude=0.4, use_wavetable=False):
     """Generate brass instrument sound."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # Brass-like ADSR
-    attack = int(0.03 * sample_rate)
-    decay = int(0.05 * sample_rate)
-    sustain_level = 0.8
-    release = int(0.1 * sample_rate)
-    
-    envelope = np.ones_like(t) * sustain_level
-    envelope[:attack] = np.linspace(0, 1, attack)
-    envelope[attack:attack+decay] = np.linspace(1, sustain_level, decay)
-    if release < len(envelope):
-        envelope[-release:] = np.linspace(sustain_level, 0, release)
+    phase = cycles(frequency, t)
     
     # Brass harmonics (strong odd harmonics)
-    tone = amplitude * envelope * (
-        1.0 * np.sin(2 * np.pi * frequency * t) +  # Fundamental
-        0.5 * np.sin(3 * np.pi * frequency * t) +  # 3rd harmonic (strong)
-        0.3 * np.sin(5 * np.pi * frequency * t) +  # 5th harmonic
-        0.2 * np.sin(7 * np.pi * frequency * t) +  # 7th harmonic
-        0.1 * np.sin(9 * np.pi * frequency * t)   # 9th harmonic
-    )
+    if use_wavetable:
+        tone = wavetable.BRASS.render(phase / 2, frequency / 2, sample_rate)
+    else:
+        tone = (
+            1.0 * np.sin(2 * np.pi * phase) +  # Fundamental
+            0.5 * np.sin(3 * np.pi * phase) +  # 3rd harmonic (strong)
+            0.3 * np.sin(5 * np.pi * phase) +  # 5th harmonic
+            0.2 * np.sin(7 * np.pi * phase) +  # 7th harmonic
+            0.1 * np.sin(9 * np.pi * phase)   # 9th harmonic
+        )
+    tone *= amplitude
+    
+    # Brass-like ADSR
+    apply_envelope(tone, sample_rate, attack=0.03, decay=0.05, sustain=0.8, release=0.1)
     
     # Add slight vibrato for realism
-    vibrato = 1 + 0.005 * np.sin(2 * np.pi * 4.5 * t)
-    tone = tone * vibrato
+    tone *= 1 + 0.005 * np.sin(2 * np.pi * cycles(4.5, t))
     
     return tone
 
+@one_shot
 def generate_timpani_tone(frequency, duration, sample_rate=44100, amplitude=0.6):
     """Generate timpani drum sound."""
     if frequency == 0:
-        return np.zeros(int(sample_rate * duration))
+        return np.zeros(int(sample_rate * duration), dtype=sample_dtype())
     
     t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # Timpani has a pitched tone with quick decay
-    amp_envelope = np.exp(-3 * t)  # Faster decay than bass drum
+    phase = cycles(frequency, t)
     
     # Fundamental with slight pitch bend
     pitch_bend = frequency * (1 + 0.1 * np.exp(-20 * t))
     
     # Timpani sound (fundamental + harmonics + membrane resonance)
-    timpani = amplitude * amp_envelope * (
-        0.7 * np.sin(2 * np.pi * pitch_bend * t) +  # Fundamental with pitch bend
-        0.2 * np.sin(4 * np.pi * frequency * t) +    # 2nd harmonic
-        0.1 * np.sin(6 * np.pi * frequency * t) +    # 3rd harmonic
-        0.05 * np.random.normal(0, 0.1, len(t)) * np.exp(-50 * t)  # Initial strike
+    timpani = (
+        0.7 * np.sin(2 * np.pi * cycles(pitch_bend, t)) +  # Fundamental with pitch bend
+        0.2 * np.sin(4 * np.pi * phase) +    # 2nd harmonic
+        0.1 * np.sin(6 * np.pi * phase) +    # 3rd harmonic
+        0.05 * as_samples(noise.normal(0, 0.1, len(t))) * np.exp(-50 * as_samples(t))  # Initial strike
     )
+    timpani *= amplitude
     
-    return timpani
+    # Timpani has a pitched tone with quick decay (faster than bass drum)
+    return apply_envelope(timpani, sample_rate, decay_rate=3)
+
+TEMPO = 100  # Majestic tempo
+LOOP = True  # Loops while the menu is open
+
+def arrangement():
+    """Return the (name, part, voice, pan, reverb) entries mixed into the main menu track."""
+    return [
+        # Melody (violin lead): slightly right, moderate reverb
+        ('melody', create_main_menu_melody(),
+         pitched_voice(generate_string_tone, amplitude=0.4, instrument='violin'), 0.1, 0.3),
+        # Bass: center, light reverb
+        ('bass', create_main_menu_bass(),
+         pitched_voice(generate_bass_tone, amplitude=0.6), 0.0, 0.2),
+        # Strings: left, rich reverb
+        #('strings', create_main_menu_strings(),
+        # chord_voice(generate_string_chord, 0.5, instrument='cello'), -0.2, 0.5),
+        # Brass: right, moderate reverb
+        ('brass', create_main_menu_brass(),
+         pitched_voice(generate_brass_tone, amplitude=0.35), 0.3, 0.4),
+        # Timpani: slightly left, hall reverb
+        ('timpani', create_main_menu_timpani(),
+         pitched_voice(generate_timpani_tone, amplitude=0.5), -0.1, 0.6),
+    ]
 
-def main():
+def main(stream=False, profile=False, layout=MONO, reverb='delay'):
     print("Generating Orchestral Main Menu Music")
     print("=" * 50)
     
-    tempo = 100  # Majestic tempo
     sample_rate = 44100
-    beat_duration = 60.0 / tempo
-    
-    # Create all parts
-    print("Creating melody...")
-    melody = create_main_menu_melody()
-    
-    print("Creating bass line...")
-    bass = create_main_menu_bass()
+    profiler = StageProfiler() if profile else None
     
-    print("Creating string arrangements...")
-    strings = create_main_menu_strings()
-    
-    print("Creating brass section...")
-    brass = create_main_menu_brass()
-    
-    print("Creating timpani...")
-    timpani = create_main_menu_timpani()
-    
-    # Generate melody track (flute/violin lead)
-    print("Generating melody track...")
-    melody_track = np.array([])
-    for note, duration in melody:
-        frequency = NOTES.get(note, 0)
-        # Use violin for main melody
-        tone = generate_string_tone(frequency, duration * beat_duration, sample_rate, 
-                                   amplitude=0.4, instrument='violin')
-        melody_track = np.concatenate([melody_track, tone])
-    
-    # Generate bass track
-    print("Generating bass track...")
-    bass_track = np.array([])
-    for note, duration in bass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_bass_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.6)
-        bass_track = np.concatenate([bass_track, tone])
-    
-    # Generate string section
-    print("Generating string sections...")
-    string_track = np.array([])
-    for chord_notes, duration in strings:
-        chord_duration = duration * beat_duration
-        chord_sound = np.zeros(int(sample_rate * chord_duration))
+    with profile_stages(profiler):
+        with stage('compose'):
+            parts = arrangement()
         
-        for notes_tuple in chord_notes:
-            for note in notes_tuple:
-                frequency = NOTES.get(note, 0)
-                tone = generate_string_tone(frequency, chord_duration, sample_rate, 
-                                           amplitude=0.15, instrument='cello')
-                chord_sound += tone
+        if stream:
+            # Render block by block with bounded memory
+            blocks = stream_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                        track='main_menu')
+        else:
+            blocks = [render_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                         track='main_menu')]
         
-        if np.max(np.abs(chord_sound)) > 0:
-            chord_sound = chord_sound / np.max(np.abs(chord_sound)) * 0.5
-        string_track = np.concatenate([string_track, chord_sound])
-    
-    # Generate brass section
-    print("Generating brass section...")
-    brass_track = np.array([])
-    for note, duration in brass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_brass_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.35)
-        brass_track = np.concatenate([brass_track, tone])
-    
-    # Generate timpani
-    print("Generating timpani...")
-    timpani_track = np.array([])
-    for note, duration in timpani:
-        frequency = NOTES.get(note, 0)
-        tone = generate_timpani_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.5)
-        timpani_track = np.concatenate([timpani_track, tone])
+        # Encode straight to OGG (falls back to main_menu.wav without ffmpeg)
+        print("\nEncoding to OGG format...")
+        ogg_file = encode_to_ogg(blocks, 'main_menu.ogg', sample_rate, LAYOUT_CHANNELS[layout],
+                                 wav_filename='main_menu.wav')
     
-    # Mix all tracks with stereo panning
-    print("Mixing orchestra with spatial positioning...")
-    
-    tracks_to_mix = [
-        (melody_track, 0.1, 0.3),      # Melody: slightly right, moderate reverb
-        (bass_track, 0.0, 0.2),         # Bass: center, light reverb
-        #(string_track, -0.2, 0.5),      # Strings: left, rich reverb
-        (brass_track, 0.3, 0.4),        # Brass: right, moderate reverb
-        (timpani_track, -0.1, 0.6),     # Timpani: slightly left, hall reverb
-    ]
-    
-    mixed_audio = mix_tracks_stereo(tracks_to_mix, sample_rate)
-    
-    # Save as WAV
-    wav_file = save_as_wav(mixed_audio, 'main_menu.wav', sample_rate)
-    
-    # Convert to OGG
-    print("\nConverting to OGG format...")
-    ogg_file = convert_to_ogg(wav_file, 'main_menu.ogg')
+    if profiler:
+        profiler.print_report('main_menu')
+        profiler.save('main_menu.profile.json', 'main_menu')
     
     if ogg_file:
         print(f"\n✓ Success! Generated orchestral main menu music:")
-        print(f"  - {wav_file}")
         print(f"  - {ogg_file}")
-    
-    # Clean up WAV file
-    if os.path.exists(wav_file) and ogg_file:
-        os.remove(wav_file)
-        print(f"  - Cleaned up temporary WAV file")
 
 if __name__ == "__main__":
-    main()
+    args = track_arguments('Generate the orchestral main menu music.')
+    main(stream=args.stream, profile=args.profile, layout=args.layout, reverb=args.reverb)
@@ -14,6 +14,9 @@ from orchestral_battle import generate_brass_tone, generate_bass_tone_fixed, gen
 from orchestral_boss import generate_choir_tone
 from orchestral_main_menu import generate_timpani_tone
 from generate_music import *
+from cli import track_arguments
+from streaming import stream_arrangement
+from profiling import StageProfiler, profile_stages, stage
 
 def create_victory_melody():
     """Create a triumphant victory fanfare."""
@@ -92,51 +95,11 @@ def create_victory_brass():
     ]
     return brass
 
-def main():
-    print("Generating Orchestral Victory Music")
-    print("=" * 50)
-    
-    tempo = 120  # Celebratory tempo
-    sample_rate = 44100
-    beat_duration = 60.0 / tempo
-    
-    # Create parts
-    print("Creating victory melody...")
-    melody = create_victory_melody()
-    
-    print("Creating uplifting bass...")
-    bass = create_victory_bass()
-    
-    print("Creating triumphant brass...")
-    brass = create_victory_brass()
-    
-    # Generate tracks
-    print("Generating melody track...")
-    melody_track = np.array([])
-    for note, duration in melody:
-        frequency = NOTES.get(note, 0)
-        tone = generate_string_tone_fixed(frequency, duration * beat_duration, sample_rate, 
-                                         amplitude=0.45, instrument='violin')
-        melody_track = np.concatenate([melody_track, tone])
-    
-    print("Generating bass track...")
-    bass_track = np.array([])
-    for note, duration in bass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_bass_tone_fixed(frequency, duration * beat_duration, sample_rate, amplitude=0.6)
-        bass_track = np.concatenate([bass_track, tone])
-    
-    print("Generating brass fanfare...")
-    brass_track = np.array([])
-    for note, duration in brass:
-        frequency = NOTES.get(note, 0)
-        tone = generate_brass_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.5)
-        brass_track = np.concatenate([brass_track, tone])
-    
-    # Simple timpani rolls
-    print("Generating timpani rolls...")
-    timpani_track = np.array([])
-    timpani_notes = [
+TEMPO = 120  # Celebratory tempo
+
+def create_victory_timpani():
+    """Create simple timpani rolls."""
+    timpani = [
         ('C2', 0.25), ('C2', 0.25), ('C2', 0.25), ('C2', 0.25),
         ('rest', 3.0),
         ('G2', 0.25), ('G2', 0.25), ('G2', 0.25), ('G2', 0.25),
@@ -145,46 +108,57 @@ def main():
         ('C2', 0.125), ('C2', 0.125), ('C2', 0.125), ('C2', 0.125),
         ('C2', 4.0),
     ]
-    for note, duration in timpani_notes:
-        frequency = NOTES.get(note, 0)
-        tone = generate_timpani_tone(frequency, duration * beat_duration, sample_rate, amplitude=0.4)
-        timpani_track = np.concatenate([timpani_track, tone])
-    
-    # Pad tracks to same length
-    max_len = max(len(melody_track), len(bass_track), len(brass_track), len(timpani_track))
-    if len(timpani_track) < max_len:
-        timpani_track = np.pad(timpani_track, (0, max_len - len(timpani_track)))
-    if len(brass_track) < max_len:
-        brass_track = np.pad(brass_track, (0, max_len - len(brass_track)))
-    if len(bass_track) < max_len:
-        bass_track = np.pad(bass_track, (0, max_len - len(bass_track)))
-    if len(melody_track) < max_len:
-        melody_track = np.pad(melody_track, (0, max_len - len(melody_track)))
-    
-    # Mix
-    print("Mixing triumphant orchestra...")
-    tracks_to_mix = [
-        (melody_track, 0.0, 0.4),       # Melody: center, reverb
-        (bass_track, 0.0, 0.2),         # Bass: center
-        (brass_track, 0.2, 0.5),        # Brass: right, reverb
-        (timpani_track, -0.2, 0.6),     # Timpani: left, hall reverb
+    return timpani
+
+def arrangement():
+    """Return the (name, part, voice, pan, reverb) entries mixed into the victory track."""
+    return [
+        # Melody: center, reverb
+        ('melody', create_victory_melody(),
+         pitched_voice(generate_string_tone_fixed, amplitude=0.45, instrument='violin'), 0.0, 0.4),
+        # Bass: center
+        ('bass', create_victory_bass(),
+         pitched_voice(generate_bass_tone_fixed, amplitude=0.6), 0.0, 0.2),
+        # Brass fanfare: right, reverb
+        ('brass', create_victory_brass(),
+         pitched_voice(generate_brass_tone, amplitude=0.5), 0.2, 0.5),
+        # Timpani: left, hall reverb
+        ('timpani', create_victory_timpani(),
+         pitched_voice(generate_timpani_tone, amplitude=0.4), -0.2, 0.6),
     ]
+
+def main(stream=False, profile=False, layout=MONO, reverb='delay'):
+    print("Generating Orchestral Victory Music")
+    print("=" * 50)
     
-    mixed_audio = mix_tracks_stereo(tracks_to_mix, sample_rate)
+    sample_rate = 44100
+    profiler = StageProfiler() if profile else None
     
-    # Save
-    wav_file = save_as_wav(mixed_audio, 'victory.wav', sample_rate)
+    with profile_stages(profiler):
+        with stage('compose'):
+            parts = arrangement()
+        
+        if stream:
+            # Render block by block with bounded memory
+            blocks = stream_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                        track='victory')
+        else:
+            blocks = [render_arrangement(parts, TEMPO, sample_rate, reverb=reverb, layout=layout,
+                                         track='victory')]
+        
+        # Encode straight to OGG (falls back to victory.wav without ffmpeg)
+        print("\nEncoding to OGG format...")
+        ogg_file = encode_to_ogg(blocks, 'victory.ogg', sample_rate, LAYOUT_CHANNELS[layout],
+                                 wav_filename='victory.wav')
     
-    print("\nConverting to OGG format...")
-    ogg_file = convert_to_ogg(wav_file, 'victory.ogg')
+    if profiler:
+        profiler.print_report('victory')
+        profiler.save('victory.profile.json', 'victory')
     
     if ogg_file:
         print(f"\n✓ Success! Generated orchestral victory music:")
         print(f"  - {ogg_file}")
-    
-    # Clean up
-    if os.path.exists(wav_file) and ogg_file:
-        os.remove(wav_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = track_arguments('Generate the orchestral victory music.')
+    main(stream=args.stream, profile=args.profile, layout=args.layout, reverb=args.reverb)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Pipeline-wide sample precision.
+Oscillators, envelopes, effects and mixing allocate their buffers in the
+dtype chosen here. float32 halves memory traffic; oscillator phase is still
+computed in float64 and wrapped before the cast, so long notes stay in tune.
+"""
+
+import numpy as np
+
+SUPPORTED_DTYPES = ('float64', 'float32')
+
+_sample_dtype = np.dtype(np.float64)
+
+def sample_dtype():
+    """Return the dtype used for audio buffers."""
+    return _sample_dtype
+
+def set_sample_dtype(dtype):
+    """Select float64 (default) or float32 audio buffers for the whole pipeline."""
+    global _sample_dtype
+    dtype = np.dtype(dtype)
+    if dtype.name not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported sample dtype {dtype.name}; use one of {SUPPORTED_DTYPES}")
+    _sample_dtype = dtype
+
+def as_samples(array):
+    """Return array in the sample dtype, without copying if it already is."""
+    return np.asarray(array, dtype=_sample_dtype)
+
+def cycles(frequency, t):
+    """Oscillator phase in cycles of frequency at times t (seconds, float64).
+
+    In float32 the phase is wrapped to [0, 2) in float64 first, because a
+    float32 product of frequency and time drifts by several LSBs after a few
+    seconds. The period of 2 keeps half-harmonics such as sin(3 pi f t)
+    continuous.
+    """
+    phase = frequency * t
+    if _sample_dtype == np.float64:
+        return phase
+    # Work in place and write straight into the float32 result; large
+    # temporaries cost more than the arithmetic
+    phase *= 0.5
+    wrapped = np.floor(phase, out=np.empty(phase.shape, _sample_dtype), casting='same_kind')
+    phase -= wrapped
+    return np.multiply(phase, 2, out=wrapped, casting='same_kind')
+
+def ramp(frequency, t):
+    """Sawtooth phase in [0, 1) of frequency at times t (seconds, float64).
+
+    The fraction is taken in float64 and kept below 1 after the cast, so a
+    sample that falls just short of a cycle boundary does not jump to the
+    start of the next cycle in float32.
+    """
+    phase = frequency * t
+    phase %= 1
+    if _sample_dtype == np.float64:
+        return phase
+    return np.minimum(phase.astype(_sample_dtype), np.nextafter(_sample_dtype.type(1), _sample_dtype.type(0)))
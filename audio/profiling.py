@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and peak memory for track builds.
+Code marks its stages with `with stage('name'):`; while a StageProfiler is
+active each stage records wall time, CPU time and peak traced memory.
+Without an active profiler stage() does nothing.
+"""
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+class StageProfiler:
+    """Accumulates wall time, CPU time and peak traced memory per stage.
+
+    Stages may nest (streaming stages pull blocks through each other);
+    times are exclusive, so a stage's time excludes its nested stages and
+    the stage totals add up to the profiled time.
+    """
+
+    def __init__(self):
+        self.stages = {}  # name -> {'calls', 'wall', 'cpu', 'peak_bytes'}
+        self._stack = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record one call of a stage."""
+        if self._stack:
+            # Keep the parent's peak before the child resets it
+            parent = self._stack[-1]
+            parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        frame = {'peak': 0, 'child_wall': 0.0, 'child_cpu': 0.0}
+        self._stack.append(frame)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            self._stack.pop()
+
+            record = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0})
+            record['calls'] += 1
+            record['wall'] += wall - frame['child_wall']
+            record['cpu'] += cpu - frame['child_cpu']
+            record['peak_bytes'] = max(record['peak_bytes'], peak)
+
+            if self._stack:
+                parent = self._stack[-1]
+                parent['child_wall'] += wall
+                parent['child_cpu'] += cpu
+                parent['peak'] = max(parent['peak'], peak)
+
+    def to_dict(self, track):
+        """Return a JSON-serializable report."""
+        return {
+            'track': track,
+            'stages': [dict(name=name, **record) for name, record in self.stages.items()],
+            'total': {
+                'wall': sum(record['wall'] for record in self.stages.values()),
+                'cpu': sum(record['cpu'] for record in self.stages.values()),
+                'peak_bytes': max((record['peak_bytes'] for record in self.stages.values()), default=0),
+            },
+        }
+
+    def print_report(self, track):
+        """Print a table of the recorded stages."""
+        report = self.to_dict(track)
+        total_wall = report['total']['wall'] or 1.0
+        print(f"\nProfile: {track}")
+        print(f"{'Stage':<24} {'Calls':>6} {'Wall s':>8} {'CPU s':>8} {'Wall %':>7} {'Peak MB':>8}")
+        print("-" * 66)
+        for entry in report['stages'] + [dict(name='total', calls='', **report['total'])]:
+            print(f"{entry['name']:<24} {entry['calls']:>6} {entry['wall']:8.3f} {entry['cpu']:8.3f} "
+                  f"{entry['wall'] / total_wall:7.1%} {entry['peak_bytes'] / 2**20:8.1f}")
+
+    def save(self, filename, track):
+        """Write the report as JSON."""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(track), f, indent=2)
+        print(f"Saved profile: {filename}")
+
+_active = None
+
+def stage(name):
+    """Context manager timing a stage on the active profiler, if any."""
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name)
+
+def profiled_blocks(name, blocks):
+    """Attribute the time spent producing each block of a stream to a stage."""
+    blocks = iter(blocks)
+    while True:
+        with stage(name):
+            block = next(blocks, None)
+        if block is None:
+            return
+        yield block
+
+@contextlib.contextmanager
+def profile_stages(profiler):
+    """Make profiler the active profiler while tracing memory; None profiles nothing."""
+    global _active
+    if profiler is None:
+        yield None
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        if started:
+            tracemalloc.stop()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Columnar score format.
+A part is a structured array with one row per sounding note: MIDI pitch,
+onset and length in samples, velocity and voice id. Chord tones are rows
+sharing an onset and length, so the timing and pitch of a whole part are a
+handful of array operations instead of a Python loop over note tuples.
+"""
+
+import re
+
+import numpy as np
+
+EVENT_DTYPE = np.dtype([
+    ('pitch', np.int16),       # MIDI note number, DRUM_PITCHES entry or REST
+    ('onset', np.int64),       # First sample of the note
+    ('length', np.int64),      # Length in samples
+    ('velocity', np.float32),  # Gain applied to the rendered note
+    ('voice', np.int16),       # Part the note belongs to
+])
+
+REST = -1
+
+# General MIDI percussion keys for the drum names used in the parts
+DRUM_PITCHES = {'kick': 36, 'snare': 38, 'hihat': 42}
+
+# Equal-tempered frequency of every MIDI note (A4 = 69 = 440 Hz); the
+# trailing 0 Hz entry is what REST (-1) indexes
+MIDI_FREQUENCIES = np.array([440.0 * 2 ** ((n - 69) / 12) for n in range(128)] + [0.0])
+
+_NOTE_NAME = re.compile(r'([A-G])(#*|b*)(-?\d+)')
+_STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+def note_number(name):
+    """MIDI number of one name: a note such as 'C4', 'F#2', 'Bb3' or 'C-1', a drum or 'rest'.
+
+    Raises ValueError for anything else, including notes outside MIDI 0-127.
+    """
+    if name == 'rest':
+        return REST
+    if name in DRUM_PITCHES:
+        return DRUM_PITCHES[name]
+    match = _NOTE_NAME.fullmatch(name)
+    if match:
+        step, accidentals, octave = match.groups()
+        pitch = (int(octave) + 1) * 12 + _STEPS[step] + accidentals.count('#') - accidentals.count('b')
+        if 0 <= pitch < 128:
+            return pitch
+    raise ValueError(f"Unknown note name {name!r}")
+
+def note_numbers(names):
+    """MIDI numbers (int16) for an array of names, in the same shape.
+
+    Each distinct name is parsed once; the whole array is then resolved with
+    a single indexing operation. Raises ValueError listing every unknown name.
+    """
+    names = np.asarray(names, dtype=str)
+    distinct, inverse = np.unique(names, return_inverse=True)
+    pitches = np.empty(len(distinct), dtype=np.int16)
+    unknown = []
+    for i, name in enumerate(distinct):
+        try:
+            pitches[i] = note_number(name)
+        except ValueError:
+            unknown.append(name)
+    if unknown:
+        raise ValueError(f"Unknown note name(s): {', '.join(map(str, unknown))}")
+    return pitches[inverse].reshape(names.shape)
+
+def step_names(note):
+    """Names sounding in one (note, beats) step.
+
+    note is a note name, a drum name, 'rest' or a chord given as a list of
+    note-name tuples; a chord with no notes is a rest.
+    """
+    if isinstance(note, str):
+        return [note]
+    return [name for names in note for name in names] or ['rest']
+
+def beat_lengths(beats, beat_duration, sample_rate=44100):
+    """Durations in seconds and lengths in samples for an array of beat counts."""
+    durations = np.asarray(beats, dtype=float) * beat_duration
+    return durations, (sample_rate * durations).astype(np.int64)
+
+def make_events(pitches, onsets, lengths, velocity=1.0, voice=0):
+    """Build an event array from per-note columns (scalars are broadcast)."""
+    events = np.empty(len(pitches), dtype=EVENT_DTYPE)
+    events['pitch'] = pitches
+    events['onset'] = onsets
+    events['length'] = lengths
+    events['velocity'] = velocity
+    events['voice'] = voice
+    return events
+
+def part_events(part, beat_duration, sample_rate=44100, velocity=1.0, voice=0):
+    """Convert a (note, beats) part into events.
+
+    Each step lasts int(sample_rate * beats * beat_duration) samples and starts
+    where the previous one ended, which is exactly where the list renderer put
+    it. Zero-length steps make no sound and are left out.
+    """
+    _, lengths = beat_lengths([beats for _, beats in part], beat_duration, sample_rate)
+    onsets = np.cumsum(lengths) - lengths
+    sounding = np.flatnonzero(lengths > 0)
+    names = [step_names(part[i][0]) for i in sounding]
+    counts = [len(step) for step in names]
+    return make_events(note_numbers([name for step in names for name in step]),
+                       np.repeat(onsets[sounding], counts),
+                       np.repeat(lengths[sounding], counts), velocity, voice)
+
+def _tune_columns(tune):
+    """MIDI numbers, start times and durations (in whole notes) and voice ids of a tune.
+
+    Tunes from abc_parser.parse_tune carry one column set per V: voice with
+    explicit start times; an older flat 'notes' list plays its notes back to back.
+    """
+    if 'voices' in tune:
+        voices = tune['voices']
+        counts = [len(voice['midi']) for voice in voices]
+        columns = [np.concatenate([np.asarray(voice[key], dtype=float) for voice in voices])
+                   if voices else np.zeros(0) for key in ('midi', 'start', 'duration')]
+        return columns + [np.repeat(np.arange(len(voices)), counts)]
+    durations = np.array([note['duration'] for note in tune['notes']], dtype=float)
+    starts = np.concatenate(([0.0], np.cumsum(durations)))[:-1]
+    return [note['midi'] for note in tune['notes']], starts, durations, 0
+
+def tune_durations(tune):
+    """Note durations in seconds of a parsed ABC tune (whole-note lengths at its tempo)."""
+    return _tune_columns(tune)[2] * 4 * (60.0 / tune['tempo'])
+
+def tune_events(tune, sample_rate=44100, velocity=1.0, voice=0):
+    """Convert a parsed ABC tune into events, one voice id per V: voice from voice on.
+
+    Onsets are taken from the running time in seconds, as the ABC synthesizer
+    places its notes, rather than from the sum of the rounded lengths.
+    """
+    pitches, starts, durations, voices = _tune_columns(tune)
+    beat_duration = 60.0 / tune['tempo']
+    starts, durations = starts * 4 * beat_duration, durations * 4 * beat_duration
+    return make_events(np.asarray(pitches, dtype=np.int16), (starts * sample_rate).astype(np.int64),
+                       (durations * sample_rate).astype(np.int64), velocity, voice + voices)
+
+def step_starts(events):
+    """Index of the first row of every step: rows sharing onset and length sound together."""
+    onsets, lengths = events['onset'], events['length']
+    changed = (onsets[1:] != onsets[:-1]) | (lengths[1:] != lengths[:-1])
+    return np.concatenate(([0], np.flatnonzero(changed) + 1)) if len(events) else np.zeros(0, np.intp)
+
+def events_length(events):
+    """Samples needed to hold every event."""
+    return int(np.max(events['onset'] + events['length'], initial=0))
+
+def event_frequencies(events, table=MIDI_FREQUENCIES):
+    """Frequency of every event in Hz (0 for rests), looked up in one indexing operation."""
+    return table[events['pitch']]
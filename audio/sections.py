@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Render-once reuse of repeated sections.
+A voice's steps are compared by a key holding everything that shapes their
+sound and spacing, so runs of steps that recur exactly (repeated bars,
+expanded ABC repeats) are rendered once into a section buffer, release
+tails included, and that buffer is added at every place the run occurs.
+"""
+
+import numpy as np
+
+# Shortest run of steps worth rendering as a section
+MIN_SECTION_STEPS = 4
+# Earlier occurrences of a run tried at each step; the earliest are kept, as
+# they leave the most room before the step for a long match
+MAX_CANDIDATES = 32
+
+_HASH_BASE = np.uint64(0x100000001B3)
+
+def _window_hashes(sounds, spaced, length):
+    """Polynomial hash of every run of length steps, as compared by find_sections.
+
+    Each offset into the window is one array operation over all windows;
+    arithmetic wraps modulo 2**64. Equal runs always hash equal, so the
+    hashes can key candidates as long as matches are confirmed exactly.
+    """
+    n = len(sounds) - length + 1
+    if n <= 0:
+        return []
+    sounds, spaced = np.asarray(sounds, dtype=np.uint64), np.asarray(spaced, dtype=np.uint64)
+    hashes = np.zeros(n, dtype=np.uint64)
+    for offset in range(length - 1):
+        hashes = hashes * _HASH_BASE + spaced[offset:offset + n]
+    return (hashes * _HASH_BASE + sounds[length - 1:]).tolist()
+
+def _common_prefix(values, a, b, low, high):
+    """Length of the common prefix of values[a:] and values[b:], from low up to high.
+
+    The first low values are known to match. Galloping and then bisecting
+    over slice comparisons takes O(log length) Python steps.
+    """
+    step = 1
+    while low < high:
+        end = min(low + step, high)
+        if values[a + low:a + end] != values[b + low:b + end]:
+            high = end - 1
+            break
+        low, step = end, step * 2
+    while low < high:
+        middle = (low + high + 1) // 2
+        if values[a + low:a + middle] == values[b + low:b + middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _longest_match(sounds, spaced, i, candidates, min_steps):
+    """Earliest longest run before step i that repeats at i, as (first, count)."""
+    best_first, best_count = 0, 0
+    n = len(sounds)
+    last = min_steps - 1
+    for first in candidates:
+        if first + min_steps > i:
+            break
+        if spaced[first:first + last] != spaced[i:i + last] or sounds[first + last] != sounds[i + last]:
+            continue  # Only the window hashes matched
+        # Runs match while their spaced steps do, plus one step whose gap may differ
+        common = _common_prefix(spaced, first, i, last, min(n - i, i - first) - 1)
+        count = common + 1 if sounds[first + common] == sounds[i + common] else common
+        if count > best_count:
+            best_first, best_count = first, count
+    return best_first, best_count
+
+def find_sections(keys, gaps, min_steps=MIN_SECTION_STEPS):
+    """Find runs of at least min_steps steps that recur exactly.
+
+    keys[k] identifies the sound of step k and gaps[k] the distance from it
+    to the next step. Two runs match when all their keys match and so do
+    their gaps, except the gap after the last step, which does not change
+    how the run sounds.
+
+    Returns (sections, literal). Each section is (first, count, starts): the
+    steps first..first + count - 1 are rendered once and placed at every step
+    index in starts. literal lists the steps covered by no section. No two
+    occurrences overlap. The scan is greedy: a run matching a known section
+    reuses it, otherwise the longest earlier run repeating here becomes a new
+    section, and its first occurrence uses the section too if still uncovered.
+    Runs of min_steps steps are looked up by hash, and at most MAX_CANDIDATES
+    earlier occurrences are tried per step, so highly repetitive parts such
+    as drum loops and ostinatos are scanned in near-linear time.
+    """
+    sound_ids, spaced_ids = {}, {}
+    sounds = [sound_ids.setdefault(key, len(sound_ids)) for key in keys]
+    spaced = [spaced_ids.setdefault(step, len(spaced_ids)) for step in zip(keys, gaps)]
+    n = len(sounds)
+    grams = _window_hashes(sounds, spaced, min_steps)
+
+    def run(i, count):
+        return spaced[i:i + count - 1], sounds[i + count - 1]
+
+    def remember(runs, gram, value):
+        occurrences = runs.setdefault(gram, [])
+        if len(occurrences) < MAX_CANDIDATES:
+            occurrences.append(value)
+
+    covered = bytearray(n)
+    sections = []
+    known = {}  # Opening run hash of min_steps steps of each section -> section numbers
+    seen = {}   # Run hash of min_steps steps at each step passed so far -> step indices, ascending
+    i = 0
+    while i < n:
+        gram = grams[i] if i + min_steps <= n else None
+        found = None
+        for number in known.get(gram, ()):
+            first, count, _ = sections[number]
+            if (found is None or count > sections[found][1]) and i + count <= n and run(i, count) == run(first, count):
+                found = number
+        if found is None and gram is not None:
+            first, count = _longest_match(sounds, spaced, i, seen.get(gram, ()), min_steps)
+            if count:
+                found = len(sections)
+                sections.append((first, count, []))
+                remember(known, gram, found)
+                if not any(covered[first:first + count]):
+                    sections[found][2].append(first)
+                    covered[first:first + count] = b'\1' * count
+        count = 1
+        if found is not None:
+            count = sections[found][1]
+            sections[found][2].append(i)
+            covered[i:i + count] = b'\1' * count
+        for k in range(i, min(i + count, n - min_steps + 1)):
+            remember(seen, grams[k], k)
+        i += count
+    return sections, [k for k in range(n) if not covered[k]]
+
+def section_sound(onsets, render, first, count):
+    """Render steps first..first + count - 1 into one buffer.
+
+    Returns (offset, samples): samples starts offset samples after
+    onsets[first] and runs until the last tail of the section ends, so a
+    release ringing past the next section boundary is kept.
+    """
+    sounds = [render(k) for k in range(first, first + count)]
+    starts = [onsets[k] - onsets[first] for k in range(first, first + count)]
+    offset = min(starts)
+    length = max(start + sound.shape[-1] for start, sound in zip(starts, sounds)) - offset
+    samples = np.zeros(sounds[0].shape[:-1] + (length,), dtype=np.result_type(*sounds))
+    for start, sound in zip(starts, sounds):
+        samples[..., start - offset:start - offset + sound.shape[-1]] += sound
+    return offset, samples
+
+def reused_sounds(keys, onsets, render, min_steps=MIN_SECTION_STEPS):
+    """Yield (onset, samples) covering every step, rendering each repeated section once.
+
+    keys[k] must equal keys[j] only if steps k and j sound the same, onsets
+    holds each step's first sample and render(k) returns step k's samples
+    with time on the last axis. Sounds are yielded out of order and may
+    overlap, so add them into place; every occurrence of a section yields
+    the same read-only buffer.
+    """
+    onsets = [int(onset) for onset in onsets]
+    # A jump back in time (the next voice starting over) gets a gap of its own,
+    # so no section spans it and needs a buffer as long as the whole voice
+    gaps = [after - before if after >= before else (None, k)
+            for k, (before, after) in enumerate(zip(onsets, onsets[1:] + onsets[-1:]))]
+    sections, literal = find_sections(keys, gaps, min_steps)
+    for k in literal:
+        yield onsets[k], render(k)
+    for first, count, starts in sections:
+        offset, samples = section_sound(onsets, render, first, count)
+        samples.flags.writeable = False
+        for start in starts:
+            yield onsets[start] + offset, samples
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Sample-aligned stem export for adaptive music.
+Every part of a track is written as its own stem with its reverb and
+panning applied, all starting at sample 0 and as long as the full mix, so a
+player can start them together and layer or drop parts at runtime. Each
+stem is normalized on its own; its recommended gain brings it back to its
+level in the mix, so the stems played at those gains sum to the mix.
+Stem files are named by a hash of their PCM, so a stem shared by several
+tracks (or unchanged since the last build) is encoded only once.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from encoder import pcm16_chunks
+from generate_music import (LAYOUT_CHANNELS, MONO, apply_fade_out, apply_track_reverb, encode_to_ogg,
+                            pan_gains, render_parts)
+from noise import BUILD_SEED
+from precision import sample_dtype
+from profiling import stage
+
+STEMS_DIR = 'stems'
+STEMS_MANIFEST_NAME = 'stems.json'
+PEAK = 0.9  # Peak level of the mix and of every normalized stem
+
+def stem_digest(samples):
+    """Short SHA-256 of a stem's 16-bit PCM, i.e. of what ends up in the file."""
+    digest = hashlib.sha256()
+    for chunk in pcm16_chunks([samples]):
+        digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def write_stem(samples, stems_dir, sample_rate=44100, channels=1, quality=4):
+    """Encode a normalized stem to <digest>.ogg in stems_dir unless it is already there.
+
+    Returns the file name relative to stems_dir, or None if encoding failed,
+    in which case no temporary file is left behind.
+    """
+    filename = f'{stem_digest(samples)}.ogg'
+    path = os.path.join(stems_dir, filename)
+    if os.path.exists(path):
+        print(f"Reusing stem {filename}")
+        return filename
+    # Workers building other tracks may write the same stem; only a finished one is renamed into place
+    temp_name = os.path.join(stems_dir, f'{filename[:-4]}.{os.getpid()}')
+    encoded = encode_to_ogg([samples], f'{temp_name}.ogg', sample_rate, channels,
+                            quality, wav_filename=f'{temp_name}.wav')
+    if encoded is None:
+        # Without ffmpeg the stem is left as a WAV; unlike the mix's, nothing would ever pick it up
+        for temp_file in (f'{temp_name}.ogg', f'{temp_name}.wav'):
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        return None
+    os.replace(encoded, path)
+    return filename
+
+def export_stems(arrangement, tempo, stems_dir, sample_rate=44100, reverb='delay', fade_out=0.0,
+                 layout=MONO, track='', seed=BUILD_SEED, quality=4):
+    """Render a track's parts once, writing each as a stem, and return (mix, stems).
+
+    mix is exactly what render_arrangement produces for the same arguments.
+    stems lists {'name', 'file', 'pan', 'gain'} per part, where file is
+    relative to stems_dir and gain scales the normalized stem back to its
+    level in the mix. Raises RuntimeError if a stem cannot be encoded.
+    """
+    parts = render_parts(arrangement, tempo, sample_rate, track, seed)
+    length = max(len(samples) for _, samples, _, _ in parts)
+    mix = np.zeros((length, LAYOUT_CHANNELS[layout]), dtype=sample_dtype())
+    os.makedirs(stems_dir, exist_ok=True)
+
+    stems = []
+    for name, samples, pan, reverb_amt in parts:
+        with stage('reverb'):
+            samples = apply_track_reverb(samples, reverb_amt, sample_rate, reverb)[:length]
+        with stage('mix'):
+            stem = np.zeros_like(mix)
+            for channel, gain in enumerate(pan_gains(pan, layout)):
+                stem[:len(samples), channel] += samples * gain
+            mix += stem
+        # Fading each stem is the same as fading their sum
+        with stage('fade out'):
+            apply_fade_out(stem, fade_out, sample_rate)
+        peak = np.max(np.abs(stem))
+        stem_gain = PEAK / peak if peak > 0 else 1.0
+        stem *= stem_gain
+        with stage('encode stems'):
+            filename = write_stem(stem[:, 0] if layout == MONO else stem, stems_dir, sample_rate,
+                                  LAYOUT_CHANNELS[layout], quality)
+        if filename is None:
+            raise RuntimeError(f'could not encode the {name} stem')
+        stems.append({'name': name, 'file': filename, 'pan': pan, 'gain': float(stem_gain)})
+    del stem
+
+    with stage('mix'):
+        # Normalize to prevent clipping, as mix_tracks does
+        max_val = np.max(np.abs(mix))
+        mix_gain = PEAK / max_val if max_val > 0 else 1.0
+        mix *= mix_gain
+    for entry in stems:
+        entry['gain'] = round(float(mix_gain) / entry['gain'], 6)
+    with stage('fade out'):
+        apply_fade_out(mix, fade_out, sample_rate)
+    return (mix[:, 0] if layout == MONO else mix), stems
+
+def stems_entry(stems, length, tempo, sample_rate=44100, layout=MONO, loop=False):
+    """A track's entry in the stems manifest: the sync grid, loop points and stems.
+
+    Every stem starts at sample 0 and is length samples long; a beat is
+    beat_samples samples at this tempo, so a beat or bar boundary for
+    switching stems in and out is a multiple of it. Looped tracks loop over
+    the whole length, which ends on the last beat of the longest part.
+    """
+    beat_samples = 60.0 / tempo * sample_rate
+    return {
+        'sample_rate': sample_rate,
+        'channels': LAYOUT_CHANNELS[layout],
+        'length': length,
+        'tempo': tempo,
+        'beat_samples': beat_samples,
+        'beats': round(length / beat_samples, 3),
+        'loop': {'start': 0, 'end': length} if loop else None,
+        'stems': stems,
+    }
+
+def prune_stems(stems_dir, manifest):
+    """Delete stem files that no track in the stems manifest refers to.
+
+    This includes temporary files left by a worker that died while encoding.
+    """
+    used = {stem['file'] for entry in manifest.values() for stem in entry['stems']}
+    used.add(STEMS_MANIFEST_NAME)
+    for filename in os.listdir(stems_dir):
+        if filename not in used:
+            os.remove(os.path.join(stems_dir, filename))
+
+def stems_missing(entry, stems_dir):
+    """Return True unless entry exists and all of its stem files do."""
+    return entry is None or not all(os.path.exists(os.path.join(stems_dir, stem['file']))
+                                    for stem in entry['stems'])
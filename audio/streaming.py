@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Block-based streaming render pipeline.
+Parts, effects and the mixer are generators of fixed-size blocks that carry
+their state between blocks, so peak memory stays roughly constant no matter
+how long the track is.
+"""
+
+import numpy as np
+
+from convolution_reverb import PartitionedConvolver, room_reverb
+from generate_music import LAYOUT_CHANNELS, MONO, pan_gains, part_length, part_sounds
+from noise import BUILD_SEED, NoiseSource, seeded_voice
+from precision import sample_dtype
+from profiling import profiled_blocks
+
+BLOCK_SIZE = 4096  # Frames per block
+
+def part_blocks(part, voice, beat_duration, sample_rate=44100, block_size=BLOCK_SIZE):
+    """Yield a (note, beats) or event array part as blocks; only the last block may be short.
+
+    Each sound is added at its onset into a rolling buffer, so event arrays
+    may have gaps or overlapping sounds. A block is yielded once a later
+    onset shows no further sound can reach it, which needs the steps in
+    onset order, as part_events and compiled scores produce them.
+    """
+    pending = np.zeros(0, dtype=sample_dtype())
+    offset = 0  # Sample position of pending[0]
+    for onset, sound in part_sounds(part, voice, beat_duration, sample_rate):
+        if onset < offset:
+            raise ValueError(f'step at sample {onset} is out of onset order')
+        while onset - offset >= block_size:
+            block = pending[:block_size]
+            if len(block) < block_size:
+                block = np.pad(block, (0, block_size - len(block)))
+            yield block
+            pending = pending[block_size:]
+            offset += block_size
+        end = onset - offset + len(sound)
+        if end > len(pending):
+            pending = np.concatenate([pending, np.zeros(end - len(pending), dtype=pending.dtype)])
+        pending[onset - offset:end] += sound
+    for start in range(0, len(pending), block_size):
+        yield pending[start:start + block_size]
+
+def padded_blocks(blocks, total_length, block_size=BLOCK_SIZE):
+    """Re-chunk a block stream to block_size blocks, zero-padded to total_length."""
+    emitted = 0
+    for block in blocks:
+        size = min(block_size, total_length - emitted)
+        block = block[:size]
+        if len(block) < size:
+            block = np.pad(block, (0, size - len(block)))
+        emitted += size
+        yield block
+    while emitted < total_length:
+        size = min(block_size, total_length - emitted)
+        emitted += size
+        yield np.zeros(size, dtype=sample_dtype())
+
+def delay_reverb_blocks(blocks, sample_rate=44100, room_size=0.3, decay=0.5):
+    """Streaming equivalent of apply_reverb, truncated to the input length."""
+    delays = [int(0.029 * sample_rate), int(0.037 * sample_rate),
+              int(0.043 * sample_rate), int(0.053 * sample_rate)]
+    max_delay = max(delays)
+    history = np.zeros(max_delay, dtype=sample_dtype())
+
+    for block in blocks:
+        signal = np.concatenate([history, block])
+        reverb_block = block.copy()
+        for delay_samples in delays:
+            start = max_delay - delay_samples
+            reverb_block += (signal[start:start + len(block)] * decay) * room_size
+        history = signal[-max_delay:]
+        yield reverb_block
+
+def convolution_reverb_blocks(blocks, sample_rate=44100, wet=0.3, block_size=BLOCK_SIZE):
+    """Streaming equivalent of apply_convolution_reverb with the default hall."""
+    convolver = PartitionedConvolver(room_reverb(sample_rate=sample_rate).ir, block_size, sample_dtype())
+    for block in blocks:
+        yield block + wet * convolver.process(block)
+
+def fade_out_blocks(blocks, total_length, fade_out, sample_rate=44100):
+    """Streaming equivalent of apply_fade_out for mono or (n, channels) blocks."""
+    fade_duration = int(fade_out * sample_rate)
+    fade_start = total_length - fade_duration
+    gain = None
+    offset = 0
+    for block in blocks:
+        if 0 < fade_duration < total_length and offset + len(block) > fade_start:
+            if gain is None:
+                # The ramp apply_fade_out uses, so streamed and whole-track fades match
+                gain = np.linspace(1, 0, fade_duration, dtype=block.dtype)
+            start = max(fade_start - offset, 0)
+            block = block.copy()
+            block[start:] *= gain[offset + start - fade_start:offset + len(block) - fade_start].reshape(
+                (-1,) + (1,) * (block.ndim - 1))
+        offset += len(block)
+        yield block
+
+def stream_arrangement(arrangement, tempo, sample_rate=44100, block_size=BLOCK_SIZE,
+                       reverb='delay', fade_out=0.0, peak=None, layout=MONO, track='', seed=BUILD_SEED):
+    """Yield normalized mono (n,) or stereo (n, 2) blocks for an arrangement.
+
+    This is the streaming counterpart of render_arrangement. Peak
+    normalization needs the peak of the whole mix; unless it is given, a
+    first pass measures it without keeping any audio, so memory stays
+    bounded at the cost of rendering twice. Both passes seed each part's
+    noise from seed, track and the part name, as render_arrangement does,
+    so they render the same samples. The generator returns the peak of the
+    mix it rendered, which a later render of the same inputs can be given.
+    A smaller peak than that leaves samples above 1.0 for the caller to clip.
+    """
+    beat_duration = 60.0 / tempo
+    total_length = max(part_length(part, beat_duration, sample_rate)
+                       for _, part, _, _, _ in arrangement)
+
+    n_channels = LAYOUT_CHANNELS[layout]
+    
+    def mix_blocks():
+        streams = []
+        for name, part, voice, pan, reverb_amt in arrangement:
+            voice = seeded_voice(voice, NoiseSource(seed, track, name))
+            blocks = padded_blocks(part_blocks(part, voice, beat_duration, sample_rate, block_size),
+                                   total_length, block_size)
+            blocks = profiled_blocks(f'render {name}', blocks)
+            if reverb_amt > 0 and reverb == 'convolution':
+                blocks = convolution_reverb_blocks(blocks, sample_rate, reverb_amt, block_size)
+            elif reverb_amt > 0:
+                blocks = delay_reverb_blocks(blocks, sample_rate, room_size=reverb_amt)
+            streams.append((profiled_blocks('reverb', blocks), pan_gains(pan, layout)))
+
+        for columns in zip(*(blocks for blocks, _ in streams)):
+            mix = np.zeros((len(columns[0]), n_channels), dtype=sample_dtype())
+            for block, (_, gains) in zip(columns, streams):
+                for channel, gain in enumerate(gains):
+                    mix[:, channel] += block * gain
+            yield mix
+
+    if peak is None:
+        print("Measuring mix peak...")
+        peak = max(np.max(np.abs(mix)) for mix in profiled_blocks('mix', mix_blocks()))
+
+    measured = 0.0
+    def normalized_blocks():
+        nonlocal measured
+        for mix in profiled_blocks('mix', mix_blocks()):
+            measured = max(measured, float(np.max(np.abs(mix))))
+            if peak > 0:
+                mix *= 0.9 / peak
+            yield mix[:, 0] if layout == MONO else mix
+
+    yield from profiled_blocks('fade out', fade_out_blocks(profiled_blocks('mix', normalized_blocks()),
+                                                          total_length, fade_out, sample_rate))
+    return measured
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Float32 pipeline validation.
+Renders each orchestral track in float64 and in float32 with the same noise
+seed, checks that the 16-bit output differs by at most one LSB, and reports
+render time and peak traced memory for both.
+
+Usage: python audio/validate_precision.py [--tolerance 1] [track ...]
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AUDIO_DIR)
+
+from build_soundtrack import TRACKS
+from generate_music import render_arrangement
+from note_cache import NOTE_CACHE
+from noise import BUILD_SEED
+from precision import sample_dtype, set_sample_dtype
+
+def render_track(name, dtype, sample_rate=44100, seed=BUILD_SEED):
+    """Render a track in dtype; returns (pcm16 samples, seconds, peak bytes)."""
+    previous = sample_dtype()
+    set_sample_dtype(dtype)
+    NOTE_CACHE.clear()  # Rendered notes must not leak between precisions
+    try:
+        module = importlib.import_module(TRACKS[name])
+        parts = module.arrangement()
+        tracemalloc.start()
+        start = time.perf_counter()
+        audio = render_arrangement(parts, module.TEMPO, sample_rate,
+                                   fade_out=getattr(module, 'FADE_OUT', 0.0), track=name, seed=seed)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        set_sample_dtype(previous)
+        NOTE_CACHE.clear()
+    return np.int16(audio * 32767), seconds, peak
+
+def validate_track(name, tolerance=1):
+    """Compare float32 against float64 output; returns True if within tolerance LSBs."""
+    reference, reference_seconds, reference_peak = render_track(name, 'float64')
+    result, seconds, peak = render_track(name, 'float32')
+
+    if len(result) != len(reference):
+        print(f"{name:<10} ✗ length {len(result)} != {len(reference)}")
+        return False
+    error = np.abs(result.astype(np.int32) - reference).max(initial=0)
+    ok = error <= tolerance
+    print(f"{name:<10} {'✓' if ok else '✗'} max error {error} LSB   "
+          f"time {reference_seconds:6.2f}s -> {seconds:6.2f}s   "
+          f"peak {reference_peak / 2**20:7.1f} MB -> {peak / 2**20:7.1f} MB")
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the float32 pipeline against float64.')
+    parser.add_argument('tracks', nargs='*', metavar='track',
+                        help=f"tracks to check (default: all of {', '.join(TRACKS)})")
+    parser.add_argument('-t', '--tolerance', type=int, default=1,
+                        help='allowed difference in 16-bit LSBs (default: 1)')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.tracks if name not in TRACKS]
+    if unknown:
+        parser.error(f"unknown track(s): {', '.join(unknown)}")
+
+    failed = [name for name in args.tracks or list(TRACKS)
+              if not validate_track(name, args.tolerance)]
+    if failed:
+        print(f"✗ float32 output differs by more than {args.tolerance} LSB: {', '.join(failed)}")
+        return 1
+    print("✓ float32 output matches float64")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Band-limited wavetable oscillators for the instrument voices.
+Each timbre is a single-cycle table built from its harmonic spectrum; notes
+are rendered by table lookup with linear interpolation instead of one
+np.sin call per partial.
+"""
+
+import numpy as np
+
+MIN_TABLE_SIZE = 4096
+OVERSAMPLE = 16  # Table samples per cycle of the highest partial
+
+class Wavetable:
+    """Single-cycle wavetable built from (harmonic, amplitude) partials.
+
+    Partials above Nyquist are dropped per note, so every rendered note is
+    band-limited. Tables are built lazily and cached per harmonic limit.
+    """
+
+    def __init__(self, name, partials):
+        self.name = name
+        self.partials = sorted(partials)
+        self._tables = {}
+
+    def table(self, max_harmonic, dtype=np.float64):
+        """Return (table, delta) holding the partials up to max_harmonic, in dtype."""
+        partials = [(h, a) for h, a in self.partials if h <= max_harmonic]
+        key = (len(partials), np.dtype(dtype).name)
+        if key not in self._tables:
+            highest = partials[-1][0] if partials else 1
+            size = max(MIN_TABLE_SIZE, 1 << int(np.ceil(np.log2(highest * OVERSAMPLE))))
+            phase = 2 * np.pi * np.arange(size + 1) / size
+            table = np.zeros(size + 1)
+            for harmonic, amplitude in partials:
+                table += amplitude * np.sin(harmonic * phase)
+            # delta[i] = table[i + 1] - table[i] for linear interpolation
+            self._tables[key] = (table[:-1].astype(dtype), np.diff(table).astype(dtype))
+        return self._tables[key]
+
+    def render(self, cycles, base_frequency, sample_rate=44100):
+        """Look up the table at a non-negative phase given in cycles of base_frequency."""
+        max_harmonic = sample_rate / 2 / base_frequency
+        table, delta = self.table(max_harmonic, cycles.dtype)
+        size = len(table)
+
+        position = cycles * size
+        index = position.astype(np.intp)
+        position -= index  # Fractional part
+        index &= size - 1  # Table sizes are powers of two
+        position *= delta[index]
+        position += table[index]
+        return position
+
+def _sawtooth(first_harmonic, step, amplitude, count=1024):
+    """Partials of a rising sawtooth of the given peak amplitude."""
+    # 2 * frac(x) - 1 == -(2 / pi) * sum(sin(2 pi k x) / k)
+    return [(first_harmonic + step * (k - 1), -amplitude * 2 / (np.pi * k))
+            for k in range(1, count + 1)]
+
+def _merge(*partial_lists):
+    """Sum partial lists that share harmonic numbers."""
+    merged = {}
+    for partials in partial_lists:
+        for harmonic, amplitude in partials:
+            merged[harmonic] = merged.get(harmonic, 0.0) + amplitude
+    return list(merged.items())
+
+# Timbres. Voices whose partials include half-integer multiples of the
+# note frequency (sin(3 pi f t) etc.) use a cycle at half the note
+# frequency, so harmonic n of the table sounds at n/2 * f.
+SINE = Wavetable('sine', [(1, 1.0)])
+
+# generate_tone: fundamental, 2nd and 3rd harmonics (cycle = f)
+TONE = Wavetable('tone', [(1, 1.0), (2, 0.3), (3, 0.1)])
+
+# Bass: fundamental, sub-harmonic and 2nd harmonic (cycle = f / 2)
+BASS = Wavetable('bass', [(2, 1.0), (1, 0.2), (4, 0.1)])
+
+# Brass: strong odd partials 1, 1.5, 2.5, 3.5, 4.5 x f (cycle = f / 2)
+BRASS = Wavetable('brass', [(2, 1.0), (3, 0.5), (5, 0.3), (7, 0.2), (9, 0.1)])
+
+# Piano: fundamental plus four overtones (cycle = f)
+PIANO = Wavetable('piano', [(1, 1.0), (2, 0.4), (3, 0.2), (4, 0.1), (5, 0.05)])
+
+# Strings: band-limited sawtooth plus 2f and 1.5f partials (cycle = f / 2).
+# The vibrato fundamental is rendered separately from SINE.
+STRING = Wavetable('string', _merge(_sawtooth(2, 2, 0.6), [(4, 0.1), (3, 0.1)]))
+
+# Choir: formant mix of fundamental, 2nd and 3rd harmonics per voice (cycle = f)
+CHOIR = Wavetable('choir', [(1, 1.0), (2, 0.3), (3, 0.2)])
@@ -6,11 +6,24 @@
 
 import os
 import re
+import sys
 import numpy as np
 import subprocess
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union
 import json
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio'))
+import abc_parser
+from cli import track_arguments
+from compiled_score import COMPILER_SOURCES, CompiledScore, cached_scores, compile_events, source_digest
+from convolution_reverb import room_reverb
+from encoder import ffmpeg_available, pipe_to_ogg
+from envelope import apply_envelope
+from precision import cycles, sample_dtype
+from profiling import StageProfiler, profile_stages, stage
+from score import MIDI_FREQUENCIES, event_frequencies, tune_durations, tune_events
+from sections import reused_sounds
+
 class HighQualityMusicGenerator:
     """高品质音乐生成器"""
     
@@ -33,120 +46,27 @@ class HighQualityMusicGenerator:
         with open(filename, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # 分割成单独的曲子
-        tunes = re.split(r'\n(?=X:\d+)', content)
-        parsed_tunes = []
-        
-        for tune in tunes:
-            if not tune.strip() or not tune.startswith('X:'):
-                continue
-                
-            tune_data = self.parse_single_tune(tune)
-            if tune_data:
-                parsed_tunes.append(tune_data)
-        
-        return parsed_tunes
+        # 单遍扫描：反复记号、和弦、连音线、休止符、多声部(V:)都在一次分词中处理
+        return abc_parser.parse_abc(content)
     
     def parse_single_tune(self, abc_text: str) -> Dict:
-        """解析单个ABC曲谱"""
-        lines = abc_text.strip().split('\n')
-        tune_data = {
-            'notes': [],
-            'tempo': 120,
-            'time_sig': (4, 4),
-            'key': 'C',
-            'title': 'Untitled'
-        }
-        
-        default_note_length = 1/8
-        
-        for line in lines:
-            line = line.strip()
-            
-            # 解析头部信息
-            if line.startswith('X:'):
-                tune_data['index'] = int(line[2:].strip())
-            elif line.startswith('T:'):
-                tune_data['title'] = line[2:].strip()
-            elif line.startswith('M:'):
-                parts = line[2:].strip().split('/')
-                if len(parts) == 2:
-                    tune_data['time_sig'] = (int(parts[0]), int(parts[1]))
-            elif line.startswith('L:'):
-                parts = line[2:].strip().split('/')
-                if len(parts) == 2:
-                    default_note_length = int(parts[0]) / int(parts[1])
-            elif line.startswith('Q:'):
-                # Q:1/4=120 表示四分音符=120 BPM
-                match = re.search(r'1/4=(\d+)', line)
-                if match:
-                    tune_data['tempo'] = int(match.group(1))
-            elif line.startswith('K:'):
-                tune_data['key'] = line[2:].strip()
-            elif line.startswith('V:'):
-                continue  # 忽略声部标记
-            elif '|' in line or any(c in line for c in 'ABCDEFGabcdefg'):
-                # 解析音符行
-                notes = self.parse_note_line(line, default_note_length)
-                tune_data['notes'].extend(notes)
-        
-        return tune_data
+        """解析单个ABC曲谱（各声部的音高、起点和时长均以全音符为单位）"""
+        return abc_parser.parse_tune(abc_text)
     
-    def parse_note_line(self, line: str, default_length: float) -> List[Dict]:
-        """解析音符行"""
-        notes = []
-        
-        # 移除小节线和装饰
-        line = re.sub(r'[|:\[\]"]', ' ', line)
-        line = re.sub(r'"[^"]*"', '', line)  # 移除和弦标记
-        
-        # 匹配音符模式
-        note_pattern = r"([_^=]?)([A-Ga-g])([,']*)(\d*/?\.?\d*)"
-        matches = re.finditer(note_pattern, line)
-        
-        for match in matches:
-            accidental, pitch, octave_mod, duration = match.groups()
-            
-            # 确定音高
-            if pitch.isupper():
-                octave = 4  # 大写字母表示低八度
-            else:
-                octave = 5  # 小写字母表示高八度
-                pitch = pitch.upper()
-            
-            # 处理八度修饰符
-            if ',' in octave_mod:
-                octave -= octave_mod.count(',')
-            if "'" in octave_mod:
-                octave += octave_mod.count("'")
-            
-            # 处理时值
-            if duration:
-                if '/' in duration:
-                    parts = duration.split('/')
-                    if len(parts) == 2 and parts[1]:
-                        note_length = default_length * (int(parts[0]) if parts[0] else 1) / int(parts[1])
-                    else:
-                        note_length = default_length / 2
-                elif duration.isdigit():
-                    note_length = default_length * int(duration)
-                else:
-                    note_length = default_length
-            else:
-                note_length = default_length
-            
-            # 计算MIDI音高
-            midi_note = self.note_to_midi_number(pitch, octave, accidental)
-            
-            notes.append({
-                'pitch': pitch,
-                'midi': midi_note,
-                'duration': note_length,
-                'octave': octave,
-                'accidental': accidental
-            })
-        
-        return notes
+    def load_tunes(self, filename: str) -> List[CompiledScore]:
+        """加载编译后的曲谱（ABC文件和解析器未改动时直接内存映射磁盘缓存）"""
+        digest = source_digest([filename, os.path.abspath(__file__), abc_parser.__file__] + COMPILER_SOURCES,
+                               sample_rate=self.sample_rate)
+        return cached_scores(digest, lambda: [self.compile_tune(tune)
+                                              for tune in self.parse_abc_file(filename)])
+    
+    def compile_tune(self, tune_data: Dict) -> CompiledScore:
+        """把解析后的曲子编译为事件数组（含每个音符的精确时长）"""
+        events = compile_events(tune_events(tune_data, self.sample_rate), tune_durations(tune_data))
+        # 每个V:声部一个声部编号，事件已按声部排序
+        voices = [voice['id'] for voice in tune_data.get('voices', [{'id': '1'}])]
+        return CompiledScore(events, voices, tune_data['tempo'], tune_data.get('time_sig', (4, 4)),
+                             tune_data.get('title', 'Untitled'), tune_data.get('key', 'C'))
     
     def note_to_midi_number(self, pitch: str, octave: int, accidental: str = '') -> int:
         """音符转MIDI音高编号"""
@@ -178,13 +98,14 @@ class HighQualityMusicGenerator:
             harmonics = [1.0, 0.5, 0.3, 0.2, 0.1, 0.05]
         
         t = np.linspace(0, duration, int(duration * self.sample_rate))
-        signal = np.zeros_like(t)
+        phase = cycles(frequency, t)  # 基频相位（float64计算后再转换精度）
+        signal = np.zeros_like(phase)
         
         for i, harmonic_amp in enumerate(harmonics):
             harmonic_freq = frequency * (i + 1)
             if harmonic_freq > self.sample_rate / 2:  # Nyquist频率
                 break
-            signal += harmonic_amp * np.sin(2 * np.pi * harmonic_freq * t)
+            signal += harmonic_amp * np.sin(2 * np.pi * (i + 1) * phase)
         
         # 归一化
         max_val = np.max(np.abs(signal))
@@ -196,41 +117,8 @@ class HighQualityMusicGenerator:
     def apply_adsr_envelope(self, samples: np.ndarray, 
                            attack: float = 0.05, decay: float = 0.1,
                            sustain: float = 0.7, release: float = 0.2) -> np.ndarray:
-        """应用ADSR包络"""
-        total_samples = len(samples)
-        sample_rate = self.sample_rate
-        
-        # 计算各阶段采样数
-        attack_samples = min(int(attack * sample_rate), total_samples // 4)
-        decay_samples = min(int(decay * sample_rate), total_samples // 4)
-        release_samples = min(int(release * sample_rate), total_samples // 3)
-        sustain_samples = max(0, total_samples - attack_samples - decay_samples - release_samples)
-        
-        envelope = np.ones(total_samples)
-        
-        # Attack阶段
-        if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
-        
-        # Decay阶段
-        if decay_samples > 0:
-            start = attack_samples
-            end = start + decay_samples
-            if end <= total_samples:
-                envelope[start:end] = np.linspace(1, sustain, decay_samples)
-        
-        # Sustain阶段
-        if sustain_samples > 0:
-            start = attack_samples + decay_samples
-            end = start + sustain_samples
-            if end <= total_samples:
-                envelope[start:end] = sustain
-        
-        # Release阶段
-        if release_samples > 0 and total_samples > release_samples:
-            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples)
-        
-        return samples * envelope
+        """应用ADSR包络（原地相乘）"""
+        return apply_envelope(samples, self.sample_rate, attack, decay, sustain, release)
     
     def add_reverb(self, signal: np.ndarray, room_size: float = 0.5,
                    damping: float = 0.5) -> np.ndarray:
@@ -239,7 +127,7 @@ class HighQualityMusicGenerator:
         delay_samples = int(0.05 * self.sample_rate * room_size)
         decay = 1 - damping
         
-        reverb_signal = np.zeros(len(signal) + delay_samples * 3)
+        reverb_signal = np.zeros(len(signal) + delay_samples * 3, dtype=signal.dtype)
         reverb_signal[:len(signal)] = signal
         
         # 添加多个延迟回声
@@ -252,21 +140,22 @@ class HighQualityMusicGenerator:
         # 截断到原始长度附近
         return reverb_signal[:len(signal) + delay_samples]
     
-    def synthesize_tune(self, tune_data: Dict, instrument: str = 'piano') -> np.ndarray:
-        """合成完整曲子"""
-        tempo = tune_data['tempo']
-        notes = tune_data['notes']
-        
-        # 每拍的秒数
-        beat_duration = 60.0 / tempo
-        
-        # 计算总时长
-        total_duration = sum(note['duration'] * 4 * beat_duration for note in notes)
+    def synthesize_tune(self, tune_data: Union[CompiledScore, Dict], instrument: str = 'piano',
+                        reverb: str = 'delay') -> np.ndarray:
+        """合成完整曲子（reverb: 'delay' 延迟混响, 'convolution' 卷积混响）"""
+        # 列式事件：起点、时长和频率一次性向量化计算
+        if isinstance(tune_data, dict):
+            tune_data = self.compile_tune(tune_data)
+        events = tune_data.events
+        durations = events['duration']
+        frequencies = event_frequencies(events, MIDI_FREQUENCIES)
+        
+        # 计算总时长（多声部时取最晚结束的音符）
+        total_duration = float(np.max(events['onset'] / self.sample_rate + durations, initial=0.0))
         
         # 预分配音频缓冲
         total_samples = int((total_duration + 2) * self.sample_rate)  # 额外2秒用于混响
-        left_channel = np.zeros(total_samples)
-        right_channel = np.zeros(total_samples)
+        channels = np.zeros((2, total_samples), dtype=sample_dtype())
         
         # 设置音色参数
         if instrument == 'piano':
@@ -282,46 +171,48 @@ class HighQualityMusicGenerator:
             harmonics = [1.0, 0.7, 0.5, 0.3]
             attack, decay, sustain, release = 0.01, 0.05, 0.5, 0.1
         
-        # 合成每个音符
-        current_time = 0
-        for i, note in enumerate(notes):
-            frequency = self.midi_to_frequency(note['midi'])
-            duration = note['duration'] * 4 * beat_duration  # 转换为秒
-            
+        def render_note(i):
             # 生成音符
-            tone = self.generate_complex_tone(frequency, duration, harmonics)
+            tone = self.generate_complex_tone(float(frequencies[i]), float(durations[i]), harmonics)
             tone = self.apply_adsr_envelope(tone, attack, decay, sustain, release)
             
-            # 立体声定位（轻微左右摆动）
+            # 立体声定位（轻微左右摆动，每16个音符一个周期）
             pan = 0.5 + 0.3 * np.sin(2 * np.pi * i / 16)
-            left_gain = np.sqrt(1 - pan)
-            right_gain = np.sqrt(pan)
-            
-            # 添加到音轨
-            start_sample = int(current_time * self.sample_rate)
-            end_sample = min(start_sample + len(tone), total_samples)
-            actual_length = end_sample - start_sample
-            
-            if actual_length > 0:
-                left_channel[start_sample:end_sample] += tone[:actual_length] * left_gain
-                right_channel[start_sample:end_sample] += tone[:actual_length] * right_gain
-            
-            current_time += duration
+            # 转为Python浮点数，避免float32音轨被提升为float64
+            return np.stack([tone * float(np.sqrt(1 - pan)), tone * float(np.sqrt(pan))])
+        
+        with stage('render'):
+            # 频率、时长和声像相同的音符听起来一样，间隔也相同的重复乐段
+            # （如展开的|: :|）只合成一次，再叠加到每次出现的位置
+            keys = zip(frequencies.tolist(), durations.tolist(), [i % 16 for i in range(len(events))])
+            for start_sample, sound in reused_sounds(list(keys), events['onset'], render_note):
+                # 添加到音轨
+                end_sample = min(start_sample + sound.shape[-1], total_samples)
+                if end_sample > start_sample:
+                    channels[:, start_sample:end_sample] += sound[:, :end_sample - start_sample]
+        left_channel, right_channel = channels
         
         # 添加混响
-        left_channel = self.add_reverb(left_channel, room_size=0.3)
-        right_channel = self.add_reverb(right_channel, room_size=0.3)
-        
-        # 合并声道
-        stereo = np.stack([left_channel, right_channel], axis=1)
+        with stage('reverb'):
+            if reverb == 'convolution':
+                # 左右声道使用不同种子的脉冲响应，得到去相关的立体声尾音
+                left_channel = room_reverb(0.3, 0.5, self.sample_rate, seed=0).apply(left_channel, wet=0.3)
+                right_channel = room_reverb(0.3, 0.5, self.sample_rate, seed=1).apply(right_channel, wet=0.3)
+            else:
+                left_channel = self.add_reverb(left_channel, room_size=0.3)
+                right_channel = self.add_reverb(right_channel, room_size=0.3)
         
-        # 归一化
-        max_val = np.max(np.abs(stereo))
-        if max_val > 0:
-            stereo = stereo / max_val * 0.8
+        with stage('mix'):
+            # 合并声道
+            stereo = np.stack([left_channel, right_channel], axis=1)
+            
+            # 归一化
+            max_val = np.max(np.abs(stereo))
+            if max_val > 0:
+                stereo = stereo / max_val * 0.8
         
         # 截断到实际长度
-        actual_samples = int(current_time * self.sample_rate)
+        actual_samples = int(total_duration * self.sample_rate)
         return stereo[:actual_samples]
     
     def save_as_wav(self, audio_data: np.ndarray, filename: str):
@@ -359,13 +250,29 @@ class HighQualityMusicGenerator:
             print("未找到ffmpeg，保留WAV格式")
             return False
     
-    def generate_all_music(self):
-        """生成所有音乐"""
+    def encode_to_ogg(self, audio_data: np.ndarray, ogg_file: str, quality: int = 6) -> bool:
+        """将PCM数据通过管道直接送入ffmpeg编码为OGG，不写临时WAV文件"""
+        if not ffmpeg_available():
+            return False
+        try:
+            return pipe_to_ogg([audio_data], ogg_file, self.sample_rate,
+                               channels=self.channels, quality=quality)
+        except OSError as e:
+            print(f"无法启动ffmpeg: {e}")
+            return False
+    
+    def generate_all_music(self, reverb: str = 'delay', profile: bool = False):
+        """生成所有音乐（profile: 打印各阶段耗时与峰值内存，并为每首曲子写出JSON报告）"""
         # 创建输出目录
         os.makedirs('audio/hq', exist_ok=True)
         
         # 解析ABC文件
-        tunes = self.parse_abc_file('music_scores.abc')
+        parse_profiler = StageProfiler() if profile else None
+        with profile_stages(parse_profiler), stage('parse'):
+            tunes = self.load_tunes('music_scores.abc')
+        if parse_profiler:
+            parse_profiler.print_report('music_scores.abc')
+            parse_profiler.save('audio/hq/music_scores.profile.json', 'music_scores.abc')
         
         # 音色映射
         instrument_map = {
@@ -384,7 +291,7 @@ class HighQualityMusicGenerator:
         generated_files = []
         
         for tune in tunes:
-            title = tune['title']
+            title = tune.title
             # 简化文件名
             filename_base = title.lower().replace(' - ', '_').replace(' ', '_')
             filename_base = re.sub(r'[^a-z0-9_]', '', filename_base)
@@ -398,16 +305,39 @@ class HighQualityMusicGenerator:
             
             print(f"生成: {title} (音色: {instrument})")
             
-            # 合成音频
-            audio = self.synthesize_tune(tune, instrument)
-            
-            # 保存WAV
             wav_file = f'audio/hq/{filename_base}.wav'
-            self.save_as_wav(audio, wav_file)
-            
-            # 转换为OGG
             ogg_file = f'audio/hq/{filename_base}.ogg'
-            if self.convert_to_ogg(wav_file, ogg_file):
+            
+            profiler = StageProfiler() if profile else None
+            with profile_stages(profiler):
+                # 合成音频
+                audio = self.synthesize_tune(tune, instrument, reverb=reverb)
+                
+                # 直接编码为OGG（管道输入，不写临时WAV文件）
+                with stage('ffmpeg'):
+                    encoded = self.encode_to_ogg(audio, ogg_file)
+                
+                # 回退：保存WAV后再转换
+                if not encoded:
+                    with stage('write WAV'):
+                        self.save_as_wav(audio, wav_file)
+                    with stage('ffmpeg'):
+                        converted = self.convert_to_ogg(wav_file, ogg_file)
+            
+            if profiler:
+                profiler.print_report(title)
+                profiler.save(f'audio/hq/{filename_base}.profile.json', title)
+            
+            if encoded:
+                print(f"  ✓ 已生成OGG: {ogg_file}")
+                generated_files.append({
+                    'title': title,
+                    'file': ogg_file,
+                    'format': 'audio/ogg'
+                })
+                continue
+            
+            if converted:
                 print(f"  ✓ 已生成OGG: {ogg_file}")
                 generated_files.append({
                     'title': title,
@@ -433,12 +363,14 @@ class HighQualityMusicGenerator:
 
 
 def main():
+    args = track_arguments('从ABC记谱法生成高质量OGG音频文件', stream=False, layout=False)
+    
     print("=" * 50)
     print("高品质游戏音乐生成器")
     print("=" * 50)
     
     generator = HighQualityMusicGenerator()
-    generator.generate_all_music()
+    generator.generate_all_music(reverb=args.reverb, profile=args.profile)
 
 
 if __name__ == '__main__':
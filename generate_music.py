@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 import json
 import base64
 import numpy as np
@@ -12,6 +13,9 @@ from typing import Dict, List, Tuple
 import wave
 import struct
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio'))
+from envelope import apply_envelope
+
 class MusicGenerator:
     """ABC记谱法音乐生成器"""
     
@@ -195,55 +199,11 @@ class MusicGenerator:
     
     def apply_envelope(self, samples: np.ndarray, attack=0.01, decay=0.05, 
                        sustain=0.7, release=0.1) -> np.ndarray:
-        """应用ADSR包络"""
-        total_samples = len(samples)
-        sample_rate = self.sample_rate
-        
-        attack_samples = min(int(attack * sample_rate), total_samples // 4)
-        decay_samples = min(int(decay * sample_rate), total_samples // 4)
-        release_samples = min(int(release * sample_rate), total_samples // 4)
-        sustain_samples = total_samples - attack_samples - decay_samples - release_samples
-        
-        if sustain_samples < 0:
-            # 对于非常短的音符，按比例缩放
-            total = attack_samples + decay_samples + release_samples
-            if total > 0:
-                scale = total_samples / total
-                attack_samples = int(attack_samples * scale)
-                decay_samples = int(decay_samples * scale)
-                release_samples = total_samples - attack_samples - decay_samples
-                sustain_samples = 0
-        
-        envelope = np.ones(total_samples)
-        current_pos = 0
-        
-        # Attack
-        if attack_samples > 0 and current_pos < total_samples:
-            end_pos = min(current_pos + attack_samples, total_samples)
-            envelope[current_pos:end_pos] = np.linspace(0, 1, end_pos - current_pos)
-            current_pos = end_pos
-        
-        # Decay
-        if decay_samples > 0 and current_pos < total_samples:
-            end_pos = min(current_pos + decay_samples, total_samples)
-            envelope[current_pos:end_pos] = np.linspace(1, sustain, end_pos - current_pos)
-            current_pos = end_pos
-        
-        # Sustain
-        if sustain_samples > 0 and current_pos < total_samples:
-            end_pos = min(current_pos + sustain_samples, total_samples)
-            envelope[current_pos:end_pos] = sustain
-            current_pos = end_pos
-        
-        # Release
-        if release_samples > 0 and current_pos < total_samples:
-            end_pos = total_samples
-            envelope[current_pos:end_pos] = np.linspace(sustain, 0, end_pos - current_pos)
-        
-        return samples * envelope
+        """应用ADSR包络（使用共享的缓存包络，原地相乘）"""
+        return apply_envelope(samples, self.sample_rate, attack, decay, sustain, release)
     
     def synthesize_track(self, template_name: str) -> np.ndarray:
-        """合成音轨"""
+        """合成音轨（循环音乐只合成一遍，循环点即整段音频的首尾）"""
         template = self.music_templates[template_name]
         notes = template['notes']
         tempo = template['tempo']
@@ -254,48 +214,48 @@ class MusicGenerator:
         # 计算总时长
         total_duration = sum(note['duration'] for note in notes) * seconds_per_beat
         
-        # 如果是循环音乐，生成两个循环
-        loops = 2 if template['loop'] else 1
-        
         # 预分配音频缓冲区
-        total_samples = int(total_duration * self.sample_rate * loops)
+        total_samples = int(total_duration * self.sample_rate)
         audio_buffer = np.zeros(total_samples)
         
         # 合成每个音符
         current_sample = 0
-        for loop in range(loops):
-            for note in notes:
-                # 获取频率
-                note_name = f"{note['pitch']}{note['octave']}"
-                if note['pitch'].startswith('_'):
-                    note_name = f"_{note['pitch'][1]}{note['octave']}"
-                
-                frequency = self.note_frequencies.get(note_name, 440)
-                duration = note['duration'] * seconds_per_beat
-                
-                # 生成方波
-                wave = self.generate_square_wave(frequency, duration)
-                
-                # 应用包络
-                if template_name in ['powerup', 'coin']:
-                    # 音效使用快速包络
-                    wave = self.apply_envelope(wave, attack=0.001, decay=0.01, 
-                                              sustain=0.5, release=0.05)
-                else:
-                    # 音乐使用平滑包络
-                    wave = self.apply_envelope(wave, attack=0.01, decay=0.05, 
-                                              sustain=0.7, release=0.1)
-                
-                # 添加到缓冲区
-                end_sample = min(current_sample + len(wave), total_samples)
-                audio_buffer[current_sample:end_sample] = wave[:end_sample - current_sample]
-                current_sample = end_sample
+        for note in notes:
+            # 获取频率
+            note_name = f"{note['pitch']}{note['octave']}"
+            if note['pitch'].startswith('_'):
+                note_name = f"_{note['pitch'][1]}{note['octave']}"
+            
+            frequency = self.note_frequencies.get(note_name, 440)
+            duration = note['duration'] * seconds_per_beat
+            
+            # 生成方波
+            wave = self.generate_square_wave(frequency, duration)
+            
+            # 应用包络
+            if template_name in ['powerup', 'coin']:
+                # 音效使用快速包络
+                wave = self.apply_envelope(wave, attack=0.001, decay=0.01, 
+                                          sustain=0.5, release=0.05)
+            else:
+                # 音乐使用平滑包络
+                wave = self.apply_envelope(wave, attack=0.01, decay=0.05, 
+                                          sustain=0.7, release=0.1)
+            
+            # 添加到缓冲区
+            end_sample = min(current_sample + len(wave), total_samples)
+            audio_buffer[current_sample:end_sample] = wave[:end_sample - current_sample]
+            current_sample = end_sample
         
         # 添加简单混响效果
         if template_name not in ['powerup', 'coin']:
             delay_samples = int(0.05 * self.sample_rate)  # 50ms延迟
-            delayed = np.zeros_like(audio_buffer)
-            delayed[delay_samples:] = audio_buffer[:-delay_samples] * 0.3
+            if template['loop']:
+                # 循环音乐：结尾的混响尾音折回开头，循环接缝处与连续播放一致
+                delayed = np.roll(audio_buffer, delay_samples) * 0.3
+            else:
+                delayed = np.zeros_like(audio_buffer)
+                delayed[delay_samples:] = audio_buffer[:-delay_samples] * 0.3
             audio_buffer += delayed
         
         # 归一化
@@ -347,7 +307,7 @@ class MusicGenerator:
             audio_base64 = self.wav_to_ogg_base64(wav_filename)
             
             # 添加到数据列表
-            music_data.append({
+            entry = {
                 'id': template_name,
                 'name': template['name'],
                 'tempo': template['tempo'],
@@ -355,8 +315,14 @@ class MusicGenerator:
                 'duration': template['duration'],
                 'format': 'audio/wav',
                 'data': f'data:audio/wav;base64,{audio_base64}',
-                'file': wav_filename
-            })
+                'file': wav_filename,
+                'sample_rate': self.sample_rate
+            }
+            if template['loop']:
+                # 采样精度的循环点：文件只含一遍循环
+                entry['loop_start'] = 0
+                entry['loop_end'] = len(audio)
+            music_data.append(entry)
             
             print(f"  ✓ 已生成: {wav_filename}")
         